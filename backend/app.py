@@ -14,12 +14,15 @@
 # FastAPI Imports
 from fastapi import FastAPI, WebSocket, HTTPException, Request, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
 
 # Celery import
-from worker import train_model
+from worker import train_model, train_model_batch, train_model_distributed
 from celery.result import AsyncResult
+from celery.contrib.abortable import AbortableAsyncResult
+from celery.states import READY_STATES, PENDING, STARTED
 from contextlib import asynccontextmanager
 
 # uvicorn imports
@@ -31,7 +34,24 @@ import asyncio
 import json
 import signal
 import sys
-from models import TrainModelRequest, CancelTaskRequest
+import time
+import uuid
+from models import TrainModelRequest, BatchTrainModelRequest, DistributedTrainModelRequest, SweepRequest, CancelTaskRequest, ResumeTaskRequest, PredictRequest
+from connections import ConnectionManager
+from listener import RedisListener, supervise
+from result_cache import ResultCache, cache_key, replay_updates
+from events import FINAL_STATUSES, is_event_id, read_events, append_event_async
+from checkpoints import read_checkpoint_meta
+from warmup import startup_metrics
+from metrics import QUEUE_DEPTH, app_metrics
+from prometheus_client import CONTENT_TYPE_LATEST
+from scheduling import Scheduler, TASK_TTL, estimate_cost, lane_for
+from estimator import estimate, combine, over_budget
+import sweep
+from model_store import CLASS_NAMES, load_model
+from serving import ModelCache
+import numpy as np
+from config import REDIS_URL, TRAIN_QUEUE
 import logging
 # import structlog
 
@@ -77,6 +97,29 @@ logger = logging.getLogger(__name__)
 # Define a global variable redis_client that will be used to connect to the Redis server.
 redis_client = None
 
+# Registry of every open WebSocket connection and the task ids each one is subscribed to. See
+# connections.py.
+manager = ConnectionManager()
+
+# Consumer of the worker's updates on the per-task 'model_updates:<task_id>' channels, created in
+# lifespan() once the Redis client exists.
+listener = None
+
+# Cache of finished training results keyed on the request's hyperparameters, created in lifespan().
+# See result_cache.py.
+result_cache = None
+
+# Routes tasks to the regular or fast-lane queue, enforces the per-client task limit and estimates
+# start times, created in lifespan(). See scheduling.py.
+scheduler = None
+
+# Trained models loaded for /predict, least recently used first out. See serving.py.
+model_cache = ModelCache(load_model)
+
+# Bookkeeping tasks started by handle_update(). The event loop only keeps weak references to tasks, so
+# they are held here until they are done.
+background_tasks = set()
+
 # Define an asynchronous context manager lifespan() that connects to the Redis server when the FastAPI
 # application starts up and closes the connection when the application shuts down. The context manager
 # is used to manage the lifecycle of the Redis connection, ensuring that the connection is established
@@ -86,16 +129,25 @@ redis_client = None
 # redis server is also stateless, thus not requiring the same shutdown procedures as the redis client.
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    listener_task = None
     try:
-        global redis_client
-        redis_client = aioredis.from_url("redis://redis:6379")
-        asyncio.create_task(redis_listener())
+        global redis_client, listener, result_cache, scheduler
+        # socket_keepalive lets the operating system notice a dead connection even while the listener
+        # is blocked waiting for the next message.
+        redis_client = aioredis.from_url(REDIS_URL, socket_keepalive=True)
+        result_cache = ResultCache(redis_client)
+        scheduler = Scheduler(redis_client, lambda task_id: AsyncResult(task_id).state in READY_STATES)
+        listener = RedisListener(redis_client, ['model_updates:*'], handle_update)
+        # The supervisor restarts the listener should it ever exit, see listener.py.
+        listener_task = asyncio.create_task(supervise("Redis listener", listener.run))
         logger.info("Application starting...")
         yield
     except Exception as e:
         logger.error(f"Error connecting to Redis: {e}")
         # raise
     finally:
+        if listener_task:
+            listener_task.cancel()
         try:
             if redis_client:
                 await redis_client.close()
@@ -172,46 +224,203 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
                        "type": error["type"]})
     return JSONResponse(status_code=422, content={"detail": errors})
 
-# redis_listener() is an asynchronous function that listens for messages on a Redis channel. It uses
-# asynchronous Redis client to subscribe to the 'model_updates' channel and then enters a loop to
-# receive messages. When a message is received, it is broadcast to the active WebSocket connection.
-async def redis_listener():
-    # pubsub() is a method that creates a new PubSub instance. PubSub is a messaging pattern where
-    # publishers send messages to a channel, and subscribers listen for messages on that channel.
-    # The publisher in this case is the redis client in the worker.py containing the training task, 
-    # and the subscriber is the pubsub object created here.
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe('model_updates')
-    while True:
+# broadcast() queues a message for every WebSocket client subscribed to its task, plus every client
+# that hasn't subscribed to a specific task. It doesn't wait for any socket, so one slow client can't
+# stall the listener loop or the other clients. Batch-level progress and sweep leaderboards are
+# coalesced per task: a client that hasn't been sent the previous BATCH (or LEADERBOARD) update of a
+# task yet only ever gets the latest one.
+def broadcast(message_data):
+    task_id, status = message_data.get('task_id'), message_data.get('status')
+    coalesce_key = (status, task_id) if status in ('BATCH', 'LEADERBOARD') else None
+    manager.publish(task_id, json.dumps(message_data), coalesce_key, message_data.get('event_id'))
+
+# handle_update() is called by the Redis listener for every update published by the worker. Besides
+# broadcasting it, final updates are passed on to the result cache, which stores successful results and
+# releases the deduplication claim of tasks that ended any other way, and to the scheduler, which
+# frees the task's slot. The end of a sweep trial also starts the sweep's next trial. That bookkeeping
+# runs as its own task so the listener never waits on it.
+def handle_update(message_data):
+    broadcast(message_data)
+    if message_data.get('status') in FINAL_STATUSES:
+        run_in_background(result_cache.record(message_data))
+        run_in_background(scheduler.record(message_data))
+        if message_data.get('sweep_id'):
+            run_in_background(continue_sweep(message_data['sweep_id'], message_data['task_id']))
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# Identifies the submitter of a request for the per-client task limit: the X-Client-Id header if the
+# client sends one, its address otherwise.
+def client_id(request):
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+# Rejects a configuration whose estimate (see estimator.py) is over the memory or time budget with a 422
+# listing the reasons, before anything is claimed or queued for it.
+def check_budget(config_estimate):
+    reasons = over_budget(config_estimate)
+    if reasons:
+        raise HTTPException(status_code=422, detail={"message": "Configuration exceeds the training budget", "reasons": reasons,
+                                                     "estimate": config_estimate})
+
+# Sends a training task to the queue matching its estimated cost (see scheduling.py) and returns the
+# scheduling details added to the endpoint's response. Raises a 429 if the client already holds its
+# maximum number of tasks. 'task' is the Celery task, 'kwargs' its arguments; 'lane' overrides the
+# queue chosen from the cost and 'force' skips the per-client limit.
+async def submit_task(task, kwargs, task_id, cost, client, lane=None, force=False):
+    if not await scheduler.admit(client, task_id, force):
+        raise HTTPException(status_code=429, detail=f"Client {client} already has {scheduler.max_tasks_per_client} tasks queued or running")
+    lane = lane or lane_for(cost)
+    estimate = await scheduler.enqueue(task_id, client, lane, cost)
+    try:
+        task.apply_async(kwargs=kwargs, task_id=task_id, queue=lane)
+    except Exception:
+        await scheduler.finish(task_id)
+        raise
+    position, estimated_start = await scheduler.position(task_id)
+    return {"queue": lane, "cost": cost, "queue_position": position, "estimated_start": estimated_start,
+            "estimated_duration": estimate}
+
+# Whether a task is still queued or running. Celery also reports PENDING for ids it has no result for
+# (unknown or expired), so only tasks the scheduler still tracks count.
+async def task_in_progress(task_id):
+    if not await scheduler.is_tracked(task_id):
+        return False
+    return await run_in_threadpool(lambda: AsyncResult(task_id).state) in (PENDING, STARTED)
+
+# Records 'task_id' as the task resuming the checkpoint of 'resumed_from', so that only one resume of a
+# checkpoint runs at a time. Returns None once claimed, or the id of the task already resuming it. A
+# claim held by a task that is no longer queued or running is stale and gets taken over.
+async def claim_resume(resumed_from, task_id):
+    key = f"resume:{resumed_from}"
+    if await redis_client.set(key, task_id, nx=True, ex=TASK_TTL):
+        return None
+    holder = await redis_client.get(key)
+    if holder is not None and await task_in_progress(holder.decode()):
+        return holder.decode()
+    await redis_client.delete(key)
+    return await claim_resume(resumed_from, task_id)
+
+# Queues one trial of a sweep (see sweep.py) as a train_model task running under the trial's id.
+async def submit_trial(meta, trial, force=False):
+    config = trial['config']
+    await sweep.mark_queued(redis_client, meta['sweep_id'], trial['trial_id'])
+    return await submit_task(
+        train_model,
+        dict(**config, epochs=meta['max_epochs'], sweep_id=meta['sweep_id']),
+        trial['trial_id'],
+        estimate_cost(config['layers'], config['units'], meta['max_epochs'], config['batch_size']),
+        meta['client'],
+        force=force
+    )
+
+# Starts the sweep's next pending trial once one of its trials ended. The sweep keeps the client slot
+# of the trial that ended, so the replacement is never refused by the per-client limit.
+async def continue_sweep(sweep_id, finished_trial_id):
+    try:
+        trial = await sweep.next_trial(redis_client, sweep_id, finished_trial_id)
+        if trial is None:
+            return
+        meta = await sweep.get_meta(redis_client, sweep_id)
+        await submit_trial(meta, trial, force=True)
+    except Exception as e:
+        logger.error(f"Could not start the next trial of sweep {sweep_id}: {e}")
+
+# The sub-task ids of a /train/batch task, or an empty list for any other task.
+async def batch_sub_task_ids(task_id):
+    sub_task_ids = await redis_client.get(f"batch:{task_id}")
+    return json.loads(sub_task_ids) if sub_task_ids is not None else []
+
+# Publishes an update the app produces itself, exactly like the worker's publish_update().
+async def publish_update(task_id, update):
+    update = {'task_id': task_id, 'timestamp': time.time(), **update}
+    update['event_id'] = await append_event_async(redis_client, task_id, update)
+    await redis_client.publish(f'model_updates:{task_id}', json.dumps(update))
+
+# Sends a client the updates of a task whose result is already cached, as if it had been connected
+# while the task ran. This is how repeated /train requests answered from the cache are replayed over
+# the WebSocket.
+async def replay_cached_result(client, task_id):
+    result = await result_cache.get_by_task(task_id)
+    if result is None:
+        return
+    for update in replay_updates(result):
+        client.enqueue(json.dumps(update))
+
+# Subscribes a client to a task. With an offset, the task's logged events after that event id ("0" for
+# all of them) are replayed first, see events.py; live updates arriving in the meantime are held back
+# and de-duplicated against the replay by the client (see connections.py). If the task has no logged
+# events left (its stream expired) but its result is cached, the cached run is replayed instead.
+# A malformed offset, or a replay that can't be read, is answered with an error frame for that task
+# ({"task_id": ..., "error": ...}) and leaves the client's subscriptions as they were, so the rest of
+# the connection keeps working.
+async def subscribe_client(client, task_id, offset=None):
+    if offset is not None and not is_event_id(offset):
+        client.enqueue(json.dumps({'task_id': task_id, 'error': f"Invalid offset: {offset}"}))
+        return
+    already_subscribed = task_id in client.subscriptions
+    client.begin_replay(task_id)
+    manager.subscribe(client, task_id)
+    last_event_id = None
+    try:
         try:
-            message = await pubsub.get_message(ignore_subscribe_messages=True)
-            if message:
-                message_data = json.loads(message['data'])
-                await broadcast(json.dumps(message_data))
-            await asyncio.sleep(0.01)
-        except asyncio.CancelledError:
-            logger.info("Redis listener cancelled.")
-            break
+            events = await read_events(redis_client, task_id, offset) if offset is not None else []
         except Exception as e:
-            print(f"Redis error: {e}")
-            # raise
-            break
+            logger.error(f"Could not replay the events of task {task_id}: {e}")
+            if not already_subscribed:
+                manager.unsubscribe(client, task_id)
+                client.replaying.pop(task_id, None)
+            client.enqueue(json.dumps({'task_id': task_id, 'error': "Could not replay the task's events"}))
+            return
+        for event in events:
+            client.enqueue(json.dumps(event))
+        if events:
+            last_event_id = events[-1]['event_id']
+        elif offset in (None, '0', '0-0', '-'):
+            await replay_cached_result(client, task_id)
+    finally:
+        client.end_replay(task_id, last_event_id)
 
-# broadcast() is an asynchronous function that sends a message to the active WebSocket connection.
-# It uses the .send_text() method of the WebSocket connection to send the message.
-async def broadcast(message):
-    await active_connection.send_text(message)
-
-# Route for the WebSocket connection. "@app.websocket(/ws)" is a decorator that defines a WebSocket
-# endpoint at the specified path. The decorated function has a websocket parameter that takes as
-# input the WebSocket connection. The function accepts the WebSocket connection and then enters a
-# loop to receive messages from the client.
 
+# Health check used by docker-compose and the frontend. Also reports the state of the Redis listener:
+# whether it is connected, how often it had to reconnect and how far behind the worker it is. The app
+# itself keeps serving requests while the listener reconnects, so a disconnected listener is reported
+# as 'degraded' rather than failing the check.
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    if listener is None:
+        return {"status": "healthy"}
+    listener_status = listener.status()
+    return {"status": "healthy" if listener_status["connected"] else "degraded", "redis_listener": listener_status}
+
+# Prometheus metrics of the app (see metrics.py). Queue depths are read from the scheduler on every
+# scrape; the training metrics themselves are served by each worker's own exporter.
+@app.get("/metrics")
+async def metrics_request():
+    for lane, (queued, running) in (await scheduler.depths()).items():
+        QUEUE_DEPTH.labels(lane, "queued").set(queued)
+        QUEUE_DEPTH.labels(lane, "running").set(running)
+    return Response(app_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+# Time to first epoch of recent training tasks, split into cold and warm starts, and how long the
+# worker processes took to warm up (see warmup.py). All values are in seconds.
+@app.get("/metrics/startup")
+async def startup_metrics_request():
+    return await startup_metrics(redis_client)
 
 
+# Route for the WebSocket connection. "@app.websocket(/ws)" is a decorator that defines a WebSocket
+# endpoint at the specified path. The decorated function has a websocket parameter that takes as
+# input the WebSocket connection. The function accepts the WebSocket connection, registers it with the
+# connection manager and then enters a loop to receive messages from the client. Clients pick the
+# tasks they want updates for either with a task_id query parameter (ws://.../ws?task_id=...) or by
+# sending {"action": "subscribe", "task_id": "..."} / {"action": "unsubscribe", "task_id": "..."}.
+# Both forms accept an offset (?offset=... or "offset": "...") to replay the task's events logged after
+# that event id before tailing live updates; "0" replays the task from its start, and a reconnecting
+# client passes the event_id of the last update it received. A client that never subscribes receives
+# the updates of every task.
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     # accept() is used to accept the WebSocket connection by
@@ -221,14 +430,25 @@ async def websocket_endpoint(websocket: WebSocket):
     # we mean that the function will not proceed to the next line until the connection is accepted.
     logger.info("WebSocket connection establishing")
     await websocket.accept()
-    global active_connection
-    # assigning the current websocket connection to the global variable active_connection.
-    # Alllows the rest of hte code to access the active websocket connection.
-    active_connection = websocket
+    client = manager.connect(websocket)
     try:
+        task_id = websocket.query_params.get('task_id')
+        if task_id:
+            await subscribe_client(client, task_id, websocket.query_params.get('offset'))
         while True:
             # receive_text() is an asynchronous function that waits for a message to be received
-            await websocket.receive_text()
+            data = await websocket.receive_text()
+            try:
+                request = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(request, dict) or not request.get('task_id'):
+                continue
+            if request.get('action') == 'subscribe':
+                offset = request.get('offset')
+                await subscribe_client(client, request['task_id'], None if offset is None else str(offset))
+            elif request.get('action') == 'unsubscribe':
+                manager.unsubscribe(client, request['task_id'])
     
     except WebSocketDisconnect:
         logger.info("WebSocket connection closed")
@@ -237,21 +457,41 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.info(f"WebSocket error: {e}")
     
     # finally block is executed after the try block has completed and any exceptions have been handled.
-    # We're basically just cleaning up here by closing the connection.
+    # We're basically just cleaning up here by removing the connection from the registry, which also
+    # stops its sender task.
     finally:
         logger.info("Closing connection")
-        active_connection = None
+        manager.disconnect(client)
+
+
+# Estimates what training a configuration would take without starting it (see estimator.py): parameter
+# count, activation memory per batch, peak memory, FLOPs per epoch and projected wall time, plus
+# whether /train would admit it under the configured budgets.
+@app.post("/estimate")
+async def estimate_request(payload: TrainModelRequest):
+    config_estimate = estimate(payload.layers, payload.units, payload.epochs, payload.batchSize)
+    reasons = over_budget(config_estimate)
+    return {**config_estimate, "admitted": not reasons, "reasons": reasons}
 
 
 # Decorator that runs the train_model_request() function when a POST request is made to the "/train" 
 # endpoint. The function accepts a JSON payload containing the model configuration and hyperparameters,
-# and then calls the train_model.delay() function from the worker.py file. The pydantic model
+# and then calls the train_model.apply_async() function from the worker.py file. The pydantic model
 # TrainModelRequest is used to validate the input payload, returning a 422 error if the payload is invalid.
-# If the payload is valid, a Celery task is created to train the model, and the task ID is returned 
-# in the response. If there is an error, an HTTPException is raised with a status code of 500 
-# (Internal Server Error) and the error message.
+# If the payload is valid, the result cache is consulted first (see result_cache.py):
+# - if the same configuration was already trained, its result is returned right away with
+#   "cached": true, and clients subscribing to the returned task_id get the run replayed over the
+#   WebSocket;
+# - if the same configuration is being trained right now, the id of that task is returned with
+#   "deduplicated": true instead of starting a second one;
+# - otherwise a Celery task is created to train the model, and the task ID is returned in the response
+#   along with the queue it was routed to, its position in that queue and its estimated start time (a
+#   Unix timestamp, see scheduling.py). A client that already holds MAX_TASKS_PER_CLIENT tasks gets a
+#   429 (Too Many Requests) instead.
+# If there is an error, an HTTPException is raised with a status code of 500 (Internal Server Error)
+# and the error message.
 @app.post("/train")
-async def train_model_request(payload: TrainModelRequest):
+async def train_model_request(payload: TrainModelRequest, request: Request):
     # Testing the except block:
     # 1. Missing a required field in the payload, in this case batch_size. Except block was triggered,
     # and the HTTPException was raised with the error message to the frontend. The catch block in the
@@ -263,30 +503,250 @@ async def train_model_request(payload: TrainModelRequest):
     # because we are not really using the broker or backend. Previously, we were using them to publish
     # updates to the frontend, but now we are only using the redis client to listen for updates.
     #
+    check_budget(estimate(payload.layers, payload.units, payload.epochs, payload.batchSize))
+    key = cache_key(payload)
+    cached = await result_cache.get(key)
+    if cached is not None:
+        return {"task_id": cached["task_id"], "cached": True,
+                "test_accuracy": cached["test_accuracy"], "test_loss": cached["test_loss"]}
+
+    task_id = str(uuid.uuid4())
+    holder = await result_cache.claim(key, task_id)
+    # A claim held by a task that already finished without its result being cached (it failed, was
+    # revoked, or its final message was missed) is stale and gets taken over.
+    if holder is not None and AsyncResult(holder).state in READY_STATES:
+        holder = await result_cache.reclaim(key, task_id)
+    if holder is not None:
+        return {"task_id": holder, "deduplicated": True}
+
     try:
-        task = train_model.delay(
-            layers = payload.layers,
-            units = payload.units,
-            epochs = payload.epochs,
-            batch_size = payload.batchSize,
-            optimizer = payload.optimizer
+        scheduling = await submit_task(
+            train_model,
+            dict(
+                layers = payload.layers,
+                units = payload.units,
+                epochs = payload.epochs,
+                batch_size = payload.batchSize,
+                optimizer = payload.optimizer,
+                precision = payload.precision,
+                jit = payload.jit
+            ),
+            task_id,
+            estimate_cost(payload.layers, payload.units, payload.epochs, payload.batchSize),
+            client_id(request)
         )
-        return {"task_id": task.id}
+        return {"task_id": task_id, **scheduling}
+    except HTTPException:
+        await result_cache.release(task_id)
+        raise
     except Exception as e:
         logging.error(f"Error training model: {e}")
-        raise HTTPException(status_code=500, detail=f"Error running train_model.delay() and assigning it to a celery task. Exception: {e}")
-
+        await result_cache.release(task_id)
+        raise HTTPException(status_code=500, detail=f"Error running train_model.apply_async() and assigning it to a celery task. Exception: {e}")
+
+# Trains several configurations together in a single worker task (see train_model_batch in worker.py),
+# which shares one input pipeline between all of them. Every configuration gets its own sub-task id,
+# under which its progress and result are published exactly like a /train task's, so clients subscribe
+# to those ids as usual. The returned task_id identifies the batch as a whole and is what /cancel takes.
+# Batched runs bypass the result cache. The batch is scheduled as one task costing as much as all of
+# its configurations together. The sub-task ids are kept under batch:<task_id> so that /cancel can
+# cancel them along with a batch that never started.
+@app.post("/train/batch")
+async def train_model_batch_request(payload: BatchTrainModelRequest, request: Request):
+    check_budget(combine([estimate(config.layers, config.units, config.epochs, config.batchSize) for config in payload.configs]))
+    sub_task_ids = [str(uuid.uuid4()) for _ in payload.configs]
+    task_id = str(uuid.uuid4())
+    await redis_client.set(f"batch:{task_id}", json.dumps(sub_task_ids), ex=TASK_TTL)
+    try:
+        scheduling = await submit_task(
+            train_model_batch,
+            dict(
+                configs = [
+                    dict(
+                        layers = config.layers,
+                        units = config.units,
+                        epochs = config.epochs,
+                        batch_size = config.batchSize,
+                        optimizer = config.optimizer,
+                        precision = config.precision,
+                        jit = config.jit
+                    )
+                    for config in payload.configs
+                ],
+                sub_task_ids = sub_task_ids
+            ),
+            task_id,
+            sum(estimate_cost(config.layers, config.units, config.epochs, config.batchSize) for config in payload.configs),
+            client_id(request)
+        )
+        return {"task_id": task_id, "sub_task_ids": sub_task_ids, **scheduling}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error training model batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Error running train_model_batch.apply_async() and assigning it to a celery task. Exception: {e}")
+
+# Trains one configuration data-parallel across 'workers' worker processes (see distributed.py). The
+# task is always sent to the regular training queue, whose workers also run the extra ranks; progress
+# and the result are published under the returned task_id like a /train task's, and /cancel takes the
+# same id. The time budget is checked against the estimate split across the workers; every worker
+# needs the full memory estimate. Distributed runs bypass the result cache.
+@app.post("/train/distributed")
+async def train_model_distributed_request(payload: DistributedTrainModelRequest, request: Request):
+    config_estimate = estimate(payload.layers, payload.units, payload.epochs, payload.batchSize)
+    check_budget({**config_estimate, "seconds": config_estimate["seconds"] / payload.workers})
+    task_id = str(uuid.uuid4())
+    try:
+        scheduling = await submit_task(
+            train_model_distributed,
+            dict(
+                layers = payload.layers,
+                units = payload.units,
+                epochs = payload.epochs,
+                batch_size = payload.batchSize,
+                optimizer = payload.optimizer,
+                workers = payload.workers,
+                precision = payload.precision
+            ),
+            task_id,
+            estimate_cost(payload.layers, payload.units, payload.epochs, payload.batchSize),
+            client_id(request),
+            lane = TRAIN_QUEUE
+        )
+        return {"task_id": task_id, "workers": payload.workers, **scheduling}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error training distributed model: {e}")
+        raise HTTPException(status_code=500, detail=f"Error running train_model_distributed.apply_async() and assigning it to a celery task. Exception: {e}")
+
+# Searches the space of configurations described by a SweepRequest (see sweep.py). 'trials'
+# configurations are sampled and trained as ordinary train_model tasks, 'parallelism' at a time, and
+# the poorly performing ones are stopped early at the sweep's rungs. Every trial's id is returned; its
+# updates are published under that id like a /train task's, ending with status STOPPED if it was
+# stopped early. The returned sweep_id receives a LEADERBOARD update whenever a trial completes an
+# epoch or ends, and a final SUCCESS update with the best trial and the share of the full training
+# epochs the sweep used. /cancel with the sweep_id cancels the whole sweep. Every trial must fit the
+# training budget, and the sweep holds 'parallelism' of the client's task slots while it runs.
+@app.post("/sweep")
+async def sweep_request(payload: SweepRequest, request: Request):
+    client = client_id(request)
+    if payload.parallelism > scheduler.max_tasks_per_client:
+        raise HTTPException(status_code=422, detail=f"parallelism can't exceed the per-client limit of {scheduler.max_tasks_per_client} tasks")
+    configs = [dict(**config, precision=payload.precision, jit=payload.jit)
+               for config in sweep.sample_trials(payload.space.model_dump(), payload.trials, payload.seed)]
+    for config in configs:
+        check_budget(estimate(config['layers'], config['units'], payload.max_epochs, config['batch_size']))
+    sweep_id = str(uuid.uuid4())
+    meta, trials = await sweep.create_sweep(redis_client, sweep_id, configs, dict(
+        client=client, metric=payload.metric, min_epochs=payload.min_epochs, max_epochs=payload.max_epochs,
+        eta=payload.reduction_factor, parallelism=payload.parallelism,
+    ))
+    try:
+        first = []
+        for _ in range(payload.parallelism):
+            trial = await sweep.pop_pending(redis_client, sweep_id)
+            if trial is None:
+                break
+            first.append({"trial_id": trial['trial_id'], **await submit_trial(meta, trial)})
+    except Exception as e:
+        logging.error(f"Error starting sweep: {e}")
+        for trial_id in await sweep.cancel_sweep(redis_client, sweep_id):
+            AbortableAsyncResult(trial_id).revoke()
+            await scheduler.finish(trial_id)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Error starting the sweep's trials. Exception: {e}")
+    return {"sweep_id": sweep_id, "trials": [{"trial_id": trial['trial_id'], "config": trial['config']} for trial in trials],
+            "rungs": meta['rungs'], "started": first}
+
+# Cancels a task cooperatively (see cancellation.py): abort() flags the task in the result backend and
+# the running task stops itself at the next batch boundary, publishing a CANCELLED update with its
+# partial metrics, while the worker process stays alive for the next task. revoke() without terminate
+# additionally makes sure a task that is still waiting in the queue never starts. Such a task never
+# publishes anything, so /cancel publishes its CANCELLED update itself, and one for each sub-task of a
+# /train/batch task, whose result-cache claims are released too; should a worker have picked the task
+# up just before the revoke, its subscribers get a second CANCELLED from the task, which is harmless.
+# Cancelling a sweep drops its pending trials and cancels its queued and running ones the same way.
 @app.post("/cancel")
 async def cancel_task(payload : CancelTaskRequest):
     try:
         logger.info(f'here in cancel task {payload.task_id}')
-        task = AsyncResult(payload.task_id)
-        task.revoke(terminate=True)
+        meta = await sweep.get_meta(redis_client, payload.task_id)
+        task_ids = [payload.task_id]
+        if meta is not None:
+            task_ids = await sweep.cancel_sweep(redis_client, payload.task_id)
+            await publish_update(payload.task_id, {'status': "CANCELLED"})
+        for task_id in task_ids:
+            task = AbortableAsyncResult(task_id)
+            task.revoke()
+            task.abort()
+            sub_task_ids = await batch_sub_task_ids(task_id)
+            if await scheduler.is_queued(task_id):
+                for sub_task_id in sub_task_ids:
+                    await publish_update(sub_task_id, {'status': "CANCELLED", 'epoch': 0, 'history': [], 'batch_id': task_id})
+                await publish_update(task_id, {'status': "CANCELLED", 'epoch': 0, 'history': []})
+            for sub_task_id in sub_task_ids:
+                await result_cache.release(sub_task_id)
+            await result_cache.release(task_id)
+            await scheduler.finish(task_id)
         return {"status": "Task cancelled"}
     except Exception as e:
         logging.error(f"Error cancelling task: {e}")
         raise HTTPException(status_code=500, detail=f"Error cancelling task. Exception: {e}")
 
+# Continues a cancelled or crashed train_model task from its last checkpoint (see checkpoints.py). The
+# checkpoints live in the artifact directory shared with the workers, so the app can check that one
+# exists and read the original configuration from it. A new task is started, picking up at the first
+# epoch the old task didn't complete; its id is returned just like /train's, and it is scheduled on
+# the cost of the epochs that remain.
+@app.post("/resume")
+async def resume_task(payload: ResumeTaskRequest, request: Request):
+    meta = await run_in_threadpool(read_checkpoint_meta, payload.task_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail=f"No checkpoint found for task {payload.task_id}")
+    # Resuming a task that is still queued or running would train two models on the same checkpoint.
+    if await task_in_progress(payload.task_id):
+        raise HTTPException(status_code=409, detail=f"Task {payload.task_id} is still queued or running")
+    config = meta['config']
+    remaining_epochs = max(config['epochs'] - meta['epoch'], 0)
+    check_budget(estimate(config['layers'], config['units'], remaining_epochs, config['batch_size']))
+    task_id = str(uuid.uuid4())
+    holder = await claim_resume(payload.task_id, task_id)
+    if holder is not None:
+        raise HTTPException(status_code=409, detail=f"Task {payload.task_id} is already being resumed by task {holder}")
+    try:
+        scheduling = await submit_task(
+            train_model,
+            dict(**config, resume_from=payload.task_id),
+            task_id,
+            estimate_cost(config['layers'], config['units'], remaining_epochs, config['batch_size']),
+            client_id(request)
+        )
+        return {"task_id": task_id, "resumed_from": payload.task_id, "epoch": meta['epoch'], **scheduling}
+    except HTTPException:
+        await redis_client.delete(f"resume:{payload.task_id}")
+        raise
+    except Exception as e:
+        await redis_client.delete(f"resume:{payload.task_id}")
+        logging.error(f"Error resuming task: {e}")
+        raise HTTPException(status_code=500, detail=f"Error running train_model.apply_async() to resume task. Exception: {e}")
+
+# Classifies images with the model a finished train_model task stored (see model_store.py). Requests for
+# the same model arriving within a few milliseconds of each other are run as one batch (see serving.py);
+# 'batch_size' in the response is the size of the batch this request's images were part of. Returns a
+# 404 if the task didn't store a model (it hasn't finished, failed, or was stopped early).
+@app.post("/predict")
+async def predict_request(payload: PredictRequest):
+    images = np.asarray(payload.images, dtype=np.float32)
+    try:
+        probabilities, batch_size = await model_cache.predict(payload.task_id, images)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"No trained model stored for task {payload.task_id}")
+    predictions = [{"class": int(np.argmax(p)), "label": CLASS_NAMES[int(np.argmax(p))], "probabilities": p.tolist()}
+                   for p in probabilities]
+    return {"task_id": payload.task_id, "predictions": predictions, "batch_size": batch_size}
+
 @app.get("/test-error")
 async def test_error():
     raise Exception("Deliberate Test Exception")
@@ -0,0 +1,157 @@
+# META
+
+# Description: Runs distributed data-parallel training (see distributed.py) end to end on the local
+# machine and compares it with a single-process train_model run of the same configuration. Starts a
+# local Redis stand-in (fakeredis' TCP server, unless --redis-url points at a real server) and a Celery
+# worker with one process per rank, submits the tasks exactly like the app does and follows their
+# updates on model_updates. Every rank is a local CPU process, so this doubles as the test setup for
+# the distributed mode. By default the dataset is a small synthetic CIFAR-shaped one written to a
+# temporary cache directory; --cifar uses the real preprocessed arrays from dataset.py instead.
+# fakeredis is not a dependency of the backend itself; install it with `pip install "fakeredis[lua]"`
+# (Celery's Redis transport runs Lua scripts).
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_distributed.py --workers 2 --epochs 2
+#   python benchmarks/bench_distributed.py --workers 3 --samples 30000 --no-baseline
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_redis_stand_in():
+    from fakeredis import TcpFakeServer
+
+    # fakeredis writes every reply of a pipeline separately; like Redis itself, it must do so without
+    # Nagle's algorithm, or each pipeline waits ~40 ms for the client's delayed ACK.
+    class Server(TcpFakeServer):
+        def get_request(self):
+            connection, address = super().get_request()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return connection, address
+
+    port = free_port()
+    server = Server(("127.0.0.1", port), server_type="redis")
+    # Connections still open at exit mustn't keep the process alive.
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+
+# Writes a synthetic dataset with the layout dataset.py expects into cache_dir.
+def write_synthetic_dataset(cache_dir, version, samples):
+    directory = os.path.join(cache_dir, version)
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    splits = {"train": samples, "val": max(samples // 10, 64), "test": max(samples // 5, 64)}
+    for split, n in splits.items():
+        np.save(os.path.join(directory, f"x_{split}.npy"), rng.standard_normal((n, 32, 32, 3), dtype=np.float32))
+        np.save(os.path.join(directory, f"y_{split}.npy"), rng.integers(0, 10, (n, 1), dtype=np.uint8))
+    np.save(os.path.join(directory, "mean.npy"), np.zeros(3, dtype=np.float32))
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump({"version": version, "synthetic": True}, f)
+
+
+# Follows a task's updates until its final one. Returns (final update, seconds from submission).
+def follow(redis_client, task_id, submitted, timeout):
+    pubsub = redis_client.pubsub()
+    pubsub.subscribe(f"model_updates:{task_id}")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        message = pubsub.get_message(timeout=1.0)
+        if message is None or message["type"] != "message":
+            continue
+        update = json.loads(message["data"])
+        if update["status"] in ("PROGRESS", "RESERVED", "ERROR", "SUCCESS", "CANCELLED"):
+            detail = update.get("logs") or update.get("cluster") or update.get("message") or ""
+            print(f"  [{time.monotonic() - submitted:7.1f}s] {update['status']} {update.get('epoch', '')} {detail}")
+        if update["status"] in ("SUCCESS", "ERROR", "CANCELLED"):
+            pubsub.close()
+            return update, time.monotonic() - submitted
+    pubsub.close()
+    raise TimeoutError(f"Task {task_id} didn't finish within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2, help="ranks of the distributed run")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--units", default="32,64", help="comma-separated units per layer")
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=128, help="global batch size")
+    parser.add_argument("--optimizer", default="adam")
+    parser.add_argument("--samples", type=int, default=8192, help="size of the synthetic training set")
+    parser.add_argument("--cifar", action="store_true", help="use the real preprocessed CIFAR-10 cache")
+    parser.add_argument("--redis-url", default=None, help="use a real Redis server instead of fakeredis")
+    parser.add_argument("--no-baseline", action="store_true", help="skip the single-process train_model run")
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    # Everything below, including the worker subprocess, reads its settings from these variables.
+    os.environ["REDIS_URL"] = args.redis_url or start_redis_stand_in()
+    os.environ["DISTRIBUTED_HOST"] = "127.0.0.1"
+    os.environ["WORKER_WARMUP"] = "0"
+    if not args.cifar:
+        os.environ["DATASET_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-distributed-")
+
+    from config import DATASET_CACHE_DIR, DATASET_VERSION, TRAIN_QUEUE
+    from worker import redis_client, train_model, train_model_distributed
+    if not args.cifar:
+        write_synthetic_dataset(DATASET_CACHE_DIR, DATASET_VERSION, args.samples)
+
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "celery", "-A", "worker", "worker", "-Q", TRAIN_QUEUE,
+         "-c", str(args.workers), "--loglevel=warning"],
+        cwd=BACKEND_DIR, env=os.environ.copy())
+    config = dict(layers=args.layers, units=[int(u) for u in args.units.split(",")], epochs=args.epochs,
+                  batch_size=args.batch_size, optimizer=args.optimizer)
+    results = {"config": config, "workers": args.workers}
+    try:
+        if not args.no_baseline:
+            print("train_model (1 process):")
+            submitted = time.monotonic()
+            task = train_model.apply_async(kwargs=config, queue=TRAIN_QUEUE)
+            update, seconds = follow(redis_client, task.id, submitted, args.timeout)
+            results["baseline"] = {"status": update["status"], "seconds": seconds,
+                                   "images_per_sec": update.get("images_per_sec"), "test_accuracy": update.get("test_accuracy")}
+
+        print(f"train_model_distributed ({args.workers} processes):")
+        submitted = time.monotonic()
+        task = train_model_distributed.apply_async(kwargs={**config, "workers": args.workers}, queue=TRAIN_QUEUE)
+        update, seconds = follow(redis_client, task.id, submitted, args.timeout)
+        results["distributed"] = {"status": update["status"], "seconds": seconds, "message": update.get("message"),
+                                  "images_per_sec": update.get("images_per_sec"), "test_accuracy": update.get("test_accuracy")}
+    finally:
+        worker.terminate()
+        worker.wait()
+
+    for name in ("baseline", "distributed"):
+        if name in results:
+            r = results[name]
+            rate = f"{r['images_per_sec']:.0f} images/sec" if r.get("images_per_sec") else "-"
+            print(f"{name:>12}: {r['status']:<8} {r['seconds']:7.1f}s  {rate}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# META
+
+# Description: End-to-end load test of the request path /train -> Celery -> Redis -> /ws. Starts a
+# local Redis stand-in (fakeredis' TCP server, unless --redis-url points at a real server), the FastAPI
+# app under uvicorn and a Celery worker running stub_worker.py, whose train_model only sleeps through
+# its epochs but publishes its updates exactly like the real one. Then 'clients' simulated users run
+# concurrently, each with its own WebSocket connection and X-Client-Id, submitting 'tasks' training
+# requests one after the other: POST /train, subscribe to the returned task id (replaying its events
+# from the start, so nothing published before the subscription is missed) and follow it to its final
+# update. A share of the tasks (--cancel-fraction) is cancelled with POST /cancel as soon as its first
+# update arrives. Every request uses a distinct configuration so none is answered from the result
+# cache. Reports p50/p95/p99 of:
+#   submit_ms          POST /train response time
+#   cancel_ms          POST /cancel response time
+#   delivery_ms        worker publish -> update received on the WebSocket (live updates only)
+#   first_update_ms    POST /train sent -> first update received, i.e. queueing plus task start
+#   cancel_final_ms    POST /cancel sent -> CANCELLED update received
+#   end_to_end_ms      POST /train sent -> final update received, for tasks that ran to completion
+# plus tasks and updates per second. --json writes the results along with the current commit, and
+# --compare prints the change of every percentile against such a file from an earlier run.
+# Needs httpx (the WebSocket client is the `websockets` package the backend already depends on) and,
+# unless --redis-url is given, `pip install "fakeredis[lua]"` (Celery's Redis transport runs Lua).
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_e2e.py --json e2e.json
+#   python benchmarks/bench_e2e.py --clients 32 --tasks 5 --worker-concurrency 8 --compare e2e.json
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench_distributed import free_port, start_redis_stand_in  # noqa: E402
+from events import FINAL_STATUSES  # noqa: E402
+
+LATENCIES = ("submit_ms", "cancel_ms", "delivery_ms", "first_update_ms", "cancel_final_ms", "end_to_end_ms")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))] if values else None
+
+
+def summarize(values):
+    return {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99)}
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# A configuration no other request of this run shares, so that /train never answers from the result
+# cache or deduplicates against another task. 'salt' separates runs against the same Redis server.
+def distinct_config(n, salt, epochs):
+    n += salt
+    return {"layers": 2, "units": [1 + n % 32, 1 + n // 32 % 32], "epochs": epochs, "batchSize": 32 + n // 1024 % 481,
+            "optimizer": "adam"}
+
+
+async def wait_for_app(http, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await http.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"The app didn't come up within {timeout}s")
+
+
+# Submits one task and follows it over 'ws' to its final update, recording into 'stats'. Returns the
+# final status.
+async def run_task(http, ws, client, config, cancel, stats, timeout):
+    sent = time.perf_counter()
+    response = await http.post("/train", json=config, headers={"X-Client-Id": client})
+    stats["submit_ms"].append((time.perf_counter() - sent) * 1000)
+    if response.status_code != 200:
+        stats["errors"].append(f"/train {response.status_code}: {response.text[:200]}")
+        return None
+    task_id = response.json()["task_id"]
+    subscribed = time.time()
+    await ws.send(json.dumps({"action": "subscribe", "task_id": task_id, "offset": "0"}))
+    first, cancel_sent = None, None
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            update = json.loads(await asyncio.wait_for(ws.recv(), deadline - time.monotonic()))
+            if update.get("task_id") != task_id:
+                continue
+            stats["updates"] += 1
+            # Replayed events were published before the subscription; their age says nothing about
+            # delivery.
+            if update.get("timestamp", 0) >= subscribed:
+                stats["delivery_ms"].append((time.time() - update["timestamp"]) * 1000)
+            if first is None:
+                first = time.perf_counter()
+                stats["first_update_ms"].append((first - sent) * 1000)
+            status = update.get("status")
+            if status in FINAL_STATUSES:
+                if status == "CANCELLED" and cancel_sent is not None:
+                    stats["cancel_final_ms"].append((time.perf_counter() - cancel_sent) * 1000)
+                elif status == "SUCCESS":
+                    stats["end_to_end_ms"].append((time.perf_counter() - sent) * 1000)
+                return status
+            # Cancelling once the task runs, since a task revoked while still queued never publishes
+            # anything.
+            if cancel and cancel_sent is None:
+                cancel_sent = time.perf_counter()
+                response = await http.post("/cancel", json={"task_id": task_id})
+                stats["cancel_ms"].append((time.perf_counter() - cancel_sent) * 1000)
+                if response.status_code != 200:
+                    stats["errors"].append(f"/cancel {response.status_code}: {response.text[:200]}")
+    except asyncio.TimeoutError:
+        stats["errors"].append(f"task {task_id} didn't finish within {timeout}s")
+        return None
+    finally:
+        await ws.send(json.dumps({"action": "unsubscribe", "task_id": task_id}))
+
+
+async def run(args, base_url):
+    ws_url = base_url.replace("http", "ws", 1) + "/ws"
+    stats = {name: [] for name in LATENCIES}
+    stats.update(updates=0, errors=[], statuses={})
+    salt = random.randrange(1 << 20)
+    rng = random.Random(args.seed)
+    plan = [[rng.random() < args.cancel_fraction for _ in range(args.tasks)] for _ in range(args.clients)]
+    limits = httpx.Limits(max_connections=args.clients + 8)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as http:
+        await wait_for_app(http, args.startup_timeout)
+        # One task before measuring, which also waits for the worker to come up.
+        async with websockets.connect(ws_url) as ws:
+            warmup = {name: [] for name in LATENCIES}
+            warmup.update(updates=0, errors=[])
+            status = await run_task(http, ws, "bench-warmup", distinct_config(-1, salt, args.epochs), False, warmup,
+                                    args.startup_timeout)
+            if status != "SUCCESS":
+                raise RuntimeError(f"Warmup task failed: {warmup['errors'] or status}")
+
+        async def user(index):
+            async with websockets.connect(ws_url, max_queue=None) as ws:
+                for n, cancel in enumerate(plan[index]):
+                    config = distinct_config(index * args.tasks + n, salt, args.epochs)
+                    status = await run_task(http, ws, f"bench-{index}", config, cancel, stats, args.timeout)
+                    stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(args.clients)))
+        elapsed = time.perf_counter() - start
+
+    finished = sum(count for status, count in stats["statuses"].items() if status is not None)
+    return {
+        "seconds": elapsed,
+        "tasks_per_sec": finished / elapsed,
+        "updates_per_sec": stats["updates"] / elapsed,
+        "statuses": {str(status): count for status, count in stats["statuses"].items()},
+        "errors": stats["errors"],
+        **{name: summarize(stats[name]) for name in LATENCIES},
+    }
+
+
+def print_results(results, baseline=None):
+    print(f"{'':>16} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name in LATENCIES:
+        r = results[name]
+        row = f"{name:>16} {r['count']:6d}" + "".join(f" {r[q]:9.1f}" if r[q] is not None else f" {'-':>9}" for q in ("p50", "p95", "p99"))
+        if baseline and baseline.get(name):
+            changes = [f"{(r[q] - baseline[name][q]) / baseline[name][q]:+.0%}" if r[q] and baseline[name].get(q) else "-"
+                       for q in ("p50", "p95", "p99")]
+            row += "   vs baseline " + " ".join(changes)
+        print(row)
+    print(f"{results['tasks_per_sec']:.2f} tasks/sec, {results['updates_per_sec']:.1f} updates/sec over {results['seconds']:.1f}s, "
+          f"final statuses {results['statuses']}")
+    if baseline:
+        print(f"baseline: {baseline['tasks_per_sec']:.2f} tasks/sec, {baseline['updates_per_sec']:.1f} updates/sec")
+    for error in results["errors"][:10]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=16, help="concurrent simulated users")
+    parser.add_argument("--tasks", type=int, default=4, help="tasks submitted by every user, one after the other")
+    parser.add_argument("--cancel-fraction", type=float, default=0.25, help="share of the tasks cancelled once running")
+    parser.add_argument("--epochs", type=int, default=3, help="epochs of every task")
+    parser.add_argument("--epoch-seconds", type=float, default=0.5, help="duration of a stub epoch")
+    parser.add_argument("--worker-concurrency", type=int, default=8, help="stub worker processes")
+    parser.add_argument("--redis-url", default=None, help="use a real Redis server instead of fakeredis")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the choice of tasks to cancel")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds a single task may take")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    parser.add_argument("--compare", default=None, help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix="bench-e2e-")
+    port = free_port()
+    env = dict(os.environ,
+               REDIS_URL=args.redis_url or start_redis_stand_in(),
+               ARTIFACT_DIR=os.path.join(log_dir, "artifacts"),
+               # The app and the worker are separate processes here; they only share Redis.
+               PYTHONPATH=os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get("PYTHONPATH")])),
+               # A warmup would train a real model in every stub process, the exporter would need a free port.
+               WORKER_WARMUP="0", WORKER_METRICS_PORT="0",
+               BENCH_EPOCH_SECONDS=str(args.epoch_seconds),
+               # Room for every simulated user's tasks; /train must never answer with 429.
+               MAX_TASKS_PER_CLIENT=str(max(2, args.tasks)),
+               TF_CPP_MIN_LOG_LEVEL="2")
+    from config import FAST_LANE_QUEUE, TRAIN_QUEUE
+
+    processes = []
+    try:
+        with open(os.path.join(log_dir, "worker.log"), "w") as worker_log, open(os.path.join(log_dir, "app.log"), "w") as app_log:
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "celery", "-A", "stub_worker", "worker", "-Q", f"{TRAIN_QUEUE},{FAST_LANE_QUEUE}",
+                 "-c", str(args.worker_concurrency), "--loglevel=warning"],
+                cwd=BENCH_DIR, env=env, stdout=worker_log, stderr=subprocess.STDOUT))
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+                cwd=BACKEND_DIR, env=env, stdout=app_log, stderr=subprocess.STDOUT))
+            results = asyncio.run(run(args, f"http://127.0.0.1:{port}"))
+    except Exception:
+        print(f"Logs of the app and the worker: {log_dir}")
+        raise
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"commit": current_commit(), "created": time.time(), "config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
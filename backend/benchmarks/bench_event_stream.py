@@ -0,0 +1,77 @@
+# META
+
+# Description: Throughput benchmark for the durable per-task event log in events.py, run against
+# fakeredis as a local stand-in for Redis (or a real server with --redis-url). Measures:
+#   - append: events/sec written with append_event() (XADD with approximate MAXLEN trimming + EXPIRE),
+#     the way the worker writes every epoch-level event;
+#   - fan-out: events/sec delivered when many clients replay a task's stream concurrently with
+#     read_events(), the way the app serves WebSocket clients subscribing with an offset.
+# Note that fakeredis runs in-process, so absolute numbers mostly reflect client-side overhead; use
+# --redis-url against a real server to include network and server costs. fakeredis is not a
+# dependency of the backend itself; install it with `pip install fakeredis` to run this benchmark.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_event_stream.py --events 20000 --readers 200
+#   python benchmarks/bench_event_stream.py --redis-url redis://localhost:6379/0
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from events import append_event, read_events, stream_key  # noqa: E402
+
+
+def make_clients(redis_url):
+    if redis_url:
+        import redis
+        import redis.asyncio as aioredis
+        return redis.Redis.from_url(redis_url), aioredis.from_url(redis_url)
+    import fakeredis
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+
+
+def bench_append(redis_client, task_id, num_events):
+    update = {'task_id': task_id, 'status': 'PROGRESS', 'epoch': 0,
+              'logs': {'loss': 1.0, 'accuracy': 0.5, 'val_loss': 1.0, 'val_accuracy': 0.5}}
+    start = time.perf_counter()
+    for epoch in range(num_events):
+        update['epoch'] = epoch
+        append_event(redis_client, task_id, update)
+    return num_events / (time.perf_counter() - start)
+
+
+async def bench_fanout(async_client, task_id, num_readers):
+    start = time.perf_counter()
+    results = await asyncio.gather(*(read_events(async_client, task_id, "0") for _ in range(num_readers)))
+    elapsed = time.perf_counter() - start
+    return sum(len(events) for events in results) / elapsed, len(results[0])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20000, help="events appended to the stream")
+    parser.add_argument("--readers", type=int, default=200, help="concurrent clients replaying the stream")
+    parser.add_argument("--redis-url", default=None, help="benchmark a real Redis server instead of fakeredis")
+    args = parser.parse_args()
+
+    redis_client, async_client = make_clients(args.redis_url)
+    task_id = "bench-task"
+    redis_client.delete(stream_key(task_id))
+
+    append_rate = bench_append(redis_client, task_id, args.events)
+    stream_length = redis_client.xlen(stream_key(task_id))
+    print(f"append : {append_rate:12.0f} events/sec ({args.events} appended, {stream_length} retained after trimming)")
+
+    fanout_rate, replayed = asyncio.run(bench_fanout(async_client, task_id, args.readers))
+    print(f"fan-out: {fanout_rate:12.0f} events/sec ({args.readers} readers x {replayed} events)")
+
+    redis_client.delete(stream_key(task_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# META
+
+# Description: Throughput benchmark (images/sec) for the training input pipeline. Compares the old
+# ImageDataGenerator.flow() path with the batched tf.data pipeline in pipeline.py by pulling a fixed
+# number of augmented batches out of each, without any model in the loop, so only input cost is
+# measured.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_input_pipeline.py                  # synthetic CIFAR-shaped data
+#   python benchmarks/bench_input_pipeline.py --cifar          # preprocessed arrays from dataset.py
+#   DATA_PARALLEL_CALLS=2 python benchmarks/bench_input_pipeline.py --batch-size 128
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tensorflow as tf  # noqa: E402
+from pipeline import build_train_dataset  # noqa: E402
+
+
+def load_data(use_cifar, num_images):
+    if use_cifar:
+        from dataset import load_dataset
+        dataset = load_dataset()
+        return dataset.x_train, dataset.y_train
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((num_images, 32, 32, 3), dtype=np.float32)
+    y = rng.integers(0, 10, (num_images, 1), dtype=np.uint8)
+    return x, y
+
+
+# Pulls num_batches batches from an iterator after a few warmup batches and returns images/sec.
+def measure(iterator, num_batches, batch_size, warmup=5):
+    for _ in range(warmup):
+        next(iterator)
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        next(iterator)
+    elapsed = time.perf_counter() - start
+    return num_batches * batch_size / elapsed
+
+
+def bench_image_data_generator(x, y, batch_size, num_batches):
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+    datagen = ImageDataGenerator(width_shift_range=0.1, height_shift_range=0.1, horizontal_flip=True)
+    return measure(iter(datagen.flow(x, y, batch_size=batch_size)), num_batches, batch_size)
+
+
+def bench_tf_data(x, y, batch_size, num_batches):
+    ds = build_train_dataset(x, y, batch_size).repeat()
+    return measure(iter(ds), num_batches, batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cifar", action="store_true", help="use the cached CIFAR-10 arrays instead of synthetic data")
+    parser.add_argument("--num-images", type=int, default=50000, help="size of the synthetic training set")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--batches", type=int, default=200)
+    args = parser.parse_args()
+
+    x, y = load_data(args.cifar, args.num_images)
+    print(f"TensorFlow {tf.__version__}, {os.cpu_count()} CPUs, {len(x)} images, batch size {args.batch_size}")
+
+    generator_rate = bench_image_data_generator(x, y, args.batch_size, args.batches)
+    print(f"ImageDataGenerator.flow : {generator_rate:10.0f} images/sec")
+    tf_data_rate = bench_tf_data(x, y, args.batch_size, args.batches)
+    print(f"tf.data pipeline        : {tf_data_rate:10.0f} images/sec")
+    print(f"speedup                 : {tf_data_rate / generator_rate:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# META
+
+# Description: Cost of the Prometheus instrumentation (see metrics.py) relative to training
+# throughput. Trains the same model on the real training pipeline (pipeline.py, fed from synthetic
+# CIFAR-shaped arrays) alternately with the instrumentation on and off, several rounds each, and
+# compares the median images/sec. "Off" swaps the data loading counter for a no-op and skips the
+# per-epoch observations. Since a difference below 1% is easily lost in run-to-run noise, the cost of
+# every instrumentation call is also timed on its own and projected onto the measured epoch: one
+# counter increment per batch loaded plus the observations made once per epoch. --multiprocess
+# measures prometheus_client's multiprocess mode, which the workers run in.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_metrics.py
+#   python benchmarks/bench_metrics.py --units 32 --batch-size 32 --rounds 5 --multiprocess
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _NoOp:
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+
+# Average seconds per call of fn over 'calls' calls.
+def per_call(fn, calls=100000):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--units", type=int, default=64, help="units of every conv layer")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--samples", type=int, default=8192, help="size of the synthetic training set")
+    parser.add_argument("--epochs", type=int, default=3, help="epochs per round; the first one is excluded")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds with the instrumentation on and off each")
+    parser.add_argument("--multiprocess", action="store_true", help="use prometheus_client's multiprocess mode")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    # prometheus_client picks its mode when the first metric is created, i.e. when metrics.py is imported.
+    if args.multiprocess:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="bench-metrics-")
+
+    import tensorflow as tf
+    import metrics
+    import pipeline
+    from precision import ThroughputCallback
+    from worker import build_model
+
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((args.samples, 32, 32, 3), dtype=np.float32)
+    y = rng.integers(0, 10, (args.samples, 1), dtype=np.uint8)
+    counter = metrics.DATA_LOADING_SECONDS
+
+    # The observations train_model makes at the end of every epoch.
+    class EpochMetrics(tf.keras.callbacks.Callback):
+        def __init__(self, throughput):
+            super().__init__()
+            self.throughput = throughput
+
+        def on_epoch_end(self, epoch, logs=None):
+            rate = self.throughput.epoch_rates[-1] if self.throughput.epoch_rates else None
+            metrics.observe_epoch(time.perf_counter() - self.throughput.epoch_start, self.throughput.last_elapsed, rate)
+
+    def run(instrumented):
+        pipeline.DATA_LOADING_SECONDS = counter if instrumented else _NoOp()
+        model = build_model(args.layers, [args.units] * args.layers)
+        model.compile(optimizer="adam", loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+        throughput = ThroughputCallback(args.batch_size)
+        callbacks = [throughput, EpochMetrics(throughput)] if instrumented else [throughput]
+        model.fit(pipeline.build_train_dataset(x, y, args.batch_size), epochs=args.epochs, callbacks=callbacks, verbose=0)
+        return throughput.images_per_sec()
+
+    rates = {"on": [], "off": []}
+    for round_index in range(args.rounds):
+        for mode in ("off", "on") if round_index % 2 else ("on", "off"):
+            rate = run(mode == "on")
+            rates[mode].append(rate)
+            print(f"round {round_index + 1} {mode:>3}: {rate:8.0f} images/sec")
+    on, off = statistics.median(rates["on"]), statistics.median(rates["off"])
+    measured = (off - on) / off
+
+    # Projection from the cost of the individual calls.
+    train_counter = counter.labels("train")
+    inc_cost = per_call(lambda: train_counter.inc(0.001))
+    epoch_cost = per_call(lambda: metrics.observe_epoch(1.0, 1.0, 1000.0), 10000)
+    batches = -(-args.samples // args.batch_size)
+    epoch_seconds = args.samples / off
+    projected = (batches * inc_cost + epoch_cost) / epoch_seconds
+
+    print(f"images/sec: {on:.0f} instrumented, {off:.0f} without ({measured:+.2%} measured cost)")
+    print(f"per call: counter increment {inc_cost * 1e6:.2f} us, epoch observations {epoch_cost * 1e6:.2f} us")
+    print(f"projected cost: {projected:.4%} of an epoch of {epoch_seconds:.2f}s ({batches} batches)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "images_per_sec": rates, "measured_cost": measured,
+                       "increment_seconds": inc_cost, "epoch_observation_seconds": epoch_cost,
+                       "projected_cost": projected}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
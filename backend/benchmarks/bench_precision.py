@@ -0,0 +1,97 @@
+# META
+
+# Description: Training throughput (images/sec) of the precision and XLA modes in precision.py, across
+# the model sizes TrainModelRequest allows: 1 to 3 conv layers, each with the given number of units.
+# Every model is trained on a fixed synthetic batch repeated in memory, so the input pipeline is out of
+# the picture and only the train step is measured. The first epoch (tracing, XLA compilation) is
+# excluded, exactly like ThroughputCallback does for real tasks. Modes:
+#   float32          Keras defaults, what train_model runs unless asked otherwise
+#   float32+xla      jit=True
+#   bf16             precision="mixed_bfloat16"
+#   bf16+xla         both
+# The bf16 modes are skipped on hosts without native bfloat16 support, where train_model would fall
+# back to float32 anyway (pass --force-bf16 to measure the emulated path). The summary names the mode
+# that is fastest for the most configurations, as a per-host default.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_precision.py
+#   python benchmarks/bench_precision.py --units 32,256,1024 --batch-size 64 --json precision.json
+
+import argparse
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tensorflow as tf  # noqa: E402
+from precision import (ThroughputCallback, bf16_supported, jit_compile_setting,  # noqa: E402
+                       precision_policy)
+from worker import build_model  # noqa: E402
+
+MODES = {
+    "float32": ("float32", False),
+    "float32+xla": ("float32", True),
+    "bf16": ("mixed_bfloat16", False),
+    "bf16+xla": ("mixed_bfloat16", True),
+}
+
+
+def measure(layers, units, batch_size, steps, precision, jit):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((batch_size, 32, 32, 3), dtype=np.float32)
+    y = rng.integers(0, 10, (batch_size, 1), dtype=np.uint8)
+    data = tf.data.Dataset.from_tensors((x, y)).repeat()
+    with precision_policy(precision):
+        model = build_model(layers, [units] * layers)
+    model.compile(optimizer="adam", loss="sparse_categorical_crossentropy", metrics=["accuracy"],
+                  jit_compile=jit_compile_setting(jit))
+    throughput = ThroughputCallback(batch_size)
+    model.fit(data, epochs=3, steps_per_epoch=steps, callbacks=[throughput], verbose=0)
+    return throughput.images_per_sec()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--units", default="32,128,512,1024", help="comma-separated units per layer to try")
+    parser.add_argument("--layers", default="1,2,3", help="comma-separated numbers of conv layers to try")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=20, help="training steps per measured epoch")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated modes to compare")
+    parser.add_argument("--force-bf16", action="store_true", help="measure bf16 even without native support")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    modes = args.modes.split(",")
+    if not bf16_supported() and not args.force_bf16:
+        print("No native bfloat16 support on this host, skipping the bf16 modes")
+        modes = [mode for mode in modes if MODES[mode][0] == "float32"]
+
+    results = []
+    print(f"{'layers':>6} {'units':>6} " + " ".join(f"{mode:>12}" for mode in modes) + "   best")
+    for layers in (int(value) for value in args.layers.split(",")):
+        for units in (int(value) for value in args.units.split(",")):
+            rates = {mode: measure(layers, units, args.batch_size, args.steps, *MODES[mode]) for mode in modes}
+            best = max(rates, key=rates.get)
+            results.append({"layers": layers, "units": units, "images_per_sec": rates, "best": best})
+            print(f"{layers:>6} {units:>6} " + " ".join(f"{rates[mode]:12.0f}" for mode in modes) + f"   {best}")
+
+    # Geometric mean speedup of every mode over float32, and the mode that wins most configurations.
+    speedups = {mode: math.exp(sum(math.log(r["images_per_sec"][mode] / r["images_per_sec"][modes[0]]) for r in results) / len(results))
+                for mode in modes}
+    wins = {mode: sum(r["best"] == mode for r in results) for mode in modes}
+    default = max(modes, key=lambda mode: (wins[mode], speedups[mode]))
+    print("speedup vs " + modes[0] + ": " + ", ".join(f"{mode} {speedups[mode]:.2f}x" for mode in modes))
+    print(f"suggested default for this host: {default} (fastest for {wins[default]} of {len(results)} configurations)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"batch_size": args.batch_size, "steps": args.steps, "bf16_supported": bf16_supported(),
+                       "results": results, "speedups": speedups, "suggested_default": default}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
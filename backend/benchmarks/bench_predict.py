@@ -0,0 +1,105 @@
+# META
+
+# Description: Latency and throughput of /predict's inference path (see serving.py) with and without
+# micro-batching. A model of the given shape is stored with model_store.save_model() in a temporary
+# artifact directory (its weights are untrained, which doesn't change the cost of a forward pass),
+# then 'clients' concurrent clients each send requests of 'images' images back to back, in process,
+# through a ModelCache, exactly as the endpoint does. Modes:
+#   unbatched    every request is its own forward pass (max batch of 1 request)
+#   batched      the requests queued behind a running pass are grouped into the next one, of up to
+#                --max-batch images, held open for another --window-ms (default PREDICT_BATCH_WINDOW_MS)
+# With closed-loop clients like these, requests queue up behind every pass anyway, so a window only
+# adds latency: for the default model, 32 clients batch to ~6x the unbatched throughput with no window
+# but ~2.5x with a 5 ms one (SavedModel; TFLite, whose passes are far cheaper, ~2x and ~0.4x).
+# Reports requests/sec, images/sec and latency percentiles for each, plus the mean batch size.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_predict.py
+#   python benchmarks/bench_predict.py --format tflite --clients 64 --window-ms 1 --json predict.json
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+async def run(cache, model_id, clients, requests_per_client, images):
+    latencies, batch_sizes = [], []
+
+    async def client():
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            _, batch_size = await cache.predict(model_id, images)
+            latencies.append(time.perf_counter() - start)
+            batch_sizes.append(batch_size)
+
+    await cache.predict(model_id, images)  # load the model and trace the first batch size
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests_per_sec": len(latencies) / elapsed,
+        "images_per_sec": len(latencies) * len(images) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_batch_images": statistics.mean(batch_sizes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--units", default="32,64", help="comma-separated units per layer")
+    parser.add_argument("--format", default="savedmodel", choices=("savedmodel", "tflite"))
+    parser.add_argument("--clients", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--images", type=int, default=1, help="images per request")
+    parser.add_argument("--window-ms", type=float, default=None)
+    parser.add_argument("--max-batch", type=int, default=None)
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    os.environ["ARTIFACT_DIR"] = tempfile.mkdtemp(prefix="bench-predict-")
+    from config import PREDICT_BATCH_WINDOW_MS, PREDICT_MAX_BATCH
+    from model_store import load_model, save_model
+    from serving import ModelCache
+    from worker import build_model
+
+    window_ms = PREDICT_BATCH_WINDOW_MS if args.window_ms is None else args.window_ms
+    max_batch = PREDICT_MAX_BATCH if args.max_batch is None else args.max_batch
+
+    units = [int(u) for u in args.units.split(",")]
+    meta = save_model("bench", build_model(args.layers, units), np.zeros(3, np.float32), {}, args.format)
+    print(f"{args.format} model: {meta['size_bytes'] / 1024:.0f} KiB")
+    images = np.random.default_rng(0).integers(0, 256, (args.images, 32, 32, 3)).astype(np.float32)
+
+    modes = {"unbatched": (0.0, args.images), "batched": (window_ms, max(max_batch, args.images))}
+    results = {}
+    print(f"{'mode':>10} {'req/s':>8} {'img/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'batch':>6}")
+    for mode, (window_ms, max_batch) in modes.items():
+        cache = ModelCache(load_model, capacity=1, window_ms=window_ms, max_batch=max_batch)
+        r = results[mode] = asyncio.run(run(cache, "bench", args.clients, args.requests, images))
+        print(f"{mode:>10} {r['requests_per_sec']:8.0f} {r['images_per_sec']:8.0f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+              f"{r['p99_ms']:8.1f} {r['mean_batch_images']:6.1f}")
+    print(f"throughput gain from micro-batching: {results['batched']['requests_per_sec'] / results['unbatched']['requests_per_sec']:.2f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "model_size_bytes": meta["size_bytes"], "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# META
+
+# Description: How much publishing training updates slows training down, inline as publish_update()
+# used to do it (event stream append + PUBLISH on the training thread) versus through the background
+# publisher (see publisher.py). A simulated training loop sleeps --step-ms per training step and
+# publishes what train_model does: a BATCH update every --batch-every steps, a PROGRESS update per
+# epoch and a final SUCCESS. Redis (fakeredis' TCP server unless --redis-url is given) is reached
+# through a local TCP proxy that adds --latency-ms to every forwarded chunk in each direction, and
+# --outage-seconds stalls the proxy completely for that long in the middle of the run, which is what a
+# briefly unreachable Redis looks like to the worker. A subscriber connected to Redis directly counts
+# the updates that arrive and how late. Reports, per mode, the training slowdown over the pure compute
+# time, the time the training loop spent blocked in publish calls, and delivered, dropped and retried
+# updates, as well as the publish calls that raised, each of which used to fail the training task.
+# Needs `pip install "fakeredis[lua]"` unless --redis-url is given.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_publisher.py
+#   python benchmarks/bench_publisher.py --latency-ms 5 --outage-seconds 2 --json publisher.json
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_distributed import start_redis_stand_in  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))] if values else None
+
+
+# Forwards TCP connections to Redis, delaying every chunk by 'latency' seconds. While paused, nothing
+# is forwarded in either direction.
+class LatencyProxy:
+    def __init__(self, host, port, latency):
+        self.target = (host, port)
+        self.latency = latency
+        self.running = threading.Event()
+        self.running.set()
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(self.target)
+            for s in (client, upstream):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for src, dst in ((client, upstream), (upstream, client)):
+                threading.Thread(target=self._pump, args=(src, dst), daemon=True).start()
+
+    def _pump(self, src, dst):
+        try:
+            while data := src.recv(65536):
+                self.running.wait()
+                if self.latency:
+                    time.sleep(self.latency)
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for s in (src, dst):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+# Collects the updates published on model_updates:* with their delivery delay.
+class Subscriber:
+    def __init__(self, redis_url):
+        import redis
+        self.pubsub = redis.Redis.from_url(redis_url).pubsub()
+        self.pubsub.psubscribe("model_updates:*")
+        self.pubsub.get_message(timeout=1.0)
+        self.received = {}
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            message = self.pubsub.get_message(timeout=1.0)
+            if message and message["type"] == "pmessage":
+                update = json.loads(message["data"])
+                self.received.setdefault(update["task_id"], []).append((update, time.time() - update["timestamp"]))
+
+
+def run(mode, args, proxy, redis_url, subscriber):
+    import redis
+    import metrics
+    from events import append_event
+    from publisher import BackgroundPublisher
+
+    task_id = str(uuid.uuid4())
+    if mode == "inline":
+        # The worker's old client; every call waits for Redis. An error here would have failed the task;
+        # it's counted instead.
+        client = redis.Redis.from_url(redis_url)
+
+        def publish(update):
+            update = {'task_id': task_id, 'timestamp': time.time(), **update}
+            try:
+                if update['status'] != "BATCH":
+                    update['event_id'] = append_event(client, task_id, update)
+                client.publish(f"model_updates:{task_id}", json.dumps(update))
+            except redis.RedisError:
+                errors.append(update)
+    else:
+        publisher = BackgroundPublisher(redis_url)
+
+        def publish(update):
+            publisher.publish(task_id, {'task_id': task_id, 'timestamp': time.time(), **update})
+
+    def counter(name, **labels):
+        return metrics.WORKER_REGISTRY.get_sample_value(name, labels) or 0.0
+
+    before = {reason: counter("redis_publish_dropped_total", reason=reason) for reason in ("queue_full", "redis_unavailable", "error")}
+    retries_before = counter("redis_publish_retries_total")
+    total_steps = args.epochs * args.steps
+    outage_at = total_steps // 2 if args.outage_seconds else None
+    blocked, errors, published = [], [], 0
+    start = time.perf_counter()
+    for epoch in range(args.epochs):
+        for step in range(args.steps):
+            if epoch * args.steps + step == outage_at:
+                proxy.running.clear()
+                threading.Timer(args.outage_seconds, proxy.running.set).start()
+            time.sleep(args.step_ms / 1000)
+            if (step + 1) % args.batch_every == 0:
+                t = time.perf_counter()
+                publish({'status': "BATCH", 'epoch': epoch + 1, 'batch': step + 1})
+                blocked.append(time.perf_counter() - t)
+                published += 1
+        t = time.perf_counter()
+        publish({'status': "PROGRESS", 'epoch': epoch + 1, 'logs': {'loss': 1.0}})
+        blocked.append(time.perf_counter() - t)
+        published += 1
+    training_seconds = time.perf_counter() - start
+    publish({'status': "SUCCESS", 'test_accuracy': 0.5})
+    published += 1
+    if mode == "background":
+        publisher.flush()
+    proxy.running.set()
+    time.sleep(0.5)  # lets the subscriber catch up
+
+    compute = total_steps * args.step_ms / 1000
+    delays = [delay for _, delay in subscriber.received.get(task_id, [])]
+    return {
+        "training_seconds": training_seconds,
+        "slowdown": training_seconds / compute - 1,
+        "blocked_seconds": sum(blocked),
+        "blocked_p50_ms": percentile(blocked, 50) * 1000,
+        "blocked_p99_ms": percentile(blocked, 99) * 1000,
+        "blocked_max_ms": max(blocked) * 1000,
+        "published": published,
+        "delivered": len(delays),
+        "delivery_p50_ms": percentile(delays, 50) * 1000 if delays else None,
+        "delivery_p99_ms": percentile(delays, 99) * 1000 if delays else None,
+        "dropped": {reason: counter("redis_publish_dropped_total", reason=reason) - value for reason, value in before.items()},
+        "retries": counter("redis_publish_retries_total") - retries_before,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--steps", type=int, default=200, help="training steps per epoch")
+    parser.add_argument("--step-ms", type=float, default=5.0, help="simulated compute per training step")
+    parser.add_argument("--batch-every", type=int, default=20, help="steps between two BATCH updates")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="delay the proxy adds per chunk and direction")
+    parser.add_argument("--outage-seconds", type=float, default=0.0, help="stall Redis this long in the middle of training")
+    parser.add_argument("--redis-url", default=None, help="use a real Redis server instead of fakeredis")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    from urllib.parse import urlparse
+    redis_url = args.redis_url or start_redis_stand_in()
+    target = urlparse(redis_url)
+    proxy = LatencyProxy(target.hostname, target.port or 6379, args.latency_ms / 1000)
+    proxied_url = f"redis://127.0.0.1:{proxy.port}{target.path or '/0'}"
+    subscriber = Subscriber(redis_url)
+
+    results = {}
+    print(f"{'mode':>10} {'slowdown':>9} {'blocked s':>9} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>8} {'delivered':>10} "
+          f"{'late p99':>9} {'dropped':>8} {'retries':>7} {'errors':>6}")
+    for mode in ("inline", "background"):
+        r = results[mode] = run(mode, args, proxy, proxied_url, subscriber)
+        late = f"{r['delivery_p99_ms']:9.1f}" if r['delivery_p99_ms'] is not None else f"{'-':>9}"
+        print(f"{mode:>10} {r['slowdown']:9.1%} {r['blocked_seconds']:9.2f} {r['blocked_p50_ms']:7.2f} {r['blocked_p99_ms']:7.2f} "
+              f"{r['blocked_max_ms']:8.1f} {r['delivered']:>4}/{r['published']:<5} {late} {sum(r['dropped'].values()):8.0f} "
+              f"{r['retries']:7.0f} {r['errors']:6d}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
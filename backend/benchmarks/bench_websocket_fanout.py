@@ -0,0 +1,98 @@
+# META
+
+# Description: Load test for the WebSocket fan-out in connections.py. Registers hundreds of simulated
+# WebSocket clients with a ConnectionManager, a share of which are deliberately slow, publishes a
+# stream of training updates spread over a set of task ids, and reports:
+#   - how long each publish() call blocks the caller (i.e. the Redis listener loop),
+#   - end-to-end delivery latency percentiles for the fast clients,
+#   - how many updates were dropped for the slow clients.
+# The simulated sockets sleep for a configurable time inside send_text(), which is what a congested
+# client looks like from the server's point of view.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_websocket_fanout.py --clients 500 --slow-fraction 0.1
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connections import ConnectionManager  # noqa: E402
+
+
+class SimulatedWebSocket:
+    def __init__(self, send_delay):
+        self.send_delay = send_delay
+        self.latencies = []
+
+    async def send_text(self, message):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.latencies.append(time.perf_counter() - json.loads(message)['sent_at'])
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+async def run(args):
+    manager = ConnectionManager(max_queue=args.max_queue)
+    task_ids = [f"task-{i}" for i in range(args.tasks)]
+    fast, slow = [], []
+    for i in range(args.clients):
+        is_slow = i < int(args.clients * args.slow_fraction)
+        websocket = SimulatedWebSocket(args.slow_delay if is_slow else 0)
+        client = manager.connect(websocket)
+        manager.subscribe(client, task_ids[i % len(task_ids)])
+        (slow if is_slow else fast).append((client, websocket))
+
+    publish_times = []
+    for n in range(args.messages):
+        task_id = task_ids[n % len(task_ids)]
+        message = json.dumps({'task_id': task_id, 'status': 'PROGRESS', 'epoch': n, 'sent_at': time.perf_counter()})
+        start = time.perf_counter()
+        manager.publish(task_id, message)
+        publish_times.append(time.perf_counter() - start)
+        await asyncio.sleep(args.interval)
+
+    # Give the fast clients' sender tasks a moment to drain their queues.
+    await asyncio.sleep(0.5)
+
+    fast_latencies = [latency for _, websocket in fast for latency in websocket.latencies]
+    dropped = sum(client.dropped for client, _ in slow)
+    delivered_slow = sum(len(websocket.latencies) for _, websocket in slow)
+
+    print(f"{args.clients} clients ({len(slow)} slow, {args.slow_delay * 1000:.0f} ms per send), "
+          f"{args.tasks} tasks, {args.messages} updates")
+    print(f"publish() time     : mean {statistics.mean(publish_times) * 1e6:8.1f} us, "
+          f"p99 {percentile(publish_times, 99) * 1e6:8.1f} us")
+    if fast_latencies:
+        print(f"fast client latency: p50 {percentile(fast_latencies, 50) * 1000:7.2f} ms, "
+              f"p95 {percentile(fast_latencies, 95) * 1000:7.2f} ms, "
+              f"p99 {percentile(fast_latencies, 99) * 1000:7.2f} ms ({len(fast_latencies)} deliveries)")
+    print(f"slow clients       : {delivered_slow} delivered, {dropped} dropped")
+
+    for client, _ in fast + slow:
+        manager.disconnect(client)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--tasks", type=int, default=10, help="number of distinct task ids clients subscribe to")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=0.001, help="seconds between published updates")
+    parser.add_argument("--slow-fraction", type=float, default=0.1)
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="seconds each send takes on a slow client")
+    parser.add_argument("--max-queue", type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
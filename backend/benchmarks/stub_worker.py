@@ -0,0 +1,56 @@
+# META
+
+# Description: Celery worker for bench_e2e.py. It is worker.py's own Celery app, with the same queues,
+# signal handlers (scheduler bookkeeping, metrics) and publish_update(), except that train_model
+# trains nothing: every epoch is BENCH_STEPS steps of sleeping, BENCH_EPOCH_SECONDS in total, during
+# which batch progress goes through a real ProgressReporter and the abort flag is checked every
+# ABORT_CHECK_EVERY_N_BATCHES steps like AbortCallback does. The PROGRESS, SUCCESS and CANCELLED updates
+# have the same shape as the real task's. Everything between /train and the WebSocket thus runs the
+# production code, and what the benchmark measures is that path, not TensorFlow.
+#
+# Usage (bench_e2e.py starts it; by hand, from this directory with the backend directory on
+# PYTHONPATH):
+#   BENCH_EPOCH_SECONDS=0.5 celery -A stub_worker worker -Q celery,fast_lane -c 4
+
+import os
+import time
+
+from celery.signals import celeryd_after_setup
+
+import worker
+from config import ABORT_CHECK_EVERY_N_BATCHES
+from progress import ProgressReporter
+from worker import celery, publish_update  # celery is the app `celery -A stub_worker` runs
+
+EPOCH_SECONDS = float(os.environ.get("BENCH_EPOCH_SECONDS", "0.5"))
+STEPS = int(os.environ.get("BENCH_STEPS", "20"))
+
+
+def train_model_stub(self, layers, units, epochs, batch_size, optimizer, precision="float32", jit=False, resume_from=None, sweep_id=None):
+    task_id = self.request.id
+    reporter = ProgressReporter(publish_update, task_id, epochs, STEPS)
+    history = []
+    for epoch in range(epochs):
+        logs = {}
+        for step in range(STEPS):
+            time.sleep(EPOCH_SECONDS / STEPS)
+            logs = {'loss': 2.3 / (epoch + 1 + step / STEPS), 'accuracy': 0.1 * (epoch + 1)}
+            reporter.batch_end(epoch, step, batch_size, logs)
+            if (step + 1) % max(1, ABORT_CHECK_EVERY_N_BATCHES) == 0 and self.is_aborted():
+                publish_update(task_id, {'status': "CANCELLED", 'epoch': epoch, 'logs': logs, 'history': history})
+                return
+        history.append({'epoch': epoch + 1, 'logs': logs})
+        publish_update(task_id, {'status': "PROGRESS", 'epoch': epoch + 1, 'logs': logs,
+                                 'images_per_sec': STEPS * batch_size / EPOCH_SECONDS})
+    publish_update(task_id, {'status': "SUCCESS", 'test_accuracy': 0.5, 'test_loss': 1.0, 'history': history,
+                             'precision': precision, 'jit': jit, 'images_per_sec': STEPS * batch_size / EPOCH_SECONDS,
+                             'model_saved': False})
+
+
+# Swapping the task's run() keeps its name, base class (CancellableTask) and registration, so the app's
+# train_model.apply_async() calls land here unchanged. worker.train_model itself is only a proxy until
+# the app is finalized, hence the lookup in the registry.
+type(celery.tasks[worker.train_model.name]).run = train_model_stub
+
+# The stub needs no dataset; don't have the main process build the CIFAR-10 cache (see warmup.py).
+celeryd_after_setup.disconnect(worker.prepare_worker)
@@ -0,0 +1,54 @@
+# META
+
+# Description: Cooperative cancellation of training tasks. /cancel used to revoke(terminate=True) the
+# task, which killed the whole prefork child process: the next task on that process then paid the
+# TensorFlow import and dataset load all over again, and nothing told the client what state training
+# was in when it stopped. /cancel now marks the task as aborted in the result backend
+# (AbortableAsyncResult.abort()), and AbortCallback, running inside model.fit(), checks that flag every
+# ABORT_CHECK_EVERY_N_BATCHES batches and sets model.stop_training. Training stops at the next batch
+# boundary, the process stays alive and warm, and the task publishes a final CANCELLED update.
+# /cancel also revokes the task, and a worker handed the revoke of a task it is running stores REVOKED
+# over the ABORTED state, so the training tasks run as CancellableTask, which takes either state for an
+# abort.
+
+import tensorflow as tf
+from celery import states
+from celery.contrib.abortable import ABORTED, AbortableTask
+
+from config import ABORT_CHECK_EVERY_N_BATCHES
+
+
+class CancellableTask(AbortableTask):
+    abstract = True
+
+    def is_aborted(self, **kwargs):
+        task_id = kwargs.get('task_id', self.request.id)
+        return self.AsyncResult(task_id).state in (ABORTED, states.REVOKED)
+
+
+class AbortCallback(tf.keras.callbacks.Callback):
+    # 'task' is the bound Celery task (an AbortableTask) whose abort flag is checked.
+    def __init__(self, task, every=ABORT_CHECK_EVERY_N_BATCHES):
+        super().__init__()
+        self.task = task
+        self.every = max(1, every)
+        self.batches = 0
+        self.aborted = False
+        # Metrics of the last batch trained before stopping, reported with the CANCELLED update.
+        self.last_logs = {}
+
+    def _check(self):
+        self.batches += 1
+        if not self.aborted and self.batches % self.every == 0 and self.task.is_aborted():
+            self.aborted = True
+        return self.aborted
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self._check():
+            self.last_logs = {name: float(value) for name, value in (logs or {}).items()}
+            self.model.stop_training = True
+
+    # model.fit() still runs validation for the interrupted epoch; cut that short as well.
+    def on_test_batch_end(self, batch, logs=None):
+        if self._check():
+            self.model.stop_evaluating = True
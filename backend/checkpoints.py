@@ -0,0 +1,131 @@
+# META
+
+# Description: Periodic checkpointing for train_model and resuming from those checkpoints. When a task
+# was cancelled or its worker process crashed, every finished epoch used to be lost and resubmitting
+# started over from epoch 0. CheckpointCallback snapshots the model's weights
+# and optimizer state at the end of every CHECKPOINT_EVERY_N_EPOCHS epochs; the snapshot itself is only
+# a copy of a few arrays, and writing it to disk happens on a background thread so the training loop
+# doesn't wait for the filesystem. Each checkpoint is a single .npz file, written to a temporary file
+# first and then renamed over the previous one, so a process killed mid-write never leaves a corrupt
+# checkpoint behind.
+#
+# Layout: <ARTIFACT_DIR>/checkpoints/<task_id>/checkpoint.npz, holding
+#   meta        JSON: task_id, training config, completed epochs, per-epoch history, dataset version
+#   weight_<i>  the model's weights, in model.get_weights() order
+#   opt_<i>     the optimizer's variables, in optimizer.variables order
+
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+from config import ARTIFACT_DIR, CHECKPOINT_EVERY_N_EPOCHS
+
+
+def checkpoint_path(task_id):
+    return os.path.join(ARTIFACT_DIR, "checkpoints", task_id, "checkpoint.npz")
+
+
+def checkpoint_exists(task_id):
+    return os.path.exists(checkpoint_path(task_id))
+
+
+def _write(path, meta, weights, optimizer_variables):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {"meta": np.array(json.dumps(meta))}
+    arrays.update({f"weight_{i}": w for i, w in enumerate(weights)})
+    arrays.update({f"opt_{i}": v for i, v in enumerate(optimizer_variables)})
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+# Returns the metadata of a task's checkpoint without loading its arrays, or None if there is none.
+def read_checkpoint_meta(task_id):
+    if not checkpoint_exists(task_id):
+        return None
+    with np.load(checkpoint_path(task_id)) as data:
+        return json.loads(str(data["meta"]))
+
+
+# Returns (meta, weights, optimizer_variables) of a task's checkpoint.
+def load_checkpoint(task_id):
+    with np.load(checkpoint_path(task_id)) as data:
+        meta = json.loads(str(data["meta"]))
+        weights = [data[f"weight_{i}"] for i in range(sum(name.startswith("weight_") for name in data.files))]
+        optimizer_variables = [data[f"opt_{i}"] for i in range(sum(name.startswith("opt_") for name in data.files))]
+    return meta, weights, optimizer_variables
+
+
+# Puts a compiled model back into the state of a checkpoint. The optimizer has to be built first so
+# that its variables (iteration count, moment estimates, ...) exist and can be assigned.
+def restore_model(model, weights, optimizer_variables):
+    model.set_weights(weights)
+    model.optimizer.build(model.trainable_variables)
+    for variable, value in zip(model.optimizer.variables, optimizer_variables):
+        variable.assign(value)
+
+
+# Writes checkpoints on a background thread. Only the most recent snapshot matters, so if the writer is
+# still busy when a new one arrives the older pending snapshot is simply replaced.
+class CheckpointWriter:
+    def __init__(self, task_id):
+        self.path = checkpoint_path(task_id)
+        self.pending = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=f"checkpoint-writer-{task_id}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            snapshot = self.pending.get()
+            if snapshot is None:
+                return
+            try:
+                _write(self.path, *snapshot)
+            except Exception as e:
+                self.error = e
+                print(f"Error writing checkpoint {self.path}: {e}")
+
+    def submit(self, meta, weights, optimizer_variables):
+        while True:
+            try:
+                self.pending.put_nowait((meta, weights, optimizer_variables))
+                return
+            except queue.Full:
+                try:
+                    self.pending.get_nowait()
+                except queue.Empty:
+                    pass
+
+    # Waits for the pending checkpoint, if any, to be written and stops the thread.
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+
+# Keras callback snapshotting the model every 'every' epochs and handing the snapshot to a
+# CheckpointWriter. 'meta' holds the task's training config; 'history' is the list of per-epoch logs
+# kept by the task, stored with the checkpoint so a resumed run can report the full history. If the
+# task's AbortCallback is given, an epoch cut short by cancellation is not checkpointed: its weights
+# are from the middle of the epoch, so the previous checkpoint is the one to resume from.
+class CheckpointCallback(tf.keras.callbacks.Callback):
+    def __init__(self, writer, meta, history, abort_callback=None, every=CHECKPOINT_EVERY_N_EPOCHS):
+        super().__init__()
+        self.writer = writer
+        self.meta = meta
+        self.history = history
+        self.abort_callback = abort_callback
+        self.every = max(1, every)
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.abort_callback is not None and self.abort_callback.aborted:
+            return
+        if (epoch + 1) % self.every and epoch + 1 != self.params.get('epochs'):
+            return
+        weights = self.model.get_weights()
+        optimizer_variables = [variable.numpy() for variable in self.model.optimizer.variables]
+        self.writer.submit({**self.meta, 'epoch': epoch + 1, 'history': list(self.history)}, weights, optimizer_variables)
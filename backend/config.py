@@ -0,0 +1,156 @@
+# META
+
+# Description: Central place for settings shared by the FastAPI app (app.py) and the Celery worker
+# (worker.py). Every value can be overridden through an environment variable of the same name, which
+# lets docker-compose.yaml tune a deployment without touching the code.
+
+import os
+
+# Directory the preprocessed CIFAR-10 arrays are written to. Both the backend and celery_worker
+# containers mount ./backend at /backend, so keeping the cache inside it means every worker process
+# (and every container) maps the very same files.
+DATASET_CACHE_DIR = os.environ.get(
+    "DATASET_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset_cache")
+)
+
+# Fraction of the training set held out for validation, and the seed used for the stratified split.
+# Fixing the seed makes the split deterministic, so every task trains and validates on the same images.
+DATASET_VALIDATION_SPLIT = float(os.environ.get("DATASET_VALIDATION_SPLIT", "0.1"))
+DATASET_SPLIT_SEED = int(os.environ.get("DATASET_SPLIT_SEED", "42"))
+
+# Identifies the preprocessing applied to the cached arrays. Any change to the preprocessing steps or
+# to the split parameters above produces a different version and thus a fresh cache directory.
+DATASET_VERSION = f"cifar10-v1-val{DATASET_VALIDATION_SPLIT}-seed{DATASET_SPLIT_SEED}"
+
+# tf.data input pipeline threading. DATA_PARALLEL_CALLS is the num_parallel_calls given to the
+# pipeline's map() stages and DATA_PREFETCH the prefetch() buffer, in batches; -1 lets tf.data tune
+# them (AUTOTUNE). DATA_THREADPOOL_SIZE gives each pipeline a private thread pool of that many threads
+# and DATA_MAX_INTRA_OP_PARALLELISM caps the threads a single pipeline op may use; 0 keeps TensorFlow's
+# defaults. Lower them when several worker processes share a host's cores.
+DATA_PARALLEL_CALLS = int(os.environ.get("DATA_PARALLEL_CALLS", "-1"))
+DATA_PREFETCH = int(os.environ.get("DATA_PREFETCH", "-1"))
+DATA_THREADPOOL_SIZE = int(os.environ.get("DATA_THREADPOOL_SIZE", "0"))
+DATA_MAX_INTRA_OP_PARALLELISM = int(os.environ.get("DATA_MAX_INTRA_OP_PARALLELISM", "0"))
+
+# Maximum number of undelivered updates queued per WebSocket client before the oldest ones are
+# dropped (see connections.py).
+WS_MAX_QUEUE = int(os.environ.get("WS_MAX_QUEUE", "100"))
+
+# Reconnect backoff for the FastAPI app's Redis listener (see listener.py), in seconds. The delay
+# starts at LISTENER_BACKOFF_INITIAL and doubles after every failed attempt up to LISTENER_BACKOFF_MAX.
+LISTENER_BACKOFF_INITIAL = float(os.environ.get("LISTENER_BACKOFF_INITIAL", "0.5"))
+LISTENER_BACKOFF_MAX = float(os.environ.get("LISTENER_BACKOFF_MAX", "30"))
+
+# Result cache for /train (see result_cache.py). Cached results expire after RESULT_CACHE_TTL seconds
+# and at most RESULT_CACHE_MAX_ENTRIES results are kept, evicting the least recently used ones.
+# RESULT_CACHE_INFLIGHT_TTL bounds how long a running task stays registered for deduplication in case
+# its final message never arrives.
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1000"))
+RESULT_CACHE_INFLIGHT_TTL = int(os.environ.get("RESULT_CACHE_INFLIGHT_TTL", str(24 * 3600)))
+
+# Maximum rate, in updates per second, at which a training task publishes batch-level progress
+# (loss, accuracy, samples/sec, ETA). Intermediate batches are coalesced into the next update.
+PROGRESS_HZ = float(os.environ.get("PROGRESS_HZ", "2"))
+
+# Durable per-task event log (see events.py). Each task's stream keeps roughly the last
+# EVENT_STREAM_MAXLEN events and expires EVENT_STREAM_TTL seconds after its last event.
+EVENT_STREAM_MAXLEN = int(os.environ.get("EVENT_STREAM_MAXLEN", "1000"))
+EVENT_STREAM_TTL = int(os.environ.get("EVENT_STREAM_TTL", str(24 * 3600)))
+
+# Local artifact directory for training checkpoints and trained models. Like the dataset cache it
+# lives under /backend, which both the backend and celery_worker containers mount, so the app can see
+# what the workers wrote.
+ARTIFACT_DIR = os.environ.get(
+    "ARTIFACT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts")
+)
+
+# train_model checkpoints its weights and optimizer state every CHECKPOINT_EVERY_N_EPOCHS epochs.
+CHECKPOINT_EVERY_N_EPOCHS = int(os.environ.get("CHECKPOINT_EVERY_N_EPOCHS", "1"))
+
+# How often, in batches, a running training task checks whether /cancel asked it to stop. Each check
+# is a single read from the Celery result backend.
+ABORT_CHECK_EVERY_N_BATCHES = int(os.environ.get("ABORT_CHECK_EVERY_N_BATCHES", "5"))
+
+# Worker process warmup (see warmup.py). With WORKER_WARMUP enabled every pool process loads the
+# dataset and runs a tiny training step, which its first task waits for. TF_INTRA_OP_THREADS and
+# TF_INTER_OP_THREADS pin TensorFlow's thread pools per process; 0 divides the host's cores evenly
+# between the worker's pool processes so that concurrent tasks don't oversubscribe them.
+WORKER_WARMUP = os.environ.get("WORKER_WARMUP", "1") == "1"
+TF_INTRA_OP_THREADS = int(os.environ.get("TF_INTRA_OP_THREADS", "0"))
+TF_INTER_OP_THREADS = int(os.environ.get("TF_INTER_OP_THREADS", "0"))
+
+# Scheduling of training tasks (see scheduling.py). Every task gets an estimated cost of
+# epochs x parameter count / batch size; tasks costing at most FAST_LANE_MAX_COST go to the
+# FAST_LANE_QUEUE, consumed by its own worker, everything else to TRAIN_QUEUE. TRAIN_QUEUE_SLOTS and
+# FAST_LANE_SLOTS are the number of worker processes consuming each queue, used to estimate start
+# times. SCHEDULER_SECONDS_PER_COST is the initial guess of how many seconds one unit of cost takes to
+# train; it is refined from the durations of finished tasks. MAX_TASKS_PER_CLIENT caps how many queued
+# or running tasks a single client can hold at once.
+TRAIN_QUEUE = os.environ.get("TRAIN_QUEUE", "celery")
+FAST_LANE_QUEUE = os.environ.get("FAST_LANE_QUEUE", "fast_lane")
+FAST_LANE_MAX_COST = float(os.environ.get("FAST_LANE_MAX_COST", "100000"))
+TRAIN_QUEUE_SLOTS = int(os.environ.get("TRAIN_QUEUE_SLOTS", "1"))
+FAST_LANE_SLOTS = int(os.environ.get("FAST_LANE_SLOTS", "1"))
+SCHEDULER_SECONDS_PER_COST = float(os.environ.get("SCHEDULER_SECONDS_PER_COST", "0.005"))
+MAX_TASKS_PER_CLIENT = int(os.environ.get("MAX_TASKS_PER_CLIENT", "2"))
+
+# Admission control (see estimator.py). /train, /train/batch and /resume reject configurations whose
+# estimated peak training memory exceeds ESTIMATE_MAX_MEMORY_MB or whose projected wall time exceeds
+# ESTIMATE_MAX_SECONDS. The projection assumes the worker sustains ESTIMATE_FLOPS_PER_SECOND and pays
+# ESTIMATE_STEP_OVERHEAD_SECONDS of fixed cost (input pipeline, callbacks, dispatch) per training step.
+ESTIMATE_MAX_MEMORY_MB = float(os.environ.get("ESTIMATE_MAX_MEMORY_MB", "4096"))
+ESTIMATE_MAX_SECONDS = float(os.environ.get("ESTIMATE_MAX_SECONDS", str(24 * 3600)))
+ESTIMATE_FLOPS_PER_SECOND = float(os.environ.get("ESTIMATE_FLOPS_PER_SECOND", "2e10"))
+ESTIMATE_STEP_OVERHEAD_SECONDS = float(os.environ.get("ESTIMATE_STEP_OVERHEAD_SECONDS", "0.002"))
+
+# Redis server used as Celery broker and result backend, for publishing training updates and for all
+# the state kept by the modules above.
+REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
+
+# Distributed data-parallel training (see distributed.py). A task may span at most
+# DISTRIBUTED_MAX_WORKERS worker processes, which must all have been reserved within
+# DISTRIBUTED_RESERVE_TIMEOUT seconds. DISTRIBUTED_HOST is the address other workers reach this one at;
+# empty means the address the host name resolves to.
+DISTRIBUTED_MAX_WORKERS = int(os.environ.get("DISTRIBUTED_MAX_WORKERS", "4"))
+DISTRIBUTED_RESERVE_TIMEOUT = float(os.environ.get("DISTRIBUTED_RESERVE_TIMEOUT", "120"))
+DISTRIBUTED_HOST = os.environ.get("DISTRIBUTED_HOST", "")
+
+# Port of the Prometheus exporter every Celery worker serves its metrics on (see metrics.py); 0 turns
+# it off.
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "9808"))
+
+# Hyperparameter sweeps (see sweep.py). A sweep may try at most SWEEP_MAX_TRIALS configurations.
+SWEEP_MAX_TRIALS = int(os.environ.get("SWEEP_MAX_TRIALS", "64"))
+
+# Trained models (see model_store.py and serving.py). Successful train_model runs are exported in
+# MODEL_FORMAT, "savedmodel" or "tflite". /predict keeps up to MODEL_CACHE_SIZE models loaded, least
+# recently used first out, and runs the requests for one model that queue up while its previous forward
+# pass runs as a single batch of at most PREDICT_MAX_BATCH images. A PREDICT_BATCH_WINDOW_MS above 0
+# additionally holds every batch open that long for more requests; with requests already queueing
+# behind the running pass that only adds latency (benchmarks/bench_predict.py), so it is off by
+# default. One request may hold at most PREDICT_MAX_IMAGES images.
+MODEL_FORMAT = os.environ.get("MODEL_FORMAT", "savedmodel")
+MODEL_CACHE_SIZE = int(os.environ.get("MODEL_CACHE_SIZE", "4"))
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get("PREDICT_BATCH_WINDOW_MS", "0"))
+PREDICT_MAX_BATCH = int(os.environ.get("PREDICT_MAX_BATCH", "64"))
+PREDICT_MAX_IMAGES = int(os.environ.get("PREDICT_MAX_IMAGES", "64"))
+
+# Publishing of training updates (see publisher.py). Every worker process sends its updates to Redis
+# from a background thread, so training never waits on Redis. At most PUBLISH_QUEUE_SIZE updates wait
+# to be sent; while the queue is full, new updates are dropped, except a task's final update, which
+# waits for room. Waiting updates go out in pipelined batches of up to PUBLISH_BATCH_SIZE over a pool of
+# at most PUBLISH_POOL_SIZE connections, each Redis call timing out after PUBLISH_SOCKET_TIMEOUT seconds.
+# A failed batch is retried up to PUBLISH_MAX_RETRIES times, backing off exponentially from
+# PUBLISH_RETRY_BACKOFF up to PUBLISH_RETRY_MAX_BACKOFF seconds, then dropped. An update sent more than
+# PUBLISH_DELAYED_AFTER seconds after it was queued counts as delayed. A task's final update holds the
+# task until everything queued before it, and itself, is sent, for at most PUBLISH_FLUSH_TIMEOUT seconds.
+PUBLISH_QUEUE_SIZE = int(os.environ.get("PUBLISH_QUEUE_SIZE", "1000"))
+PUBLISH_BATCH_SIZE = int(os.environ.get("PUBLISH_BATCH_SIZE", "100"))
+PUBLISH_POOL_SIZE = int(os.environ.get("PUBLISH_POOL_SIZE", "2"))
+PUBLISH_SOCKET_TIMEOUT = float(os.environ.get("PUBLISH_SOCKET_TIMEOUT", "5"))
+PUBLISH_MAX_RETRIES = int(os.environ.get("PUBLISH_MAX_RETRIES", "8"))
+PUBLISH_RETRY_BACKOFF = float(os.environ.get("PUBLISH_RETRY_BACKOFF", "0.1"))
+PUBLISH_RETRY_MAX_BACKOFF = float(os.environ.get("PUBLISH_RETRY_MAX_BACKOFF", "5"))
+PUBLISH_DELAYED_AFTER = float(os.environ.get("PUBLISH_DELAYED_AFTER", "1"))
+PUBLISH_FLUSH_TIMEOUT = float(os.environ.get("PUBLISH_FLUSH_TIMEOUT", "30"))
@@ -0,0 +1,157 @@
+# META
+
+# Description: Registry of the open WebSocket connections used by app.py to fan out training updates.
+# Previously app.py kept a single global active_connection: a second browser tab silently took the
+# updates away from the first one, and a slow client blocked the Redis listener while it waited for
+# send_text() to complete. Here every connection gets its own bounded send queue drained by its own
+# sender task, so publishing is a non-blocking enqueue. When a client can't keep up its queue fills up
+# and the oldest pending update is dropped in favour of the newest one, so the final SUCCESS/ERROR
+# message still gets through and other clients are unaffected. Updates that only matter in their
+# latest version (batch-level progress) can be given a coalesce key: a newer update with the same key
+# replaces the pending one in place instead of taking another spot in the queue.
+#
+# Clients subscribe to the task ids returned by /train. A client with no subscriptions receives every
+# update, which keeps clients that never subscribe working the way they did before. While the app
+# replays a task's earlier events to a client (see events.py), live updates of that task are held back
+# and afterwards only those newer than the last replayed event are delivered, so the client sees every
+# event exactly once and in order. That last replayed event id is kept for as long as the client stays
+# subscribed: an event logged before the replay read the stream can still be published after the replay
+# ended, and it is dropped then too.
+
+import asyncio
+import logging
+import time
+
+from config import WS_MAX_QUEUE
+from events import compare_event_ids
+from metrics import WS_CLIENTS, WS_DROPPED, WS_FANOUT
+
+logger = logging.getLogger(__name__)
+
+
+class Client:
+    def __init__(self, websocket, max_queue=WS_MAX_QUEUE):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        # coalesce key -> latest undelivered message with that key and the time it was queued. The
+        # queue holds (coalesce key, None) in place of such messages, and (None, (message, time)) for
+        # all others. The times are used to measure fan-out latency (see metrics.py).
+        self.pending = {}
+        self.subscriptions = set()
+        # task_id -> live updates held back while that task's events are being replayed.
+        self.replaying = {}
+        # task_id -> id of the last event replayed for that task. Live updates up to it were already sent.
+        self.replayed = {}
+        self.dropped = 0
+        self.sender = None
+
+    # Queues a message for delivery without waiting. If a message with the same coalesce key is still
+    # pending it is replaced. Otherwise, if the queue is full, the oldest pending message is discarded
+    # to make room.
+    def enqueue(self, message, coalesce_key=None):
+        entry = (message, time.perf_counter())
+        if coalesce_key is not None and coalesce_key in self.pending:
+            self.pending[coalesce_key] = entry
+            return
+        if self.queue.full():
+            oldest_key, _ = self.queue.get_nowait()
+            if oldest_key is not None:
+                del self.pending[oldest_key]
+            self.dropped += 1
+            WS_DROPPED.inc()
+        if coalesce_key is None:
+            self.queue.put_nowait((None, entry))
+        else:
+            self.pending[coalesce_key] = entry
+            self.queue.put_nowait((coalesce_key, None))
+
+    # Delivers a live update of the given task, unless that task is being replayed to this client, in
+    # which case the update is held back until the replay is done, or the update was already replayed.
+    def deliver(self, task_id, message, coalesce_key=None, event_id=None):
+        if task_id in self.replaying:
+            self.replaying[task_id].append((message, coalesce_key, event_id))
+        elif not self._replayed(task_id, event_id):
+            self.enqueue(message, coalesce_key)
+
+    def _replayed(self, task_id, event_id):
+        last_event_id = self.replayed.get(task_id)
+        return last_event_id is not None and event_id is not None and compare_event_ids(event_id, last_event_id) <= 0
+
+    def begin_replay(self, task_id):
+        self.replaying.setdefault(task_id, [])
+
+    # Ends a replay whose last replayed event was last_event_id (None if nothing was replayed) and
+    # delivers the live updates held back in the meantime that the replay didn't already include.
+    def end_replay(self, task_id, last_event_id=None):
+        if last_event_id is not None:
+            self.replayed[task_id] = last_event_id
+        for message, coalesce_key, event_id in self.replaying.pop(task_id, []):
+            if not self._replayed(task_id, event_id):
+                self.enqueue(message, coalesce_key)
+
+    # Drains the queue into the socket. Runs as one task per client, so a slow socket only ever
+    # delays its own messages.
+    async def run_sender(self):
+        while True:
+            coalesce_key, entry = await self.queue.get()
+            message, queued_at = self.pending.pop(coalesce_key) if coalesce_key is not None else entry
+            await self.websocket.send_text(message)
+            WS_FANOUT.observe(time.perf_counter() - queued_at)
+
+
+class ConnectionManager:
+    def __init__(self, max_queue=WS_MAX_QUEUE):
+        self.max_queue = max_queue
+        self.clients = set()
+        # task_id -> set of clients subscribed to that task.
+        self.subscribers = {}
+        # Clients without any subscription, which receive every update.
+        self.unsubscribed = set()
+
+    # Registers an accepted websocket and starts its sender task. If the sender fails (for example
+    # because the socket was closed underneath it) the client is removed from the registry.
+    def connect(self, websocket):
+        client = Client(websocket, self.max_queue)
+        client.sender = asyncio.create_task(client.run_sender())
+        client.sender.add_done_callback(lambda _: self.disconnect(client))
+        self.clients.add(client)
+        self.unsubscribed.add(client)
+        WS_CLIENTS.inc()
+        return client
+
+    def disconnect(self, client):
+        if client not in self.clients:
+            return
+        self.clients.discard(client)
+        self.unsubscribed.discard(client)
+        WS_CLIENTS.dec()
+        for task_id in list(client.subscriptions):
+            self.unsubscribe(client, task_id)
+        if client.dropped:
+            logger.info(f"Client disconnected after dropping {client.dropped} updates")
+        if client.sender and not client.sender.done():
+            client.sender.cancel()
+
+    def subscribe(self, client, task_id):
+        client.subscriptions.add(task_id)
+        self.subscribers.setdefault(task_id, set()).add(client)
+        self.unsubscribed.discard(client)
+
+    def unsubscribe(self, client, task_id):
+        client.subscriptions.discard(task_id)
+        client.replayed.pop(task_id, None)
+        if not client.subscriptions and client in self.clients:
+            self.unsubscribed.add(client)
+        subscribers = self.subscribers.get(task_id)
+        if subscribers is not None:
+            subscribers.discard(client)
+            if not subscribers:
+                del self.subscribers[task_id]
+
+    # Fans a message out to every client subscribed to task_id, plus every client that hasn't
+    # subscribed to anything. Never awaits, so it can't be stalled by any individual client.
+    def publish(self, task_id, message, coalesce_key=None, event_id=None):
+        for client in self.subscribers.get(task_id, ()):
+            client.deliver(task_id, message, coalesce_key, event_id)
+        for client in self.unsubscribed:
+            client.enqueue(message, coalesce_key)
@@ -0,0 +1,142 @@
+# META
+
+# Description: Worker-level store for the preprocessed CIFAR-10 dataset. Previously every train_model
+# task re-downloaded/re-read CIFAR-10, converted it to float64, subtracted the mean and re-ran the
+# stratified split, which cost several seconds and ~1.5 GB of transient memory before training even
+# started. Here the preprocessing runs exactly once per dataset version: the normalized, mean-subtracted
+# images are written as float32 .npy files (labels as uint8) together with the mean and the split.
+# Every task in every worker process then opens those files with mmap_mode='r', so the operating
+# system shares the same physical pages between all of them instead of each task holding its own copy.
+
+import fcntl
+import json
+import os
+import shutil
+from typing import NamedTuple
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from config import DATASET_CACHE_DIR, DATASET_SPLIT_SEED, DATASET_VALIDATION_SPLIT, DATASET_VERSION
+
+# Names of the arrays persisted for each dataset version.
+ARRAY_NAMES = ("x_train", "y_train", "x_val", "y_val", "x_test", "y_test", "mean")
+
+# Number of images converted to float32 at a time while writing the cache. Bounds the transient
+# memory of the one-off preprocessing step to a few tens of megabytes.
+_CHUNK_SIZE = 5000
+
+
+class CifarDataset(NamedTuple):
+    x_train: np.ndarray
+    y_train: np.ndarray
+    x_val: np.ndarray
+    y_val: np.ndarray
+    x_test: np.ndarray
+    y_test: np.ndarray
+    mean: np.ndarray
+    version: str
+
+
+# Per-process handle on the memory-mapped arrays. Opening a memmap is cheap, but caching the handle
+# means repeated tasks in the same process don't even pay for the open() calls.
+_dataset = None
+
+
+def dataset_dir():
+    return os.path.join(DATASET_CACHE_DIR, DATASET_VERSION)
+
+
+# Writes images to a .npy file in chunks, normalizing them to [0, 1] and subtracting the per-channel
+# mean on the way. open_memmap() lets us fill the file in place, so at no point do we hold a full
+# float copy of the split in memory.
+def _write_normalized(path, images, indices, mean):
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(len(indices),) + images.shape[1:])
+    for start in range(0, len(indices), _CHUNK_SIZE):
+        chunk = images[indices[start:start + _CHUNK_SIZE]].astype(np.float32)
+        chunk /= 255.0
+        chunk -= mean
+        out[start:start + len(chunk)] = chunk
+    out.flush()
+    del out
+
+
+# Runs the preprocessing once and writes every array into target_dir. Mirrors what train_model
+# used to do inline: normalize, subtract the training-set mean, then hold out a stratified
+# validation split. The split indices are drawn with a fixed seed so they are reproducible.
+def _build(target_dir):
+    import tensorflow as tf
+
+    (x_train, y_train), (x_test, y_test) = tf.keras.datasets.cifar10.load_data()
+
+    # Computing the mean in float64 over the uint8 images avoids materializing a float copy of the
+    # whole training set just to average it.
+    mean = (x_train.mean(axis=(0, 1, 2), dtype=np.float64) / 255.0).astype(np.float32)
+
+    train_idx, val_idx = train_test_split(
+        np.arange(len(x_train)),
+        test_size=DATASET_VALIDATION_SPLIT,
+        stratify=y_train,
+        random_state=DATASET_SPLIT_SEED,
+    )
+    # Sorting keeps reads sequential within the memmap; training shuffles anyway.
+    train_idx.sort()
+    val_idx.sort()
+
+    _write_normalized(os.path.join(target_dir, "x_train.npy"), x_train, train_idx, mean)
+    _write_normalized(os.path.join(target_dir, "x_val.npy"), x_train, val_idx, mean)
+    _write_normalized(os.path.join(target_dir, "x_test.npy"), x_test, np.arange(len(x_test)), mean)
+    np.save(os.path.join(target_dir, "y_train.npy"), y_train[train_idx].astype(np.uint8))
+    np.save(os.path.join(target_dir, "y_val.npy"), y_train[val_idx].astype(np.uint8))
+    np.save(os.path.join(target_dir, "y_test.npy"), y_test.astype(np.uint8))
+    np.save(os.path.join(target_dir, "mean.npy"), mean)
+
+    with open(os.path.join(target_dir, "meta.json"), "w") as f:
+        json.dump({
+            "version": DATASET_VERSION,
+            "validation_split": DATASET_VALIDATION_SPLIT,
+            "split_seed": DATASET_SPLIT_SEED,
+            "mean": mean.tolist(),
+        }, f)
+
+
+# Makes sure the cache for the current dataset version exists, building it if necessary. An exclusive
+# file lock ensures that when several worker processes start at once only one of them does the work
+# while the others wait. The arrays are first written into a temporary directory and then renamed into
+# place, so a crash halfway through never leaves a partially written cache behind.
+def ensure_dataset():
+    target_dir = dataset_dir()
+    if os.path.exists(os.path.join(target_dir, "meta.json")):
+        return target_dir
+
+    os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(DATASET_CACHE_DIR, f"{DATASET_VERSION}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Another process may have finished building while we were waiting for the lock.
+            if os.path.exists(os.path.join(target_dir, "meta.json")):
+                return target_dir
+            tmp_dir = f"{target_dir}.tmp-{os.getpid()}"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            try:
+                _build(tmp_dir)
+                os.replace(tmp_dir, target_dir)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return target_dir
+
+
+# Returns the preprocessed dataset as read-only memory-mapped arrays. Safe to call from every task:
+# the first call in a process builds (or waits for) the cache and opens the files, later calls return
+# the same handles.
+def load_dataset():
+    global _dataset
+    if _dataset is None:
+        directory = ensure_dataset()
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in ARRAY_NAMES}
+        _dataset = CifarDataset(version=DATASET_VERSION, **arrays)
+    return _dataset
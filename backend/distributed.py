@@ -0,0 +1,259 @@
+# META
+
+# Description: Distributed data-parallel training across several Celery worker processes, on one host
+# or many. A train_model task is confined to a single worker process; a train_model_distributed task
+# (worker.py) instead spans 'workers' of them:
+#   1. The task itself becomes the coordinator and rank 0. It sends one distributed_participant task
+#      per additional rank to the training queue and waits for all of them to start and register the
+#      address they can be reached at. If they aren't all running within DISTRIBUTED_RESERVE_TIMEOUT
+#      (the pool is busy with other tasks), the group is aborted and the task fails instead of holding
+#      its reserved processes indefinitely.
+#   2. Once every rank registered, the coordinator publishes the cluster spec and every rank starts a
+#      training subprocess (this file, run as a script) with TF_CONFIG describing the cluster.
+#   3. The subprocesses train with tf.distribute.MultiWorkerMirroredStrategy: each one reads its own
+#      shard of the training set (see pipeline.py), and the optimizer all-reduces the gradients across
+#      ranks at every step, so every rank holds identical weights. Keras' model.fit() doesn't support
+#      MultiWorkerMirroredStrategy, so this uses a custom training loop.
+#   4. Rank 0's subprocess publishes progress under the coordinator's task id, exactly like a single
+#      train_model task would, and leaves its final result in Redis for the coordinator to publish.
+# Training runs in a fresh subprocess because the strategy's collective ops have to be set up before a
+# process runs any TensorFlow op, which the warm worker processes long have (see warmup.py). It also
+# means cancellation can simply terminate the subprocesses: ranks must stop at the same step or the
+# others block in the next all-reduce, and the worker processes themselves stay alive either way. If
+# any rank fails, the group is aborted and the coordinator reports the error.
+#
+# Coordination state, in Redis with a TTL of KEY_TTL:
+#   distributed:<group_id>:members   hash of rank -> host:port, filled as the ranks start
+#   distributed:<group_id>:cluster   JSON {"cluster": [host:port, ...], "spec": training arguments}
+#   distributed:<group_id>:abort     set once the group is cancelled or failed
+#   distributed:<group_id>:exit      hash of rank -> exit code of the rank's training subprocess
+#   distributed:<group_id>:result    JSON final result, written by rank 0
+#
+# Local testing: every rank can run on the same machine. Start a Redis server (or a stand-in, see
+# benchmarks/bench_distributed.py, which does all of this) and a worker with enough processes, e.g.
+#   REDIS_URL=redis://localhost:6379/0 DISTRIBUTED_HOST=127.0.0.1 celery -A worker worker -c 3
+# and POST /train/distributed with "workers": 2.
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from config import DISTRIBUTED_HOST, DISTRIBUTED_RESERVE_TIMEOUT
+
+PREFIX = "distributed"
+
+KEY_TTL = 24 * 3600
+
+# How often, in seconds, waiting ranks poll Redis and check their subprocess.
+POLL_INTERVAL = 0.5
+
+
+def _key(group_id, name):
+    return f"{PREFIX}:{group_id}:{name}"
+
+
+# An address other ranks can reach this process at, with a port that was free a moment ago.
+def local_address():
+    host = DISTRIBUTED_HOST or socket.gethostbyname(socket.gethostname())
+    with socket.socket() as s:
+        s.bind(("", 0))
+        port = s.getsockname()[1]
+    return f"{host}:{port}"
+
+
+def register(redis_client, group_id, rank):
+    address = local_address()
+    with redis_client.pipeline() as pipe:
+        pipe.hset(_key(group_id, "members"), rank, address)
+        pipe.expire(_key(group_id, "members"), KEY_TTL)
+        pipe.execute()
+    return address
+
+
+def abort(redis_client, group_id):
+    redis_client.set(_key(group_id, "abort"), 1, ex=KEY_TTL)
+
+
+def is_aborted(redis_client, group_id):
+    return bool(redis_client.exists(_key(group_id, "abort")))
+
+
+# Called by the coordinator: registers rank 0 and waits until all 'num_workers' ranks have registered,
+# then publishes the cluster spec together with the training arguments. Returns the cluster's addresses
+# ordered by rank, or None if the coordinator was cancelled or the deadline passed, in which case the
+# group is aborted.
+def reserve(redis_client, group_id, num_workers, spec, task_aborted, timeout=DISTRIBUTED_RESERVE_TIMEOUT):
+    register(redis_client, group_id, 0)
+    deadline = time.monotonic() + timeout
+    while True:
+        members = redis_client.hgetall(_key(group_id, "members"))
+        if len(members) >= num_workers:
+            cluster = [members[str(rank).encode()].decode() for rank in range(num_workers)]
+            redis_client.set(_key(group_id, "cluster"), json.dumps({"cluster": cluster, "spec": spec}), ex=KEY_TTL)
+            return cluster
+        if task_aborted() or time.monotonic() > deadline:
+            abort(redis_client, group_id)
+            return None
+        time.sleep(POLL_INTERVAL)
+
+
+# Called by the other ranks after registering: waits for the cluster spec. Returns (cluster, spec), or
+# None if the group was aborted in the meantime.
+def wait_for_cluster(redis_client, group_id, timeout=DISTRIBUTED_RESERVE_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not is_aborted(redis_client, group_id):
+        data = redis_client.get(_key(group_id, "cluster"))
+        if data is not None:
+            data = json.loads(data)
+            return data["cluster"], data["spec"]
+        if time.monotonic() > deadline:
+            return None
+        time.sleep(POLL_INTERVAL)
+    return None
+
+
+# Runs this rank's training subprocess and waits for it. Returns the subprocess' exit code, or None if
+# it was terminated because the group was aborted (or 'task_aborted' returned True, which aborts the
+# whole group). A failing rank aborts the group too, so the others don't wait for it forever.
+def run_rank(redis_client, group_id, rank, cluster, spec, task_aborted=lambda: False):
+    tf_config = {"cluster": {"worker": cluster}, "task": {"type": "worker", "index": rank}}
+    args = {**spec, "group_id": group_id, "rank": rank, "num_workers": len(cluster)}
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), json.dumps(args)],
+                               env={**os.environ, "TF_CONFIG": json.dumps(tf_config)})
+    while process.poll() is None:
+        if task_aborted() or is_aborted(redis_client, group_id):
+            abort(redis_client, group_id)
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            return None
+        time.sleep(POLL_INTERVAL)
+    redis_client.hset(_key(group_id, "exit"), rank, process.returncode)
+    redis_client.expire(_key(group_id, "exit"), KEY_TTL)
+    if process.returncode != 0:
+        abort(redis_client, group_id)
+    return process.returncode
+
+
+def exit_codes(redis_client, group_id):
+    return {int(rank): int(code) for rank, code in redis_client.hgetall(_key(group_id, "exit")).items()}
+
+
+def read_result(redis_client, group_id):
+    data = redis_client.get(_key(group_id, "result"))
+    return json.loads(data) if data is not None else None
+
+
+# The training subprocess of one rank. 'args' holds the train_model arguments plus group_id, rank and
+# num_workers. batch_size is the global batch size: each step, every rank trains on batch_size /
+# num_workers samples of its own shard.
+def train_rank(args):
+    # The strategy must exist before any other TensorFlow op runs in this process.
+    import tensorflow as tf
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+
+    import math
+    from dataset import load_dataset
+    from pipeline import build_train_dataset, build_eval_dataset
+    from precision import ThroughputCallback, precision_policy, resolve_precision
+    from progress import ProgressReporter
+    from worker import build_model, publish_update, publisher, redis_client
+
+    group_id, rank, num_workers = args["group_id"], args["rank"], args["num_workers"]
+    batch_size, epochs = args["batch_size"], args["epochs"]
+    chief = rank == 0
+    shard = (num_workers, rank)
+
+    dataset = load_dataset()
+    # Every pipeline is batched with the global batch size; experimental_distribute_dataset() splits
+    # each batch between the ranks' replicas.
+    train_data = strategy.experimental_distribute_dataset(build_train_dataset(dataset.x_train, dataset.y_train, batch_size, shard=shard))
+    val_data = strategy.experimental_distribute_dataset(build_eval_dataset(dataset.x_val, dataset.y_val, batch_size, shard=shard))
+    test_data = strategy.experimental_distribute_dataset(build_eval_dataset(dataset.x_test, dataset.y_test, batch_size, shard=shard))
+
+    policy = resolve_precision(args.get("precision", "float32"))
+    with precision_policy(policy), strategy.scope():
+        model = build_model(args["layers"], args["units"])
+    with strategy.scope():
+        optimizer = tf.keras.optimizers.get(args["optimizer"])
+        optimizer.build(model.trainable_variables)
+    loss_fn = tf.keras.losses.SparseCategoricalCrossentropy(reduction=None)
+
+    def batch_sums(labels, probabilities):
+        losses = loss_fn(labels, probabilities)
+        predictions = tf.argmax(probabilities, axis=-1, output_type=tf.int32)
+        correct = tf.cast(tf.equal(predictions, tf.cast(tf.reshape(labels, [-1]), tf.int32)), tf.float32)
+        return tf.reduce_sum(losses), tf.reduce_sum(correct), tf.cast(tf.shape(losses)[0], tf.float32)
+
+    # Per-replica training step. The loss is scaled by the global batch size, and the optimizer sums
+    # the gradients of all replicas before applying them, which yields the gradient of the global batch.
+    def train_step(images, labels):
+        with tf.GradientTape() as tape:
+            probabilities = model(images, training=True)
+            loss = tf.reduce_sum(loss_fn(labels, probabilities)) / batch_size
+        gradients = tape.gradient(loss, model.trainable_variables)
+        optimizer.apply(gradients, model.trainable_variables)
+        return batch_sums(labels, probabilities)
+
+    def eval_step(images, labels):
+        return batch_sums(labels, model(images, training=False))
+
+    # Each step returns the loss sum, correct predictions and sample count over all ranks.
+    @tf.function
+    def distributed_train_step(batch):
+        sums = strategy.run(train_step, args=batch)
+        return [strategy.reduce(tf.distribute.ReduceOp.SUM, value, axis=None) for value in sums]
+
+    @tf.function
+    def distributed_eval_step(batch):
+        sums = strategy.run(eval_step, args=batch)
+        return [strategy.reduce(tf.distribute.ReduceOp.SUM, value, axis=None) for value in sums]
+
+    def evaluate(data):
+        loss, correct, count = 0.0, 0.0, 0.0
+        for batch in data:
+            batch_loss, batch_correct, batch_count = distributed_eval_step(batch)
+            loss, correct, count = loss + float(batch_loss), correct + float(batch_correct), count + float(batch_count)
+        return {"loss": loss / max(count, 1), "accuracy": correct / max(count, 1)}
+
+    steps_per_epoch = math.ceil(len(dataset.x_train) / batch_size)
+    reporter = ProgressReporter(publish_update, group_id, epochs, steps_per_epoch, extra={'workers': num_workers}) if chief else None
+    # Each rank trains on an equal shard of the training set, see pipeline._shard_range().
+    throughput = ThroughputCallback(batch_size, len(dataset.x_train) // num_workers)
+    history = []
+    for epoch in range(epochs):
+        throughput.on_epoch_begin(epoch)
+        loss, correct, count = 0.0, 0.0, 0.0
+        for step, batch in enumerate(train_data):
+            batch_loss, batch_correct, batch_count = distributed_train_step(batch)
+            loss, correct, count = loss + float(batch_loss), correct + float(batch_correct), count + float(batch_count)
+            throughput.on_train_batch_end(step)
+            if reporter is not None:
+                reporter.batch_end(epoch, step, int(batch_count), {"loss": loss / count, "accuracy": correct / count})
+        throughput.on_epoch_end(epoch)
+        logs = {"loss": loss / max(count, 1), "accuracy": correct / max(count, 1)}
+        logs.update({f"val_{name}": value for name, value in evaluate(val_data).items()})
+        history.append({'epoch': epoch + 1, 'logs': logs})
+        if chief:
+            print(f" Distributed task {group_id}, epoch {epoch + 1}: logs={logs}")
+            publish_update(group_id, {'status': "PROGRESS", 'epoch': epoch + 1, 'logs': logs, 'workers': num_workers,
+                                      'images_per_sec': throughput.epoch_rates[-1] if throughput.epoch_rates else None})
+
+    test_logs = evaluate(test_data)
+    if chief:
+        result = {'test_accuracy': test_logs['accuracy'], 'test_loss': test_logs['loss'], 'history': history,
+                  'workers': num_workers, 'precision': policy, 'images_per_sec': throughput.images_per_sec()}
+        redis_client.set(_key(group_id, "result"), json.dumps(result), ex=KEY_TTL)
+        # The progress updates go through the background publisher (see publisher.py), whose thread
+        # doesn't outlive this process; send whatever is still queued before it exits.
+        publisher.flush()
+
+
+if __name__ == "__main__":
+    train_rank(json.loads(sys.argv[1]))
@@ -0,0 +1,98 @@
+# META
+
+# Description: Analytic cost estimates for a training configuration, computed from the layer spec
+# alone without building the Keras model, so they are cheap enough to run on every request. models.py
+# only checks value ranges, and a configuration like units=[1024, 1024, 1024] passes them yet can
+# exhaust a worker's memory or tie it up for days. /estimate reports the numbers, and /train,
+# /train/batch and /resume use them to reject configurations over the memory or time budget up front
+# (see config.py).
+#
+# The estimates follow build_model() in worker.py: 3x3 valid convolutions each followed by 2x2 max
+# pooling, a dense layer as wide as the last conv layer with dropout, and a 10-way softmax, trained on
+# 32x32x3 float32 images.
+#   params        trainable parameters
+#   activations   float32 values one sample produces in the forward pass; all of them are kept for the
+#                 backward pass, which produces a gradient of the same size for each
+#   flops         multiply-adds x 2 of one forward pass; a training step costs about 3x that (forward,
+#                 gradients w.r.t. the activations and w.r.t. the weights)
+#   memory        weights, gradients and two optimizer slots (Adam's moments) per parameter, plus the
+#                 batch's activations and their gradients, plus the input batches tf.data keeps prefetched
+#   wall time     flops / ESTIMATE_FLOPS_PER_SECOND plus ESTIMATE_STEP_OVERHEAD_SECONDS per step
+
+import math
+
+from config import (DATASET_VALIDATION_SPLIT, ESTIMATE_FLOPS_PER_SECOND, ESTIMATE_MAX_MEMORY_MB,
+                    ESTIMATE_MAX_SECONDS, ESTIMATE_STEP_OVERHEAD_SECONDS)
+
+# CIFAR-10's training set is split into training and validation data (see dataset.py); the test set
+# is evaluated once at the end.
+TRAIN_SAMPLES = round(50000 * (1 - DATASET_VALIDATION_SPLIT))
+VAL_SAMPLES = 50000 - TRAIN_SAMPLES
+TEST_SAMPLES = 10000
+
+BYTES_PER_VALUE = 4
+# Weights, gradients and the optimizer's two slot variables.
+BYTES_PER_PARAM = 4 * BYTES_PER_VALUE
+# Input batches buffered by the tf.data pipeline ahead of training.
+PREFETCHED_BATCHES = 4
+
+
+# Per-sample parameter count, forward FLOPs and activation count of the model build_model() creates.
+def model_profile(layers, units):
+    size, channels = 32, 3
+    params, flops = 0, 0
+    activations = size * size * channels
+    for filters in units[:layers]:
+        conv_size = size - 2
+        params += 3 * 3 * channels * filters + filters
+        flops += 2 * 3 * 3 * channels * filters * conv_size * conv_size
+        size, channels = conv_size // 2, filters
+        activations += conv_size * conv_size * filters + size * size * filters
+    flat = size * size * channels
+    dense = units[-1]
+    params += flat * dense + dense + dense * 10 + 10
+    flops += 2 * flat * dense + 2 * dense * 10
+    # Dense output, dropout output and mask, logits and softmax.
+    activations += 3 * dense + 2 * 10
+    return params, flops, activations
+
+
+def param_count(layers, units):
+    return model_profile(layers, units)[0]
+
+
+# Returns the estimate for one configuration as a dict.
+def estimate(layers, units, epochs, batch_size):
+    params, flops, activations = model_profile(layers, units)
+    steps_per_epoch = math.ceil(TRAIN_SAMPLES / batch_size)
+    eval_steps = math.ceil(VAL_SAMPLES / batch_size)
+    flops_per_epoch = 3 * flops * TRAIN_SAMPLES + flops * VAL_SAMPLES
+    activation_bytes = 2 * activations * batch_size * BYTES_PER_VALUE
+    memory_bytes = (params * BYTES_PER_PARAM + activation_bytes
+                    + PREFETCHED_BATCHES * batch_size * 32 * 32 * 3 * BYTES_PER_VALUE)
+    seconds_per_epoch = flops_per_epoch / ESTIMATE_FLOPS_PER_SECOND + (steps_per_epoch + eval_steps) * ESTIMATE_STEP_OVERHEAD_SECONDS
+    test_seconds = flops * TEST_SAMPLES / ESTIMATE_FLOPS_PER_SECOND + math.ceil(TEST_SAMPLES / batch_size) * ESTIMATE_STEP_OVERHEAD_SECONDS
+    return {
+        "params": params,
+        "activation_bytes_per_batch": activation_bytes,
+        "memory_bytes": memory_bytes,
+        "flops_per_epoch": flops_per_epoch,
+        "seconds_per_epoch": seconds_per_epoch,
+        "seconds": epochs * seconds_per_epoch + test_seconds,
+    }
+
+
+# Combines the estimates of models trained together in one task (train_model_batch): they're all in
+# memory at once and share the worker's compute.
+def combine(estimates):
+    return {name: sum(e[name] for e in estimates) for name in estimates[0]}
+
+
+# Returns the reasons an estimate is over budget; an empty list means the configuration is admitted.
+def over_budget(estimate, max_memory_mb=ESTIMATE_MAX_MEMORY_MB, max_seconds=ESTIMATE_MAX_SECONDS):
+    reasons = []
+    if estimate["memory_bytes"] > max_memory_mb * 2**20:
+        reasons.append(f"estimated memory {estimate['memory_bytes'] / 2**20:.0f} MB exceeds the budget of {max_memory_mb:.0f} MB")
+    if estimate["seconds"] > max_seconds:
+        reasons.append(f"estimated training time {estimate['seconds']:.0f}s exceeds the budget of {max_seconds:.0f}s")
+    return reasons
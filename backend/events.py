@@ -0,0 +1,85 @@
+# META
+
+# Description: Durable, replayable log of each training task's events. Pub/sub is fire-and-forget:
+# a WebSocket client that connects (or reconnects) after a task started used to miss every earlier
+# epoch, and possibly the final SUCCESS/ERROR message too. The worker therefore also appends every
+# epoch-level and final event to a Redis Stream per task, training_events:<task_id>, before publishing
+# it. Each stream is capped at about EVENT_STREAM_MAXLEN entries and expires EVENT_STREAM_TTL seconds
+# after its last event, which bounds Redis memory. The stream entry id is sent along with the live
+# update as 'event_id', so a client can later ask the app to replay everything after the last id it
+# saw, and the app can tell replayed events and live events apart.
+#
+# Batch-level progress (status BATCH) is transient and is only ever published, never logged.
+
+import json
+import re
+
+from config import EVENT_STREAM_MAXLEN, EVENT_STREAM_TTL
+
+
+# Statuses a task's last update can have. Every one of them ends the task's stream of updates.
+FINAL_STATUSES = ("SUCCESS", "ERROR", "CANCELLED", "STOPPED")
+
+
+# Offsets a client may ask to replay from: a stream id ("<milliseconds>-<sequence>", the sequence being
+# optional) or "-" for the whole stream.
+EVENT_ID_PATTERN = re.compile(r"\d+(-\d+)?|-")
+
+
+def stream_key(task_id):
+    return f"training_events:{task_id}"
+
+
+# Queues the two commands that append an event to the task's stream on 'pipe', a pipeline of either
+# the synchronous or the asynchronous Redis client. The first command's result is the event id. The
+# worker's background publisher (see publisher.py) queues a whole batch of events on one pipeline.
+def add_event(pipe, task_id, update):
+    key = stream_key(task_id)
+    pipe.xadd(key, {"data": json.dumps(update)}, maxlen=EVENT_STREAM_MAXLEN, approximate=True)
+    pipe.expire(key, EVENT_STREAM_TTL)
+
+
+def decode_event_id(event_id):
+    return event_id.decode() if isinstance(event_id, bytes) else event_id
+
+
+# Appends an event to the task's stream and returns its id, with a synchronous Redis client.
+def append_event(redis_client, task_id, update):
+    with redis_client.pipeline(transaction=False) as pipe:
+        add_event(pipe, task_id, update)
+        event_id, _ = pipe.execute()
+    return decode_event_id(event_id)
+
+
+# Same as append_event, with the app's asynchronous Redis client, for the few updates the app publishes
+# itself.
+async def append_event_async(redis_client, task_id, update):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        add_event(pipe, task_id, update)
+        event_id, _ = await pipe.execute()
+    return decode_event_id(event_id)
+
+
+def is_event_id(offset):
+    return isinstance(offset, str) and EVENT_ID_PATTERN.fullmatch(offset) is not None
+
+
+# Returns the task's events that come after 'offset', oldest first, as decoded updates with their
+# 'event_id' set. An offset of "0" (or "-") replays the whole stream. Used by the app with its
+# asynchronous Redis client.
+async def read_events(redis_client, task_id, offset="0"):
+    start = "-" if offset in ("0", "0-0", "-") else f"({offset}"
+    entries = await redis_client.xrange(stream_key(task_id), start, "+")
+    events = []
+    for event_id, fields in entries:
+        events.append({**json.loads(fields[b"data"] if b"data" in fields else fields["data"]), "event_id": decode_event_id(event_id)})
+    return events
+
+
+# Orders two stream ids ("<milliseconds>-<sequence>"). Returns a negative number, zero or a positive
+# number when a is older than, the same as or newer than b.
+def compare_event_ids(a, b):
+    a_ms, _, a_seq = a.partition("-")
+    b_ms, _, b_seq = b.partition("-")
+    a_key, b_key = (int(a_ms), int(a_seq or 0)), (int(b_ms), int(b_seq or 0))
+    return (a_key > b_key) - (a_key < b_key)
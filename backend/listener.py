@@ -0,0 +1,110 @@
+# META
+
+# Description: Event-driven consumer for the training updates the Celery worker publishes to Redis.
+# The previous redis_listener in app.py polled pubsub.get_message() every 10 ms, which meant ~100
+# wakeups a second while idle, up to 10 ms of added latency per update, and a single exception
+# break-ing out of the loop and silently stopping all updates until the app was restarted. Here the
+# listener blocks on pubsub.listen(), so it only wakes up when a message actually arrives, and any
+# connection error leads to a reconnect and resubscribe with exponential backoff. The listener also
+# keeps track of its own health (connected or not, reconnects, last error) and lag (time between the
+# worker publishing an update and the listener receiving it) for the /health endpoint; the lag of
+# every update is also recorded for /metrics (see metrics.py).
+
+import asyncio
+import json
+import logging
+import time
+
+from config import LISTENER_BACKOFF_INITIAL, LISTENER_BACKOFF_MAX
+from metrics import UPDATE_DELIVERY
+
+logger = logging.getLogger(__name__)
+
+
+class RedisListener:
+    # 'patterns' are channel patterns passed to PSUBSCRIBE, e.g. 'model_updates:*'.
+    def __init__(self, redis_client, patterns, on_message):
+        self.redis_client = redis_client
+        self.patterns = patterns
+        # Called with the decoded JSON payload of every message received.
+        self.on_message = on_message
+        self.connected = False
+        self.reconnects = 0
+        self.messages = 0
+        self.last_error = None
+        self.last_message_at = None
+        self.lag = None
+
+    # Handles one message. A malformed payload, or one the handler fails on, is logged and skipped
+    # instead of tearing down the subscription: only Redis errors should make the listener reconnect.
+    def _handle(self, message):
+        try:
+            message_data = json.loads(message['data'])
+        except ValueError as e:
+            logger.error(f"Discarding malformed update: {e}")
+            return
+        now = time.time()
+        self.messages += 1
+        self.last_message_at = now
+        if isinstance(message_data, dict) and 'timestamp' in message_data:
+            self.lag = max(0.0, now - message_data['timestamp'])
+            UPDATE_DELIVERY.observe(self.lag)
+        try:
+            self.on_message(message_data)
+        except Exception as e:
+            logger.exception(f"Error handling update {message_data!r}: {e}")
+
+    # Subscribes and consumes messages until cancelled. Connection errors are retried forever with
+    # exponential backoff; the backoff is reset once a subscription succeeds.
+    async def run(self):
+        backoff = LISTENER_BACKOFF_INITIAL
+        while True:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(*self.patterns)
+                self.connected = True
+                backoff = LISTENER_BACKOFF_INITIAL
+                logger.info(f"Redis listener subscribed to {self.patterns}")
+                async for message in pubsub.listen():
+                    if message['type'] == 'pmessage':
+                        self._handle(message)
+            except asyncio.CancelledError:
+                logger.info("Redis listener cancelled.")
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Redis listener error: {e}. Reconnecting in {backoff:.1f}s")
+            finally:
+                self.connected = False
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, LISTENER_BACKOFF_MAX)
+            self.reconnects += 1
+
+    def status(self):
+        return {
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "messages": self.messages,
+            "lag_seconds": self.lag,
+            "seconds_since_last_message": None if self.last_message_at is None else time.time() - self.last_message_at,
+            "last_error": self.last_error,
+        }
+
+
+# Keeps a coroutine running for the lifetime of the application. RedisListener.run() already recovers
+# from Redis errors and skips updates its message handler fails on; this is the safety net for anything
+# else that would otherwise end the task and silently stop updates.
+async def supervise(name, coroutine_factory, restart_delay=LISTENER_BACKOFF_INITIAL):
+    while True:
+        try:
+            await coroutine_factory()
+            logger.error(f"{name} exited unexpectedly, restarting")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"{name} crashed: {e}, restarting")
+        await asyncio.sleep(restart_delay)
@@ -0,0 +1,129 @@
+# META
+
+# Description: Prometheus metrics for the app and the workers. The app serves its metrics from
+# GET /metrics; every Celery worker starts an exporter of its own on WORKER_METRICS_PORT from its main
+# process (see worker.py), which serves the metrics of all its pool processes. Those are separate
+# processes, so the worker must run with PROMETHEUS_MULTIPROC_DIR pointing at an empty, writable
+# directory: prometheus_client then keeps every process' values in files there and the exporter adds
+# them up. Without it the exporter only sees the main process, which never trains anything.
+#
+# App (registry APP_REGISTRY):
+#   training_queue_depth{queue,state}        tasks queued or running per queue, read from the scheduler
+#                                            (see scheduling.py) at scrape time
+#   update_delivery_seconds                  worker publish -> app listener, per update
+#   websocket_fanout_seconds                 update handed to the connection manager -> sent on the socket
+#   websocket_messages_dropped_total         updates dropped because a client's send queue was full
+#   websocket_clients                        open WebSocket connections
+# Worker (registry WORKER_REGISTRY):
+#   task_wait_seconds{queue}                 time a task spent queued before a worker process took it
+#   time_to_first_epoch_seconds{start}       task start -> first completed epoch, warm or cold process
+#   epoch_seconds                            duration of an epoch, validation included
+#   training_images_per_second               per-epoch training throughput
+#   training_seconds_total                   time spent in training batches
+#   data_loading_seconds_total{split}        time the input pipeline spent gathering batches from the
+#                                            memory-mapped dataset (see pipeline.py), for training
+#                                            ("train") or validation and test ("eval"). It runs in
+#                                            background threads, so compared with training_seconds_total
+#                                            the train split shows how much of the training time loading
+#                                            takes up
+#   redis_publish_seconds                    one batch of training updates sent by the background
+#                                            publisher (see publisher.py): event log appends + PUBLISHes
+#   redis_publish_delay_seconds              update queued -> sent by the publisher
+#   redis_publish_delayed_total              updates sent more than PUBLISH_DELAYED_AFTER after queueing
+#   redis_publish_dropped_total{reason}      updates never sent: queue_full, redis_unavailable (retries
+#                                            exhausted) or error
+#   redis_publish_retries_total              batch sends retried after a Redis connection error or timeout
+#
+# Everything is recorded once per epoch, task, published update or delivered message, never per
+# training batch except for the single counter increment per batch loaded, which keeps the cost far
+# below 1% of training throughput (benchmarks/bench_metrics.py measures it).
+
+import os
+import shutil
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, start_http_server
+
+APP_REGISTRY = CollectorRegistry()
+WORKER_REGISTRY = CollectorRegistry()
+
+# Bucket boundaries in seconds for latencies within the app and to and from Redis.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Bucket boundaries in seconds for waits and durations of training work.
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+THROUGHPUT_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+# --- App ---
+
+QUEUE_DEPTH = Gauge("training_queue_depth", "Training tasks queued or running", ["queue", "state"], registry=APP_REGISTRY)
+UPDATE_DELIVERY = Histogram("update_delivery_seconds", "Time from the worker publishing an update to the app receiving it",
+                            buckets=LATENCY_BUCKETS, registry=APP_REGISTRY)
+WS_FANOUT = Histogram("websocket_fanout_seconds", "Time from an update being fanned out to it being sent on a WebSocket",
+                      buckets=LATENCY_BUCKETS, registry=APP_REGISTRY)
+WS_DROPPED = Counter("websocket_messages_dropped", "Updates dropped because a WebSocket client's send queue was full",
+                     registry=APP_REGISTRY)
+WS_CLIENTS = Gauge("websocket_clients", "Open WebSocket connections", registry=APP_REGISTRY)
+
+# --- Worker ---
+
+TASK_WAIT = Histogram("task_wait_seconds", "Time a training task spent queued", ["queue"],
+                      buckets=DURATION_BUCKETS, registry=WORKER_REGISTRY)
+TIME_TO_FIRST_EPOCH = Histogram("time_to_first_epoch_seconds", "Time from task start to its first completed epoch", ["start"],
+                                buckets=DURATION_BUCKETS, registry=WORKER_REGISTRY)
+EPOCH_SECONDS = Histogram("epoch_seconds", "Duration of a training epoch, validation included",
+                          buckets=DURATION_BUCKETS, registry=WORKER_REGISTRY)
+IMAGES_PER_SECOND = Histogram("training_images_per_second", "Training throughput of an epoch",
+                              buckets=THROUGHPUT_BUCKETS, registry=WORKER_REGISTRY)
+TRAINING_SECONDS = Counter("training_seconds", "Time spent in training batches", registry=WORKER_REGISTRY)
+DATA_LOADING_SECONDS = Counter("data_loading_seconds", "Time the input pipeline spent gathering batches, by split",
+                               ["split"], registry=WORKER_REGISTRY)
+REDIS_PUBLISH = Histogram("redis_publish_seconds", "Time to log and publish one batch of training updates",
+                          buckets=LATENCY_BUCKETS, registry=WORKER_REGISTRY)
+PUBLISH_DELAY = Histogram("redis_publish_delay_seconds", "Time a training update waited to be published",
+                          buckets=LATENCY_BUCKETS, registry=WORKER_REGISTRY)
+PUBLISH_DELAYED = Counter("redis_publish_delayed", "Training updates published more than PUBLISH_DELAYED_AFTER seconds late",
+                          registry=WORKER_REGISTRY)
+PUBLISH_DROPPED = Counter("redis_publish_dropped", "Training updates dropped without being published", ["reason"],
+                          registry=WORKER_REGISTRY)
+PUBLISH_RETRIES = Counter("redis_publish_retries", "Retried sends of a batch of training updates", registry=WORKER_REGISTRY)
+
+
+def app_metrics():
+    return generate_latest(APP_REGISTRY)
+
+
+# Records a finished epoch. 'epoch_seconds' includes validation, 'training_seconds' covers the
+# training batches only.
+def observe_epoch(epoch_seconds, training_seconds, images_per_sec):
+    EPOCH_SECONDS.observe(epoch_seconds)
+    if training_seconds:
+        TRAINING_SECONDS.inc(training_seconds)
+    if images_per_sec:
+        IMAGES_PER_SECOND.observe(images_per_sec)
+
+
+# Serves the worker metrics found in the multiprocess directory. The app's metrics are defined in
+# every process that imports this module, so their (unused) files show up there too and are skipped.
+class _WorkerCollector:
+    def __init__(self, directory):
+        self.collector = multiprocess.MultiProcessCollector(None, path=directory)
+        self.names = {metric.name for metric in WORKER_REGISTRY.collect()}
+
+    def collect(self):
+        return (metric for metric in self.collector.collect() if metric.name in self.names)
+
+
+# Starts the worker's exporter. Called once in the worker's main process before the pool forks; the
+# multiprocess directory is emptied first so values of an earlier run aren't added to this one's.
+def start_worker_exporter(port):
+    if not port:
+        return
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+        registry = CollectorRegistry()
+        registry.register(_WorkerCollector(directory))
+    else:
+        registry = WORKER_REGISTRY
+    start_http_server(port, registry=registry)
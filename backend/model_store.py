@@ -0,0 +1,135 @@
+# META
+
+# Description: Local store of trained models. train_model used to throw its model away after
+# evaluating it on the test set. Now every successful run is exported under its task id, so /predict
+# can serve it (see serving.py). Models are exported for inference only: the training loop, optimizer
+# state and Keras metadata are left out. The input normalization the dataset applies (scaling to
+# [0, 1], then subtracting the training-set mean, see dataset.py) is baked into the exported model
+# as its first layer, so a stored model takes raw RGB pixel values (0-255) and is self-contained.
+# MODEL_FORMAT picks the format:
+#   savedmodel   a TensorFlow SavedModel (model.export()), served with tf.saved_model.load()
+#   tflite       converted to TensorFlow Lite with dynamic-range quantization (8-bit weights), about an
+#                eighth of the size, served with the TFLite interpreter
+# Each model is written to a temporary directory first and renamed into place when complete, so a
+# reader never sees a half-written model.
+#
+# Layout: <ARTIFACT_DIR>/models/<task_id>/
+#   meta.json      task_id, format, training config, dataset version, test metrics, size in bytes
+#   saved_model/   or model.tflite, depending on the format
+
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from config import ARTIFACT_DIR, MODEL_FORMAT
+
+# TensorFlow's own TFLite interpreter is deprecated in favour of the ai_edge_litert package; use that
+# one when it is installed.
+try:
+    from ai_edge_litert.interpreter import Interpreter
+except ImportError:
+    Interpreter = tf.lite.Interpreter
+
+# The CIFAR-10 classes, in label order.
+CLASS_NAMES = ("airplane", "automobile", "bird", "cat", "deer", "dog", "frog", "horse", "ship", "truck")
+
+INPUT_SHAPE = (32, 32, 3)
+
+FORMATS = ("savedmodel", "tflite")
+
+
+def model_dir(task_id):
+    return os.path.join(ARTIFACT_DIR, "models", task_id)
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+# Wraps a trained model with the dataset's input normalization: x / 255 - mean.
+def _inference_model(model, mean):
+    mean = np.asarray(mean, dtype=np.float32)
+    return tf.keras.Sequential([
+        tf.keras.Input(INPUT_SHAPE),
+        tf.keras.layers.Rescaling(1.0 / 255, offset=-mean, dtype="float32"),
+        model,
+    ])
+
+
+# Exports a trained model under task_id. 'meta' holds whatever the caller wants recorded with it
+# (config, dataset version, test metrics). Returns the stored metadata.
+def save_model(task_id, model, mean, meta, model_format=MODEL_FORMAT):
+    if model_format not in FORMATS:
+        raise ValueError(f"Unknown model format {model_format}, expected one of {FORMATS}")
+    target = model_dir(task_id)
+    tmp_dir = f"{target}.tmp-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        saved_model = os.path.join(tmp_dir, "saved_model")
+        _inference_model(model, mean).export(saved_model, format="tf_saved_model", verbose=False)
+        if model_format == "tflite":
+            converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            with open(os.path.join(tmp_dir, "model.tflite"), "wb") as f:
+                f.write(converter.convert())
+            shutil.rmtree(saved_model)
+        meta = {**meta, "task_id": task_id, "format": model_format, "created": time.time(),
+                "size_bytes": _size(tmp_dir), "classes": list(CLASS_NAMES)}
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp_dir, target)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return meta
+
+
+# Returns the metadata of a stored model, or None if there is none for task_id.
+def read_model_meta(task_id):
+    try:
+        with open(os.path.join(model_dir(task_id), "meta.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Loads a stored model for inference. Returns predict(images) -> class probabilities, taking a float32
+# array of raw pixel values of shape (batch, 32, 32, 3). Raises FileNotFoundError if there is no model
+# for task_id. The returned function is not safe to call from several threads at once.
+def load_model(task_id):
+    meta = read_model_meta(task_id)
+    if meta is None:
+        raise FileNotFoundError(f"No model stored for task {task_id}")
+    if meta["format"] == "tflite":
+        return _load_tflite(os.path.join(model_dir(task_id), "model.tflite"))
+    # The loaded object owns the model's variables, so the function must keep it referenced.
+    loaded = tf.saved_model.load(os.path.join(model_dir(task_id), "saved_model"))
+    return lambda images: loaded.serve(tf.constant(images, dtype=tf.float32)).numpy()
+
+
+def _load_tflite(path):
+    interpreter = Interpreter(model_path=path)
+    input_index = interpreter.get_input_details()[0]["index"]
+    output_index = interpreter.get_output_details()[0]["index"]
+    state = {"batch": None}
+
+    def predict(images):
+        # The interpreter's tensors have a fixed shape, reallocated whenever the batch size changes.
+        if state["batch"] != len(images):
+            interpreter.resize_tensor_input(input_index, (len(images),) + INPUT_SHAPE)
+            interpreter.allocate_tensors()
+            state["batch"] = len(images)
+        interpreter.set_tensor(input_index, np.ascontiguousarray(images, dtype=np.float32))
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index).copy()
+
+    return predict
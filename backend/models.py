@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field, field_validator
-from typing import List
+from typing import List, Optional
 from re import compile, match
+from config import DISTRIBUTED_MAX_WORKERS, PREDICT_MAX_IMAGES, SWEEP_MAX_TRIALS
 
 class TrainModelRequest(BaseModel):
     layers: int = Field(ge=1, le=3, description="Number of convolutional layers in the model")
@@ -8,10 +9,20 @@ class TrainModelRequest(BaseModel):
     epochs: int = Field(ge=0, le=200)
     batchSize: int = Field(ge=1, le=512)
     optimizer: str
+    # Opt-in training modes, see precision.py.
+    precision: str = Field(default="float32", description="Keras dtype policy: float32 or mixed_bfloat16")
+    jit: bool = Field(default=False, description="Compile the train step with XLA")
 
     class Config:
         extra = "forbid"
     
+    @field_validator('precision')
+    @classmethod
+    def validate_precision(cls, v):
+        if v not in ('float32', 'mixed_bfloat16'):
+            raise ValueError('Precision must be float32 or mixed_bfloat16')
+        return v
+
     @field_validator('units')
     @classmethod
     def validate_units_length(cls, v, values):
@@ -28,6 +39,125 @@ class TrainModelRequest(BaseModel):
                 raise ValueError('Units must be between 1 and 1024')
         return v
     
+class BatchTrainModelRequest(BaseModel):
+    configs: List[TrainModelRequest] = Field(min_length = 1, max_length = 8, description="Model configurations trained together in one worker task")
+
+    class Config:
+        extra = "forbid"
+
+    # All models in a batch read the same batches from one shared input pipeline, so they must agree
+    # on the batch size.
+    @field_validator('configs')
+    @classmethod
+    def validate_same_batch_size(cls, v):
+        if len({config.batchSize for config in v}) > 1:
+            raise ValueError('All configs in a batch must use the same batchSize')
+        return v
+
+# A TrainModelRequest trained data-parallel across several worker processes, see distributed.py.
+class DistributedTrainModelRequest(TrainModelRequest):
+    workers: int = Field(ge=2, le=DISTRIBUTED_MAX_WORKERS, description="Number of worker processes to train on")
+
+    @field_validator('jit')
+    @classmethod
+    def validate_no_jit(cls, v):
+        if v:
+            raise ValueError('jit is not supported for distributed training')
+        return v
+
+# Candidate values of the TrainModelRequest fields a sweep searches over (see sweep.py). Every conv
+# layer of a trial draws its own width from 'units'.
+class SweepSpace(BaseModel):
+    layers: List[int] = Field(min_length = 1, max_length = 3)
+    units: List[int] = Field(min_length = 1, max_length = 16)
+    batchSize: List[int] = Field(min_length = 1, max_length = 8)
+    optimizer: List[str] = Field(min_length = 1, max_length = 4)
+
+    class Config:
+        extra = "forbid"
+
+    @field_validator('layers')
+    @classmethod
+    def validate_layers(cls, v):
+        if any(layers < 1 or layers > 3 for layers in v):
+            raise ValueError('Layers must be between 1 and 3')
+        return sorted(set(v))
+
+    @field_validator('units')
+    @classmethod
+    def validate_units(cls, v):
+        if any(unit < 1 or unit > 1024 for unit in v):
+            raise ValueError('Units must be between 1 and 1024')
+        return sorted(set(v))
+
+    @field_validator('batchSize')
+    @classmethod
+    def validate_batch_size(cls, v):
+        if any(batch_size < 1 or batch_size > 512 for batch_size in v):
+            raise ValueError('batchSize must be between 1 and 512')
+        return sorted(set(v))
+
+    @field_validator('optimizer')
+    @classmethod
+    def validate_optimizer(cls, v):
+        return sorted(set(v))
+
+# A hyperparameter sweep: 'trials' configurations sampled from 'space', each trained for up to
+# max_epochs and stopped early by successive halving on 'metric' (see sweep.py).
+class SweepRequest(BaseModel):
+    space: SweepSpace
+    trials: int = Field(ge=1, le=SWEEP_MAX_TRIALS, description="Number of configurations to try")
+    max_epochs: int = Field(ge=1, le=200, description="Epochs of a trial that is never stopped")
+    min_epochs: int = Field(default=1, ge=1, le=200, description="Epoch of the first early-stopping decision")
+    reduction_factor: int = Field(default=3, ge=2, le=8, description="Only 1/reduction_factor of the trials continue past each decision")
+    parallelism: int = Field(default=2, ge=1, le=16, description="Trials queued or running at once")
+    metric: str = Field(default="val_accuracy", description="Validation metric the trials are ranked by")
+    seed: Optional[int] = None
+    precision: str = Field(default="float32", description="Keras dtype policy: float32 or mixed_bfloat16")
+    jit: bool = Field(default=False, description="Compile the train step with XLA")
+
+    class Config:
+        extra = "forbid"
+
+    @field_validator('metric')
+    @classmethod
+    def validate_metric(cls, v):
+        if v not in ('val_accuracy', 'val_loss'):
+            raise ValueError('Metric must be val_accuracy or val_loss')
+        return v
+
+    @field_validator('precision')
+    @classmethod
+    def validate_precision(cls, v):
+        if v not in ('float32', 'mixed_bfloat16'):
+            raise ValueError('Precision must be float32 or mixed_bfloat16')
+        return v
+
+# Images to classify with the model trained by task 'task_id' (see serving.py): a list of 32x32 RGB
+# images, each a list of rows of [r, g, b] pixel values between 0 and 255.
+class PredictRequest(BaseModel):
+    task_id: str
+    images: List[List[List[List[float]]]] = Field(min_length = 1, max_length = PREDICT_MAX_IMAGES)
+
+    class Config:
+        extra = "forbid"
+
+    # The id names a directory in the model store, so it must be a plain task id.
+    @field_validator('task_id')
+    @classmethod
+    def validate_task_id(cls, v):
+        if not compile(r'^[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}$').match(v):
+            raise ValueError('Invalid task ID')
+        return v
+
+    @field_validator('images')
+    @classmethod
+    def validate_images(cls, v):
+        for image in v:
+            if len(image) != 32 or any(len(row) != 32 or any(len(pixel) != 3 for pixel in row) for row in image):
+                raise ValueError('Images must be 32x32 pixels with 3 channels')
+        return v
+
 class CancelTaskRequest(BaseModel):
     task_id: str
     
@@ -41,4 +171,9 @@ class CancelTaskRequest(BaseModel):
 
 
     class Config:
-        extra = "forbid"
\ No newline at end of file
+        extra = "forbid"
+
+# Same shape and validation as CancelTaskRequest: the id of the train_model task whose last checkpoint
+# /resume continues from.
+class ResumeTaskRequest(CancelTaskRequest):
+    pass
\ No newline at end of file
@@ -0,0 +1,120 @@
+# META
+
+# Description: tf.data input pipelines used by the training tasks in worker.py. These replace
+# ImageDataGenerator.flow(), which augmented one image at a time in Python and could not keep a
+# CPU-only worker busy. Here augmentation (random shifts of up to 10% plus horizontal flips) is done on
+# whole batches with tensor ops inside map(num_parallel_calls=...), and batches are prefetched so the
+# next one is ready by the time the model asks for it.
+
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from metrics import DATA_LOADING_SECONDS
+from config import DATA_MAX_INTRA_OP_PARALLELISM, DATA_PARALLEL_CALLS, DATA_PREFETCH, DATA_THREADPOOL_SIZE
+
+# Same augmentation strength ImageDataGenerator was configured with: width_shift_range and
+# height_shift_range of 0.1, i.e. up to 3 pixels on a 32x32 image.
+SHIFT_RANGE = 0.1
+
+
+# Applies the threading settings from config.py to a pipeline. A private thread pool keeps several
+# concurrent tasks in one worker from contending for TensorFlow's shared inter-op pool. Pipelines that
+# are sharded explicitly (see _shard_range) turn tf.distribute's own auto-sharding off.
+def _with_options(ds, sharded=False):
+    options = tf.data.Options()
+    if sharded:
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    if DATA_THREADPOOL_SIZE > 0:
+        options.threading.private_threadpool_size = DATA_THREADPOOL_SIZE
+    if DATA_MAX_INTRA_OP_PARALLELISM > 0:
+        options.threading.max_intra_op_parallelism = DATA_MAX_INTRA_OP_PARALLELISM
+    return ds.with_options(options)
+
+
+# Indices of the samples in one shard, for data-parallel training across several processes (see
+# distributed.py). 'shard' is (num_shards, index); None means all samples. Every shard gets the same
+# number of samples, dropping the remainder, since the processes must run the same number of steps.
+def _shard_range(num_samples, shard):
+    if shard is None:
+        return tf.data.Dataset.range(num_samples)
+    num_shards, index = shard
+    return tf.data.Dataset.range(num_samples - num_samples % num_shards).shard(num_shards, index)
+
+
+# Randomly shifts and horizontally flips a batch of images of shape (batch, height, width, channels).
+# Instead of looping over images, each image gets its own row and column index vectors and a single
+# batched gather per axis produces the whole augmented batch. Clipping the indices to the image bounds
+# reproduces ImageDataGenerator's default fill_mode='nearest', and a flip is just reversing the column
+# indices, so it costs nothing extra.
+def augment_batch(images, shift_range=SHIFT_RANGE):
+    batch = tf.shape(images)[0]
+    height, width = images.shape[1], images.shape[2]
+    max_dy = int(round(height * shift_range))
+    max_dx = int(round(width * shift_range))
+
+    dy = tf.random.uniform((batch, 1), -max_dy, max_dy + 1, dtype=tf.int32)
+    dx = tf.random.uniform((batch, 1), -max_dx, max_dx + 1, dtype=tf.int32)
+    rows = tf.clip_by_value(tf.range(height)[tf.newaxis, :] - dy, 0, height - 1)
+    cols = tf.clip_by_value(tf.range(width)[tf.newaxis, :] - dx, 0, width - 1)
+
+    flip = tf.random.uniform((batch, 1)) < 0.5
+    cols = tf.where(flip, (width - 1) - cols, cols)
+
+    images = tf.gather(images, rows, axis=1, batch_dims=1)
+    return tf.gather(images, cols, axis=2, batch_dims=1)
+
+
+# Returns a map() function turning a batch of sample indices into the batch of images and labels, read
+# from the (memory-mapped) arrays x and y in the pipeline's threads. The time that takes is reported as
+# data loading of 'split', "train" or "eval" (see metrics.py).
+def _gather_from(x, y, split):
+    image_shape = tuple(x.shape[1:])
+    label_shape = tuple(y.shape[1:])
+    loading_seconds = DATA_LOADING_SECONDS.labels(split)
+
+    def load_batch(indices):
+        start = time.perf_counter()
+        indices = np.sort(indices)
+        batch = np.asarray(x[indices], dtype=np.float32), np.asarray(y[indices])
+        loading_seconds.inc(time.perf_counter() - start)
+        return batch
+
+    def gather(indices):
+        images, labels = tf.numpy_function(load_batch, [indices], (tf.float32, tf.as_dtype(y.dtype)))
+        images.set_shape((None,) + image_shape)
+        labels.set_shape((None,) + label_shape)
+        return images, labels
+
+    return gather
+
+
+# Training pipeline. The source is a shuffled stream of indices rather than the images themselves, so
+# the memory-mapped arrays from dataset.py are never copied into the graph: each batch is gathered from
+# the shared pages on demand, which also makes the operating system's page cache act as the cache for
+# the training set across every task and worker process. Gathering and augmentation run in parallel
+# map() calls and the result is prefetched. With 'shard', only that shard of the training set is used.
+def build_train_dataset(x, y, batch_size, shuffle_seed=None, shard=None):
+    ds = _shard_range(len(x), shard)
+    ds = ds.shuffle(len(x), seed=shuffle_seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+    # No cache() here. Before the gather it would only cache indices; after it, it would copy the whole
+    # training set into the memory of every task, which the memory-mapped arrays exist to avoid, and
+    # after augmentation it would replay the same shifts and flips every epoch. The page cache over the
+    # memory-mapped arrays already keeps repeated epochs from going back to disk.
+    ds = ds.map(_gather_from(x, y, "train"), num_parallel_calls=DATA_PARALLEL_CALLS)
+    ds = ds.map(lambda images, labels: (augment_batch(images), labels), num_parallel_calls=DATA_PARALLEL_CALLS)
+    ds = ds.prefetch(DATA_PREFETCH)
+    return _with_options(ds, sharded=shard is not None)
+
+
+# Validation/test pipeline: batches of consecutive indices, neither shuffled nor augmented, gathered
+# from the memory-mapped arrays like the training batches, so the split is never copied into the graph
+# or cached a second time in the process; the page cache already serves repeated passes. 'shard' works
+# as for training.
+def build_eval_dataset(x, y, batch_size, shard=None):
+    ds = _shard_range(len(x), shard).batch(batch_size)
+    ds = ds.map(_gather_from(x, y, "eval"), num_parallel_calls=DATA_PARALLEL_CALLS)
+    ds = ds.prefetch(DATA_PREFETCH)
+    return _with_options(ds, sharded=shard is not None)
@@ -0,0 +1,118 @@
+# META
+
+# Description: Opt-in numeric precision and XLA compilation for training. By default models train in
+# float32 with Keras' default compile settings, which on a CPU-only worker means no XLA. A
+# TrainModelRequest can ask for
+#   precision="mixed_bfloat16"  layers compute in bfloat16 while keeping their variables in float32.
+#                               Only used where the hardware has native bfloat16 arithmetic (x86 CPUs
+#                               with AVX512_BF16 or AMX, GPUs of compute capability 8.0 and up);
+#                               elsewhere bfloat16 is emulated and slower than float32, so the task
+#                               falls back to float32 and says so.
+#   jit=True                    model.compile(jit_compile=True): the train step is compiled with XLA,
+#                               which fuses the convolution, activation and pooling kernels.
+# Both can be combined. The policy the task actually ran with is reported with its result, along with
+# the measured training throughput (see ThroughputCallback), so the modes can be compared on each
+# worker host; benchmarks/bench_precision.py does that systematically.
+
+import contextlib
+import statistics
+import time
+
+import tensorflow as tf
+
+PRECISIONS = ("float32", "mixed_bfloat16")
+
+_bf16_supported = None
+
+
+# Whether this host has native bfloat16 arithmetic. Checked once per process.
+def bf16_supported():
+    global _bf16_supported
+    if _bf16_supported is None:
+        _bf16_supported = _gpu_supports_bf16() or _cpu_supports_bf16()
+    return _bf16_supported
+
+
+def _cpu_supports_bf16():
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def _gpu_supports_bf16():
+    for gpu in tf.config.list_physical_devices("GPU"):
+        capability = tf.config.experimental.get_device_details(gpu).get("compute_capability")
+        if capability and capability >= (8, 0):
+            return True
+    return False
+
+
+# Returns the Keras dtype policy to train with for the requested precision.
+def resolve_precision(precision):
+    if precision == "mixed_bfloat16" and not bf16_supported():
+        print("bfloat16 is not supported natively on this host, training in float32 instead")
+        return "float32"
+    return precision
+
+
+# Makes 'policy' the global Keras dtype policy while models are built, and restores the previous one
+# afterwards. The policy is process-wide and worker processes run many tasks, so it must not leak into
+# the next task. Layers take their dtype from the policy when they're created; once built, a model
+# keeps its policy.
+@contextlib.contextmanager
+def precision_policy(policy):
+    previous = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy(policy)
+    try:
+        yield
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
+
+
+# The jit_compile argument for model.compile(): jit=False keeps Keras' default ("auto", which enables
+# XLA only on GPUs), jit=True forces XLA.
+def jit_compile_setting(jit):
+    return True if jit else "auto"
+
+
+# Measures training throughput in images/sec per epoch, over the training batches only (validation is
+# excluded). The first epoch includes tracing and, with jit, XLA compilation; images_per_sec()
+# therefore reports the median of the later epochs when there are any. 'num_samples' is the number of
+# training samples per epoch, so the last batch of an epoch is counted with its real, possibly smaller,
+# size; None means every batch is full (a repeated dataset, for example).
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    def __init__(self, batch_size, num_samples=None):
+        super().__init__()
+        self.batch_size = batch_size
+        self.num_samples = num_samples
+        self.epoch_rates = []
+        # Seconds the last epoch spent in training batches.
+        self.last_elapsed = None
+        self.epoch_start = None
+        self.last_batch_end = None
+        self.images = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = self.last_batch_end = time.perf_counter()
+        self.images = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.num_samples is None:
+            self.images += self.batch_size
+        else:
+            self.images += min(self.batch_size, self.num_samples - batch * self.batch_size)
+        self.last_batch_end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = self.last_batch_end - self.epoch_start
+        self.last_elapsed = elapsed
+        if self.images and elapsed > 0:
+            self.epoch_rates.append(self.images / elapsed)
+
+    def images_per_sec(self):
+        if not self.epoch_rates:
+            return None
+        return statistics.median(self.epoch_rates[1:] or self.epoch_rates)
@@ -0,0 +1,72 @@
+# META
+
+# Description: Batch-level training progress for the worker tasks in worker.py. Epoch updates alone
+# leave the UI without any feedback for minutes when epochs are long, but publishing on every batch
+# would flood Redis and the WebSocket. ProgressReporter is told about every batch, which costs little
+# more than a clock read, and publishes at most PROGRESS_HZ times a second. Whatever happened between
+# two updates is coalesced: only the latest loss/accuracy is sent, along with the throughput measured
+# over the whole interval and the estimated time remaining.
+
+import math
+import time
+
+import tensorflow as tf
+
+from config import PROGRESS_HZ
+
+
+class ProgressReporter:
+    # 'publish' is called as publish(task_id, update), 'steps_per_epoch' is the number of batches in
+    # an epoch and 'extra' holds fields added to every update (a batch_id, for example).
+    def __init__(self, publish, task_id, epochs, steps_per_epoch, hz=PROGRESS_HZ, extra=None):
+        self.publish = publish
+        self.task_id = task_id
+        self.total_steps = epochs * steps_per_epoch
+        self.steps_per_epoch = steps_per_epoch
+        self.interval = 1.0 / hz if hz > 0 else math.inf
+        self.extra = extra or {}
+        self.steps_done = 0
+        self.samples_since_update = 0
+        self.start = self.last_update = time.perf_counter()
+
+    # Records a finished batch. 'logs' may hold tensors; they are only converted to Python floats when
+    # an update is actually published, so skipped batches never force a device sync.
+    def batch_end(self, epoch, step, batch_size, logs):
+        self.steps_done += 1
+        self.samples_since_update += batch_size
+        now = time.perf_counter()
+        if now - self.last_update < self.interval:
+            return
+        elapsed = now - self.last_update
+        steps_per_sec = self.steps_done / (now - self.start)
+        remaining = max(self.total_steps - self.steps_done, 0)
+        self.publish(self.task_id, {
+            'status': "BATCH",
+            'epoch': epoch + 1,
+            'batch': step + 1,
+            'steps': self.steps_per_epoch,
+            'logs': {name: float(value) for name, value in (logs or {}).items()},
+            'samples_per_sec': self.samples_since_update / elapsed,
+            'eta_seconds': remaining / steps_per_sec if steps_per_sec > 0 else None,
+            **self.extra,
+        })
+        self.samples_since_update = 0
+        self.last_update = now
+
+
+# Keras callback feeding a ProgressReporter from model.fit(). 'num_samples' is the number of training
+# samples per epoch, so the last batch of an epoch is counted with its real, possibly smaller, size.
+class ProgressCallback(tf.keras.callbacks.Callback):
+    def __init__(self, reporter, batch_size, num_samples):
+        super().__init__()
+        self.reporter = reporter
+        self.batch_size = batch_size
+        self.num_samples = num_samples
+        self.epoch = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        size = min(self.batch_size, self.num_samples - batch * self.batch_size)
+        self.reporter.batch_end(self.epoch, batch, size, logs)
@@ -0,0 +1,154 @@
+# META
+
+# Description: Background publishing of training updates for the worker. publish_update() used to
+# append each update to the task's event stream (see events.py) and PUBLISH it right on the training
+# thread, from inside the Keras callbacks: a slow Redis slowed training down, and a Redis error raised
+# inside model.fit() failed the whole task. Now every worker process has a BackgroundPublisher. Its
+# publish() only puts the update on a bounded queue, and a thread sends what is queued to Redis:
+#   - in batches of up to PUBLISH_BATCH_SIZE updates, pipelined, so a batch costs two round trips
+#     however many updates it holds: one for the event stream appends (whose ids the published updates
+#     carry as 'event_id'), one for the PUBLISHes;
+#   - over its own connection pool with socket timeouts, so a hung Redis can't hold the thread forever
+#     and the task's other Redis calls never wait for a free connection behind it;
+#   - retrying a failed batch with exponential backoff, then dropping it. When the stream appends went
+#     through and only the PUBLISHes failed, a retry doesn't append the events again. A send that timed
+#     out may still have reached Redis, though, so an update can occasionally be published twice.
+# Updates leave in the order they were queued. When the queue is full (Redis has been unreachable for
+# a while), new updates are dropped, since the next epoch's update supersedes them anyway; a final
+# update (SUCCESS, ERROR, CANCELLED, STOPPED) instead waits for room, and the task then waits until it
+# is sent (flush()), so that neither a task nor its process ends with its result still queued.
+# Dropped, delayed and retried updates are counted (see metrics.py).
+
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+import redis
+
+import metrics
+from config import (PUBLISH_BATCH_SIZE, PUBLISH_DELAYED_AFTER, PUBLISH_FLUSH_TIMEOUT, PUBLISH_MAX_RETRIES, PUBLISH_POOL_SIZE,
+                    PUBLISH_QUEUE_SIZE, PUBLISH_RETRY_BACKOFF, PUBLISH_RETRY_MAX_BACKOFF, PUBLISH_SOCKET_TIMEOUT, REDIS_URL)
+from events import FINAL_STATUSES, add_event, decode_event_id
+
+# An update waiting to be sent. 'queued' is the perf_counter() time it was queued at.
+Message = collections.namedtuple("Message", "task_id update queued")
+
+
+class BackgroundPublisher:
+    def __init__(self, redis_url=REDIS_URL, max_queue=PUBLISH_QUEUE_SIZE, batch_size=PUBLISH_BATCH_SIZE,
+                 max_retries=PUBLISH_MAX_RETRIES, backoff=PUBLISH_RETRY_BACKOFF, max_backoff=PUBLISH_RETRY_MAX_BACKOFF):
+        self.pool = redis.ConnectionPool.from_url(redis_url, max_connections=PUBLISH_POOL_SIZE, socket_timeout=PUBLISH_SOCKET_TIMEOUT,
+                                                  socket_connect_timeout=PUBLISH_SOCKET_TIMEOUT)
+        self.client = redis.Redis(connection_pool=self.pool)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.pid = None
+
+    # Creates the queue and starts the sender thread, once per process: the worker's pool processes are
+    # forked from a main process that may have created the publisher, but threads don't survive a fork.
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.max_queue)
+            # Number of queued updates not yet sent or dropped, for flush().
+            self.unfinished = 0
+            self.done = threading.Condition()
+            threading.Thread(target=self._run, name="redis-publisher", daemon=True).start()
+            self.pid = os.getpid()
+
+    # Queues an update for task_id and returns right away. Returns False if it was dropped because the
+    # queue is full. A final update waits for room instead, up to PUBLISH_FLUSH_TIMEOUT seconds.
+    def publish(self, task_id, update):
+        self._ensure_started()
+        with self.done:
+            self.unfinished += 1
+        try:
+            message = Message(task_id, update, time.perf_counter())
+            if update.get('status') in FINAL_STATUSES:
+                self.queue.put(message, timeout=PUBLISH_FLUSH_TIMEOUT)
+            else:
+                self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self._finish(1)
+            metrics.PUBLISH_DROPPED.labels("queue_full").inc()
+            return False
+
+    # Waits until every update queued so far is sent (or dropped). Returns False on timeout.
+    def flush(self, timeout=PUBLISH_FLUSH_TIMEOUT):
+        if self.pid != os.getpid():
+            return True
+        with self.done:
+            return self.done.wait_for(lambda: self.unfinished == 0, timeout)
+
+    def _finish(self, count):
+        with self.done:
+            self.unfinished -= count
+            if self.unfinished == 0:
+                self.done.notify_all()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send_with_retries(batch)
+            except Exception as e:
+                print(f"Could not publish {len(batch)} training updates: {e}")
+                metrics.PUBLISH_DROPPED.labels("error").inc(len(batch))
+            finally:
+                self._finish(len(batch))
+
+    def _send_with_retries(self, batch):
+        # Copies of the updates, which keep the event ids of a successful stream append across retries.
+        payloads = [dict(message.update) for message in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._send(batch, payloads)
+                return
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    print(f"Dropping {len(batch)} training updates after {attempt + 1} attempts: {e}")
+                    metrics.PUBLISH_DROPPED.labels("redis_unavailable").inc(len(batch))
+                    return
+                metrics.PUBLISH_RETRIES.inc()
+                time.sleep(min(self.backoff * 2 ** attempt, self.max_backoff))
+
+    # Appends the batch's events to their streams (batch-level progress isn't logged), then publishes
+    # every update. Payloads that already got an event id on an earlier attempt keep it.
+    def _send(self, batch, payloads):
+        start = time.perf_counter()
+        to_log = [(message.task_id, payload) for message, payload in zip(batch, payloads)
+                  if payload.get('status') != "BATCH" and 'event_id' not in payload]
+        if to_log:
+            with self.client.pipeline(transaction=False) as pipe:
+                for task_id, payload in to_log:
+                    add_event(pipe, task_id, payload)
+                results = pipe.execute()
+            for (_, payload), event_id in zip(to_log, results[::2]):
+                payload['event_id'] = decode_event_id(event_id)
+        with self.client.pipeline(transaction=False) as pipe:
+            for message, payload in zip(batch, payloads):
+                pipe.publish(f"model_updates:{message.task_id}", json.dumps(payload))
+            pipe.execute()
+        sent = time.perf_counter()
+        metrics.REDIS_PUBLISH.observe(sent - start)
+        for message in batch:
+            delay = sent - message.queued
+            metrics.PUBLISH_DELAY.observe(delay)
+            if delay > PUBLISH_DELAYED_AFTER:
+                metrics.PUBLISH_DELAYED.inc()
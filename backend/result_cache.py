@@ -0,0 +1,156 @@
+# META
+
+# Description: Content-addressed cache of training results, used by app.py so that submitting the
+# same configuration to /train twice doesn't retrain from scratch. A configuration is identified by a
+# hash of its normalized TrainModelRequest fields plus the dataset version (see config.py), so a change
+# to the preprocessing automatically invalidates old results.
+#
+# Everything lives in Redis so it is shared by every app process:
+#   result_cache:result:<key>   JSON result (task_id, test accuracy/loss, per-epoch history), with a TTL
+#   result_cache:lru            sorted set of keys scored by last access, used for LRU eviction
+#   result_cache:task:<task_id> the key a task is computing/has computed, used to store its result and
+#                               to replay it to WebSocket clients subscribing to that task
+#   result_cache:inflight:<key> task_id of the task currently computing <key>, used to attach
+#                               duplicate requests to the task that is already running
+
+import hashlib
+import json
+import time
+
+from config import DATASET_VERSION, RESULT_CACHE_INFLIGHT_TTL, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL
+from events import FINAL_STATUSES
+
+PREFIX = "result_cache"
+
+
+# Builds the cache key for a TrainModelRequest. Field order, whitespace and optimizer name casing
+# don't change what gets trained, so they don't change the key either.
+def cache_key(payload):
+    normalized = {
+        "layers": payload.layers,
+        "units": list(payload.units),
+        "epochs": payload.epochs,
+        "batchSize": payload.batchSize,
+        "optimizer": payload.optimizer.strip().lower(),
+        "dataset": DATASET_VERSION,
+    }
+    # Non-default training modes (see precision.py) change the result, so they're part of the key. They
+    # are left out when unset so the keys of plain requests stay the same as before they existed.
+    if payload.precision != "float32":
+        normalized["precision"] = payload.precision
+    if payload.jit:
+        normalized["jit"] = True
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, redis_client, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES,
+                 inflight_ttl=RESULT_CACHE_INFLIGHT_TTL):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.inflight_ttl = inflight_ttl
+
+    # Returns the cached result for key, or None. A hit refreshes the entry's LRU position.
+    async def get(self, key):
+        data = await self.redis.get(f"{PREFIX}:result:{key}")
+        if data is None:
+            return None
+        await self.redis.zadd(f"{PREFIX}:lru", {key: time.time()})
+        return json.loads(data)
+
+    # Returns the cached result of the task with the given id, or None if that task's result isn't
+    # cached (yet).
+    async def get_by_task(self, task_id):
+        key = await self.redis.get(f"{PREFIX}:task:{task_id}")
+        if key is None:
+            return None
+        return await self.get(key.decode())
+
+    async def put(self, key, result):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(f"{PREFIX}:result:{key}", json.dumps(result), ex=self.ttl)
+            pipe.set(f"{PREFIX}:task:{result['task_id']}", key, ex=self.ttl)
+            pipe.zadd(f"{PREFIX}:lru", {key: time.time()})
+            await pipe.execute()
+        await self._evict()
+
+    # Drops the least recently used results once there are more than max_entries of them. Entries that
+    # already expired through their TTL are dropped from the index at the same time.
+    async def _evict(self):
+        await self.redis.zremrangebyscore(f"{PREFIX}:lru", "-inf", time.time() - self.ttl)
+        excess = await self.redis.zcard(f"{PREFIX}:lru") - self.max_entries
+        if excess <= 0:
+            return
+        keys = [key.decode() for key in await self.redis.zrange(f"{PREFIX}:lru", 0, excess - 1)]
+        results = await self.redis.mget([f"{PREFIX}:result:{key}" for key in keys])
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, data in zip(keys, results):
+                pipe.delete(f"{PREFIX}:result:{key}")
+                if data is not None:
+                    pipe.delete(f"{PREFIX}:task:{json.loads(data)['task_id']}")
+            pipe.zrem(f"{PREFIX}:lru", *keys)
+            await pipe.execute()
+
+    # Registers task_id as the task computing key. Returns None if the claim succeeded, or the id of
+    # the task that already holds it.
+    async def claim(self, key, task_id):
+        claimed = await self.redis.set(f"{PREFIX}:inflight:{key}", task_id, nx=True, ex=self.inflight_ttl)
+        if claimed:
+            await self.redis.set(f"{PREFIX}:task:{task_id}", key, ex=self.inflight_ttl)
+            return None
+        holder = await self.redis.get(f"{PREFIX}:inflight:{key}")
+        # The holder may have finished between our SET and GET; try once more.
+        if holder is None:
+            return await self.claim(key, task_id)
+        return holder.decode()
+
+    # Takes over the claim on key from a task that is known to be dead (failed, revoked or lost).
+    async def reclaim(self, key, task_id):
+        await self.redis.delete(f"{PREFIX}:inflight:{key}")
+        return await self.claim(key, task_id)
+
+    # Releases the claim a task holds, for instance after it failed or was cancelled, so the next
+    # identical request starts a fresh task.
+    async def release(self, task_id):
+        key = await self.redis.get(f"{PREFIX}:task:{task_id}")
+        if key is None:
+            return
+        key = key.decode()
+        holder = await self.redis.get(f"{PREFIX}:inflight:{key}")
+        if holder is not None and holder.decode() == task_id:
+            await self.redis.delete(f"{PREFIX}:inflight:{key}")
+        if await self.redis.get(f"{PREFIX}:result:{key}") is None:
+            await self.redis.delete(f"{PREFIX}:task:{task_id}")
+
+    # Called with every update the worker publishes. Stores the result of tasks that completed
+    # successfully and releases the claim of tasks that ended in any other way.
+    async def record(self, update):
+        task_id, status = update.get("task_id"), update.get("status")
+        if task_id is None or status not in FINAL_STATUSES:
+            return
+        if status != "SUCCESS":
+            await self.release(task_id)
+            return
+        key = await self.redis.get(f"{PREFIX}:task:{task_id}")
+        if key is None:
+            return
+        key = key.decode()
+        await self.put(key, {
+            "task_id": task_id,
+            "test_accuracy": update.get("test_accuracy"),
+            "test_loss": update.get("test_loss"),
+            "history": update.get("history", []),
+        })
+        await self.redis.delete(f"{PREFIX}:inflight:{key}")
+
+
+# Rebuilds the sequence of updates a client would have received while the task was running from a
+# cached result: one PROGRESS update per epoch, then the final SUCCESS update.
+def replay_updates(result):
+    task_id = result["task_id"]
+    updates = [{"task_id": task_id, "status": "PROGRESS", "epoch": entry["epoch"], "logs": entry["logs"], "cached": True}
+               for entry in result.get("history", [])]
+    updates.append({"task_id": task_id, "status": "SUCCESS", "test_accuracy": result["test_accuracy"],
+                    "test_loss": result["test_loss"], "cached": True})
+    return updates
@@ -0,0 +1,194 @@
+# META
+
+# Description: Priority and fair-share scheduling of training tasks. Every task used to go into
+# Celery's single default queue in FIFO order, so one 200-epoch run with batchSize=1 could hold up
+# everyone's quick experiments for hours. Now:
+#   - every task gets an estimated cost, epochs x parameter count / batch size, computed from its
+#     configuration without building the model;
+#   - cheap tasks (cost <= FAST_LANE_MAX_COST) are routed to a fast-lane queue with its own worker, so
+#     they never wait behind long runs;
+#   - a client can hold at most MAX_TASKS_PER_CLIENT queued or running tasks at once;
+#   - /train reports the task's position in its queue and an estimated start time.
+#
+# Start times are estimated by replaying the queue onto the lane's worker slots: every running task
+# frees its slot at its expected finish time, and every task ahead in the queue then occupies the first
+# slot that frees up for its estimated duration. Durations are cost x seconds per unit of cost, a rate
+# that starts at SCHEDULER_SECONDS_PER_COST and follows the durations of finished tasks.
+#
+# Everything lives in Redis so it is shared by every app process and the workers:
+#   scheduler:task:<task_id>      hash: lane, client, cost, estimated seconds, enqueued/started time
+#   scheduler:queued:<lane>       sorted set of the lane's queued task ids, scored by enqueue time
+#   scheduler:running:<lane>      sorted set of the lane's running task ids, scored by expected finish
+#   scheduler:client:<client_id>  set of the client's queued and running task ids
+#   scheduler:seconds_per_cost    current estimate of training seconds per unit of cost
+
+import heapq
+import time
+
+from config import (FAST_LANE_MAX_COST, FAST_LANE_QUEUE, FAST_LANE_SLOTS, MAX_TASKS_PER_CLIENT,
+                    SCHEDULER_SECONDS_PER_COST, TRAIN_QUEUE, TRAIN_QUEUE_SLOTS)
+from estimator import param_count
+from events import FINAL_STATUSES
+
+PREFIX = "scheduler"
+
+# Entries are dropped this long after their task was enqueued, in case a final update never arrives.
+TASK_TTL = 7 * 24 * 3600
+
+# Weight of the newest finished task in the running seconds-per-cost estimate.
+RATE_SMOOTHING = 0.2
+
+
+# Cost used for routing. The parameter count comes from the analytic model profile in estimator.py.
+def estimate_cost(layers, units, epochs, batch_size):
+    return epochs * param_count(layers, units) / batch_size
+
+
+def lane_for(cost):
+    return FAST_LANE_QUEUE if cost <= FAST_LANE_MAX_COST else TRAIN_QUEUE
+
+
+LANE_SLOTS = {TRAIN_QUEUE: TRAIN_QUEUE_SLOTS, FAST_LANE_QUEUE: FAST_LANE_SLOTS}
+
+
+# Called by the worker (with its synchronous Redis client) when it starts executing a task: moves the
+# task from its lane's queue to the lane's running set. Returns the lane and how many seconds the task
+# waited in it, or None for tasks the scheduler doesn't know.
+def mark_started(redis_client, task_id):
+    entry = redis_client.hgetall(f"{PREFIX}:task:{task_id}")
+    if not entry:
+        return None
+    lane = entry[b"lane"].decode()
+    now = time.time()
+    with redis_client.pipeline() as pipe:
+        pipe.zrem(f"{PREFIX}:queued:{lane}", task_id)
+        pipe.zadd(f"{PREFIX}:running:{lane}", {task_id: now + float(entry[b"estimate"])})
+        pipe.hset(f"{PREFIX}:task:{task_id}", "started", now)
+        pipe.execute()
+    return lane, max(0.0, now - float(entry[b"enqueued"]))
+
+
+class Scheduler:
+    # 'is_finished' is called with a task id and returns whether Celery considers that task done. It is
+    # used to clean up after tasks whose final update never arrived (lost worker, revoked while queued).
+    def __init__(self, redis_client, is_finished, max_tasks_per_client=MAX_TASKS_PER_CLIENT):
+        self.redis = redis_client
+        self.is_finished = is_finished
+        self.max_tasks_per_client = max_tasks_per_client
+
+    async def seconds_per_cost(self):
+        rate = await self.redis.get(f"{PREFIX}:seconds_per_cost")
+        return float(rate) if rate is not None else SCHEDULER_SECONDS_PER_COST
+
+    # Reserves one of the client's task slots for task_id. Returns False if the client already holds
+    # max_tasks_per_client tasks. With force, the task is counted but never refused; sweeps use it for
+    # trials replacing one that just ended.
+    async def admit(self, client_id, task_id, force=False):
+        key = f"{PREFIX}:client:{client_id}"
+        if force:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.sadd(key, task_id)
+                pipe.expire(key, TASK_TTL)
+                await pipe.execute()
+            return True
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.sadd(key, task_id)
+            pipe.expire(key, TASK_TTL)
+            pipe.scard(key)
+            _, _, held = await pipe.execute()
+        if held <= self.max_tasks_per_client:
+            return True
+        # Over the limit: forget tasks that are already done and count again.
+        for member in await self.redis.smembers(key):
+            member = member.decode()
+            if member != task_id and self.is_finished(member):
+                await self.finish(member)
+        if await self.redis.scard(key) <= self.max_tasks_per_client:
+            return True
+        await self.redis.srem(key, task_id)
+        return False
+
+    # Records a task that is about to be sent to 'lane'. Returns its estimated duration in seconds.
+    async def enqueue(self, task_id, client_id, lane, cost):
+        estimate = cost * await self.seconds_per_cost()
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(f"{PREFIX}:task:{task_id}", mapping={
+                "lane": lane, "client": client_id, "cost": cost, "estimate": estimate, "enqueued": now,
+            })
+            pipe.expire(f"{PREFIX}:task:{task_id}", TASK_TTL)
+            pipe.zadd(f"{PREFIX}:queued:{lane}", {task_id: now})
+            await pipe.execute()
+        return estimate
+
+    # Returns the task's 1-based position in its lane's queue and its estimated start time (a Unix
+    # timestamp), or (0, None) once it is running or unknown.
+    async def position(self, task_id):
+        lane = await self.redis.hget(f"{PREFIX}:task:{task_id}", "lane")
+        if lane is None:
+            return 0, None
+        lane = lane.decode()
+        rank = await self.redis.zrank(f"{PREFIX}:queued:{lane}", task_id)
+        if rank is None:
+            return 0, None
+        now = time.time()
+        ahead = [member.decode() for member in await self.redis.zrange(f"{PREFIX}:queued:{lane}", 0, rank - 1)] if rank else []
+        estimates = []
+        if ahead:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for member in ahead:
+                    pipe.hget(f"{PREFIX}:task:{member}", "estimate")
+                estimates = [float(value or 0) for value in await pipe.execute()]
+        running = await self.redis.zrange(f"{PREFIX}:running:{lane}", 0, -1, withscores=True)
+        # Time at which each of the lane's worker slots becomes free.
+        slots = sorted(max(0.0, finish - now) for _, finish in running)
+        free_at = (slots + [0.0] * LANE_SLOTS[lane])[:max(1, LANE_SLOTS[lane])]
+        heapq.heapify(free_at)
+        for estimate in estimates:
+            heapq.heapreplace(free_at, free_at[0] + estimate)
+        return rank + 1, now + free_at[0]
+
+    # Whether the task is known, i.e. queued or running and not finished yet.
+    async def is_tracked(self, task_id):
+        return await self.redis.exists(f"{PREFIX}:task:{task_id}") > 0
+
+    # Whether the task is known and still waiting in its queue, i.e. no worker has started it yet.
+    async def is_queued(self, task_id):
+        entry = await self.redis.hmget(f"{PREFIX}:task:{task_id}", "lane", "started")
+        return entry[0] is not None and entry[1] is None
+
+    # Forgets a task once it ended (any final status) or was cancelled. Successful runs also update the
+    # seconds-per-cost estimate. 'finished_at' is the time of the task's final update.
+    async def finish(self, task_id, succeeded=False, finished_at=None):
+        entry = await self.redis.hgetall(f"{PREFIX}:task:{task_id}")
+        if not entry:
+            return
+        lane = entry[b"lane"].decode()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zrem(f"{PREFIX}:queued:{lane}", task_id)
+            pipe.zrem(f"{PREFIX}:running:{lane}", task_id)
+            pipe.srem(f"{PREFIX}:client:{entry[b'client'].decode()}", task_id)
+            pipe.delete(f"{PREFIX}:task:{task_id}")
+            await pipe.execute()
+        cost = float(entry[b"cost"])
+        if succeeded and b"started" in entry and cost > 0:
+            duration = (finished_at or time.time()) - float(entry[b"started"])
+            rate = await self.seconds_per_cost()
+            rate = (1 - RATE_SMOOTHING) * rate + RATE_SMOOTHING * duration / cost
+            await self.redis.set(f"{PREFIX}:seconds_per_cost", rate)
+
+    # Number of tasks queued and running in every lane, as {lane: (queued, running)}.
+    async def depths(self):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for lane in LANE_SLOTS:
+                pipe.zcard(f"{PREFIX}:queued:{lane}")
+                pipe.zcard(f"{PREFIX}:running:{lane}")
+            counts = await pipe.execute()
+        return {lane: (counts[2 * i], counts[2 * i + 1]) for i, lane in enumerate(LANE_SLOTS)}
+
+    # Called with every update the worker publishes; forgets tasks as they end.
+    async def record(self, update):
+        task_id, status = update.get("task_id"), update.get("status")
+        if task_id is None or status not in FINAL_STATUSES:
+            return
+        await self.finish(task_id, succeeded=status == "SUCCESS", finished_at=update.get("timestamp"))
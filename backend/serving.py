@@ -0,0 +1,133 @@
+# META
+
+# Description: Inference for /predict, on the models train_model stores (see model_store.py). Two
+# pieces:
+#   - ModelCache keeps the most recently used models loaded, up to MODEL_CACHE_SIZE of them; the least
+#     recently used one is dropped to make room. Loading happens in a thread so the event loop keeps
+#     serving, and concurrent requests for a model that is still loading wait for the same load.
+#   - Every loaded model gets a MicroBatcher. A single request usually holds one or a few images, and a
+#     forward pass over a handful of images costs about as much as one over dozens, so instead of
+#     running each request on its own the batcher takes every request that queued up while the
+#     previous pass ran (up to PREDICT_MAX_BATCH images), runs them as one batch and hands every
+#     request its own slice of the result. Under load this multiplies throughput, and an isolated
+#     request runs right away. PREDICT_BATCH_WINDOW_MS optionally keeps each batch open a little
+#     longer after its first request for more to arrive.
+# Forward passes run in a thread as well, one at a time per model.
+
+import asyncio
+import collections
+
+import numpy as np
+
+from config import MODEL_CACHE_SIZE, PREDICT_BATCH_WINDOW_MS, PREDICT_MAX_BATCH
+
+
+class MicroBatcher:
+    # 'predict' is a blocking function mapping a batch of images to a batch of outputs.
+    def __init__(self, predict, window_ms=PREDICT_BATCH_WINDOW_MS, max_batch=PREDICT_MAX_BATCH):
+        self.predict = predict
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.runner = None
+        # A request that didn't fit into the previous batch; it opens the next one.
+        self.carry = None
+
+    # Returns the outputs for 'images' and the size of the batch they were computed in.
+    async def submit(self, images):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((images, future))
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self.run())
+        return await future
+
+    # Collects one batch: the first waiting request, then whatever else arrives within the window,
+    # without going over max_batch images (unless a single request is larger than that by itself).
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        first = self.carry or await self.queue.get()
+        self.carry = None
+        items, size = [first], len(first[0])
+        deadline = loop.time() + self.window
+        while size < self.max_batch:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if size + len(item[0]) > self.max_batch:
+                self.carry = item
+                break
+            items.append(item)
+            size += len(item[0])
+        return items, size
+
+    # Runs batches until no request is left waiting; submit() starts it again when needed, so an idle
+    # (or evicted) model has no task running.
+    async def run(self):
+        while self.carry is not None or not self.queue.empty():
+            items, size = await self._collect()
+            items = [(images, future) for images, future in items if not future.cancelled()]
+            if not items:
+                continue
+            try:
+                outputs = await asyncio.to_thread(self.predict, np.concatenate([images for images, _ in items]))
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            start = 0
+            for images, future in items:
+                if not future.done():
+                    future.set_result((outputs[start:start + len(images)], size))
+                start += len(images)
+
+
+class ModelCache:
+    # 'load' is a blocking function mapping a model id to its predict function, raising
+    # FileNotFoundError for unknown ids.
+    def __init__(self, load, capacity=MODEL_CACHE_SIZE, window_ms=PREDICT_BATCH_WINDOW_MS, max_batch=PREDICT_MAX_BATCH):
+        self.load = load
+        self.capacity = capacity
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.batchers = collections.OrderedDict()
+        self.loading = {}
+        self.loads = 0
+        self.evictions = 0
+
+    # Returns the MicroBatcher of a model, loading the model if needed.
+    async def get(self, model_id):
+        batcher = self.batchers.get(model_id)
+        if batcher is not None:
+            self.batchers.move_to_end(model_id)
+            return batcher
+        if model_id not in self.loading:
+            self.loading[model_id] = asyncio.ensure_future(self._load(model_id))
+        return await asyncio.shield(self.loading[model_id])
+
+    async def _load(self, model_id):
+        try:
+            predict = await asyncio.to_thread(self.load, model_id)
+            batcher = MicroBatcher(predict, self.window_ms, self.max_batch)
+            self.batchers[model_id] = batcher
+            self.loads += 1
+            # Requests already handed to an evicted batcher still complete; it just isn't reused.
+            while len(self.batchers) > self.capacity:
+                self.batchers.popitem(last=False)
+                self.evictions += 1
+            return batcher
+        finally:
+            del self.loading[model_id]
+
+    async def predict(self, model_id, images):
+        return await (await self.get(model_id)).submit(images)
+
+    def status(self):
+        return {"loaded": list(self.batchers), "capacity": self.capacity, "loads": self.loads, "evictions": self.evictions}
@@ -0,0 +1,241 @@
+# META
+
+# Description: Hyperparameter sweeps with asynchronous successive halving (ASHA). Exploring
+# configurations used to mean submitting /train by hand, one full-length run at a time. A sweep takes
+# a search space over the TrainModelRequest fields, samples 'trials' configurations from it and trains
+# each one as an ordinary train_model task, at most 'parallelism' at a time. Trials that are doing
+# poorly are stopped early:
+#   - the rungs are the epochs min_epochs * eta^k below max_epochs (eta is the reduction factor), e.g.
+#     1, 3 and 9 for min_epochs=1, eta=3, max_epochs=27;
+#   - when a trial completes a rung epoch, its validation metric is recorded for that rung and compared
+#     with every other trial that reached the rung so far. Unless it is within the best 1/eta of them it
+#     stops right there, with status STOPPED.
+# The decision is taken inside the trial's own task (SweepCallback), from the per-epoch logs
+# train_model already produces, so no coordinator has to run anywhere. Only about 1/eta of the trials
+# get past each rung, so a sweep trains a fraction of the epochs the same trials would take as full
+# runs. The final summary reports that fraction.
+#
+# The app starts the first 'parallelism' trials and, every time a trial ends, the next pending one (see
+# app.py). Every trial epoch and every finished trial publishes the sweep's leaderboard under the
+# sweep's own id, so WebSocket clients subscribed to it follow the search live. The last trial to
+# finish publishes the sweep's final SUCCESS update.
+#
+# State, in Redis with a TTL of SWEEP_TTL:
+#   sweep:<sweep_id>:meta           JSON settings: client, metric, mode, rungs, max_epochs, total, ...
+#   sweep:<sweep_id>:pending        list of trials (JSON trial_id + config) not started yet
+#   sweep:<sweep_id>:trials         hash of trial_id -> JSON config, status, epoch, best metric
+#   sweep:<sweep_id>:rung:<epoch>   sorted set of trial_id -> metric of the trials that reached the rung
+#   sweep:<sweep_id>:done           number of finished trials
+#   sweep:<sweep_id>:cancelled      set once the sweep was cancelled
+#   sweep:<sweep_id>:next:<trial>   claim taken by the app process that starts the trial after <trial>
+
+import itertools
+import json
+import random
+import uuid
+
+import numpy as np
+import tensorflow as tf
+
+from events import FINAL_STATUSES
+
+PREFIX = "sweep"
+
+SWEEP_TTL = 7 * 24 * 3600
+
+
+def _key(sweep_id, name):
+    return f"{PREFIX}:{sweep_id}:{name}"
+
+
+# Epochs at which trials are compared: min_epochs * eta^k, below max_epochs.
+def rungs(min_epochs, max_epochs, eta):
+    epochs, result = min_epochs, []
+    while epochs < max_epochs:
+        result.append(epochs)
+        epochs *= eta
+    return result
+
+
+# Whether larger values of the metric are better.
+def metric_mode(metric):
+    return "min" if metric.endswith("loss") else "max"
+
+
+# Samples up to num_trials distinct configurations from the search space. 'space' maps layers, units,
+# batchSize and optimizer to their candidate values; every conv layer draws its own width from the units
+# candidates. If the space holds no more than num_trials configurations, all of them are used.
+def sample_trials(space, num_trials, seed=None):
+    def configs_with(layers):
+        return itertools.product([layers], itertools.product(space["units"], repeat=layers), space["batchSize"], space["optimizer"])
+
+    size = sum(len(space["units"]) ** layers for layers in space["layers"]) * len(space["batchSize"]) * len(space["optimizer"])
+    if size <= num_trials:
+        combinations = [c for layers in space["layers"] for c in configs_with(layers)]
+    else:
+        rng = random.Random(seed)
+        combinations = set()
+        while len(combinations) < num_trials:
+            layers = rng.choice(space["layers"])
+            combinations.add((layers, tuple(rng.choice(space["units"]) for _ in range(layers)),
+                              rng.choice(space["batchSize"]), rng.choice(space["optimizer"])))
+        combinations = sorted(combinations)
+    return [{"layers": layers, "units": list(units), "batch_size": batch_size, "optimizer": optimizer}
+            for layers, units, batch_size, optimizer in combinations]
+
+
+# --- App side (asynchronous Redis client) ---
+
+# Stores a new sweep. 'configs' are train_model arguments without epochs; every trial trains for up to
+# max_epochs. Returns the trials as dicts with their pre-generated trial_id (the task id they run as).
+async def create_sweep(redis_client, sweep_id, configs, settings):
+    trials = [{"trial_id": str(uuid.uuid4()), "config": config} for config in configs]
+    meta = {**settings, "sweep_id": sweep_id, "total": len(trials),
+            "rungs": rungs(settings["min_epochs"], settings["max_epochs"], settings["eta"]),
+            "mode": metric_mode(settings["metric"])}
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(_key(sweep_id, "meta"), json.dumps(meta), ex=SWEEP_TTL)
+        pipe.hset(_key(sweep_id, "trials"), mapping={
+            trial["trial_id"]: json.dumps({"config": trial["config"], "status": "PENDING", "epoch": 0, "best": None})
+            for trial in trials
+        })
+        pipe.expire(_key(sweep_id, "trials"), SWEEP_TTL)
+        pipe.rpush(_key(sweep_id, "pending"), *[json.dumps(trial) for trial in trials])
+        pipe.expire(_key(sweep_id, "pending"), SWEEP_TTL)
+        await pipe.execute()
+    return meta, trials
+
+
+async def get_meta(redis_client, sweep_id):
+    data = await redis_client.get(_key(sweep_id, "meta"))
+    return json.loads(data) if data is not None else None
+
+
+# Takes the next pending trial, or None when there is none left or the sweep was cancelled.
+async def pop_pending(redis_client, sweep_id):
+    if await redis_client.exists(_key(sweep_id, "cancelled")):
+        return None
+    data = await redis_client.lpop(_key(sweep_id, "pending"))
+    return json.loads(data) if data is not None else None
+
+
+# Returns the next pending trial to start once 'finished_trial_id' ended, or None. Every app process
+# sees the trial's final update; only the first one to claim it starts the next trial.
+async def next_trial(redis_client, sweep_id, finished_trial_id):
+    if not await redis_client.set(_key(sweep_id, f"next:{finished_trial_id}"), 1, nx=True, ex=SWEEP_TTL):
+        return None
+    return await pop_pending(redis_client, sweep_id)
+
+
+# Cancels a sweep: no further trials start. Returns the ids of trials that may be queued or running,
+# for the caller to cancel.
+async def cancel_sweep(redis_client, sweep_id):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(_key(sweep_id, "cancelled"), 1, ex=SWEEP_TTL)
+        pipe.delete(_key(sweep_id, "pending"))
+        pipe.hgetall(_key(sweep_id, "trials"))
+        _, _, trials = await pipe.execute()
+    return [trial_id.decode() for trial_id, data in trials.items()
+            if json.loads(data)["status"] not in FINAL_STATUSES + ("PENDING",)]
+
+
+async def mark_queued(redis_client, sweep_id, trial_id):
+    await _update_trial_async(redis_client, sweep_id, trial_id, status="QUEUED")
+
+
+async def _update_trial_async(redis_client, sweep_id, trial_id, **fields):
+    data = await redis_client.hget(_key(sweep_id, "trials"), trial_id)
+    if data is not None:
+        await redis_client.hset(_key(sweep_id, "trials"), trial_id, json.dumps({**json.loads(data), **fields}))
+
+
+# --- Worker side (synchronous Redis client) ---
+
+def load_meta(redis_client, sweep_id):
+    return json.loads(redis_client.get(_key(sweep_id, "meta")))
+
+
+def _update_trial(redis_client, sweep_id, trial_id, **fields):
+    data = redis_client.hget(_key(sweep_id, "trials"), trial_id)
+    trial = {**json.loads(data), **fields} if data is not None else fields
+    redis_client.hset(_key(sweep_id, "trials"), trial_id, json.dumps(trial))
+    return trial
+
+
+# The sweep's trials, best first (ties go to the trial that trained longer), as they stand now.
+def leaderboard(redis_client, sweep_id, mode):
+    trials = [{"trial_id": trial_id.decode(), **json.loads(data)} for trial_id, data in redis_client.hgetall(_key(sweep_id, "trials")).items()]
+    sign = -1 if mode == "max" else 1
+    return sorted(trials, key=lambda t: (t["best"] is None, sign * (t["best"] or 0), -t["epoch"], t["trial_id"]))
+
+
+def publish_leaderboard(redis_client, publish, meta, status="LEADERBOARD", **extra):
+    sweep_id = meta["sweep_id"]
+    done = int(redis_client.get(_key(sweep_id, "done")) or 0)
+    publish(sweep_id, {'status': status, 'metric': meta["metric"], 'completed': done, 'total': meta["total"],
+                       'leaderboard': leaderboard(redis_client, sweep_id, meta["mode"]), **extra})
+
+
+# Records a trial's end and publishes the leaderboard. The trial that completes the sweep publishes the
+# sweep's final update, with the best trial and the share of full-length training epochs the sweep
+# actually needed. 'epoch' is the number of epochs the trial completed, None to keep the last recorded.
+def trial_finished(redis_client, publish, sweep_id, trial_id, status, epoch=None):
+    meta = load_meta(redis_client, sweep_id)
+    fields = {"status": status} if epoch is None else {"status": status, "epoch": epoch}
+    _update_trial(redis_client, sweep_id, trial_id, **fields)
+    done = redis_client.incr(_key(sweep_id, "done"))
+    redis_client.expire(_key(sweep_id, "done"), SWEEP_TTL)
+    if done < meta["total"] or redis_client.exists(_key(sweep_id, "cancelled")):
+        publish_leaderboard(redis_client, publish, meta)
+        return
+    board = leaderboard(redis_client, sweep_id, meta["mode"])
+    epochs_trained = sum(trial["epoch"] for trial in board)
+    full_epochs = meta["total"] * meta["max_epochs"]
+    publish_leaderboard(redis_client, publish, meta, status="SUCCESS", best=board[0] if board else None,
+                        epochs_trained=epochs_trained, full_epochs=full_epochs,
+                        compute_fraction=epochs_trained / full_epochs if full_epochs else None)
+
+
+# Keras callback of a sweep trial: keeps the trial's leaderboard entry up to date and stops the trial
+# at a rung epoch unless it's within the best 1/eta of the trials that reached that rung. Uses the
+# same cutoff as asynchronous successive halving: the (1 - 1/eta) quantile of the recorded metrics.
+# 'publish' is the worker's publish_update; 'abort_callback' the task's AbortCallback, whose cut-short
+# epochs are ignored.
+class SweepCallback(tf.keras.callbacks.Callback):
+    def __init__(self, redis_client, publish, sweep_id, trial_id, abort_callback=None):
+        super().__init__()
+        self.redis = redis_client
+        self.publish = publish
+        self.meta = load_meta(redis_client, sweep_id)
+        self.trial_id = trial_id
+        self.abort_callback = abort_callback
+        self.stopped = False
+        self.best = None
+
+    def on_train_begin(self, logs=None):
+        _update_trial(self.redis, self.meta["sweep_id"], self.trial_id, status="RUNNING")
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.abort_callback is not None and self.abort_callback.aborted:
+            return
+        value = (logs or {}).get(self.meta["metric"])
+        if value is None:
+            return
+        value = float(value)
+        better = max if self.meta["mode"] == "max" else min
+        self.best = value if self.best is None else better(self.best, value)
+        sweep_id, epochs = self.meta["sweep_id"], epoch + 1
+        _update_trial(self.redis, sweep_id, self.trial_id, epoch=epochs, best=self.best, last=value)
+        if epochs in self.meta["rungs"]:
+            rung = _key(sweep_id, f"rung:{epochs}")
+            self.redis.zadd(rung, {self.trial_id: value})
+            self.redis.expire(rung, SWEEP_TTL)
+            recorded = [score for _, score in self.redis.zrange(rung, 0, -1, withscores=True)]
+            quantile = 1 - 1 / self.meta["eta"] if self.meta["mode"] == "max" else 1 / self.meta["eta"]
+            cutoff = float(np.quantile(recorded, quantile))
+            if (value < cutoff) if self.meta["mode"] == "max" else (value > cutoff):
+                print(f"Sweep {sweep_id}: stopping trial {self.trial_id} at epoch {epochs} ({self.meta['metric']}={value:.4f}, cutoff {cutoff:.4f})")
+                self.stopped = True
+                self.model.stop_training = True
+        if not self.stopped:
+            publish_leaderboard(self.redis, self.publish, self.meta)
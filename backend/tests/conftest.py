@@ -0,0 +1,13 @@
+# META
+
+# Description: Shared setup for the backend's tests. The backend modules import each other as
+# top-level modules (they run from the backend directory), so that directory goes on sys.path here.
+# Tests that need Redis use fakeredis; nothing here needs a running Redis, Celery worker or dataset.
+#
+# Usage (from the backend directory):
+#   python -m pytest -q tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
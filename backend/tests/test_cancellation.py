@@ -0,0 +1,128 @@
+# Tests for cooperative cancellation (see cancellation.py): a task counts as aborted whether /cancel's
+# revoke or its abort reached the result backend last, AbortCallback stops training and evaluation
+# once it does, and /cancel ends a /train/batch task that never started along with its sub-tasks
+# (against fakeredis, with apply_async() stubbed).
+
+import asyncio
+import types
+
+import fakeredis
+import numpy as np
+import pytest
+from celery import Celery, states
+from celery.contrib.abortable import ABORTED
+
+import app
+from cancellation import AbortCallback, CancellableTask
+from events import read_events
+from models import BatchTrainModelRequest, CancelTaskRequest
+from result_cache import ResultCache
+from scheduling import Scheduler
+from worker import build_model
+
+
+@pytest.fixture
+def task():
+    app = Celery(broker="memory://", backend="cache+memory://")
+
+    @app.task(bind=True, base=CancellableTask)
+    def train(self):
+        pass
+
+    return train
+
+
+@pytest.mark.parametrize("state,aborted", [
+    (ABORTED, True),
+    (states.REVOKED, True),
+    (states.STARTED, False),
+    (states.PENDING, False),
+])
+def test_is_aborted_for_aborted_and_revoked_tasks(task, state, aborted):
+    task.backend.store_result("t1", None, state)
+    assert task.is_aborted(task_id="t1") is aborted
+
+
+# Stands in for the bound task: reports an abort from the 'after'-th check on.
+class AbortAfter:
+    def __init__(self, after):
+        self.after = after
+        self.checks = 0
+
+    def is_aborted(self):
+        self.checks += 1
+        return self.checks >= self.after
+
+
+def compiled_model():
+    model = build_model(1, [4])
+    model.compile(optimizer="adam", loss="sparse_categorical_crossentropy")
+    return model
+
+
+def data(samples=64):
+    rng = np.random.default_rng(0)
+    return rng.random((samples, 32, 32, 3), dtype=np.float32), rng.integers(0, 10, samples)
+
+
+def test_abort_callback_stops_training_at_the_next_check():
+    x, y = data()
+    callback = AbortCallback(AbortAfter(3), every=2)
+    history = compiled_model().fit(x, y, batch_size=8, epochs=5, callbacks=[callback], verbose=0)
+    # Checked after batches 2, 4 and 6; the third check aborts during the first epoch.
+    assert callback.aborted
+    assert callback.batches == 6
+    assert len(history.history["loss"]) == 1
+    assert "loss" in callback.last_logs
+
+
+def test_abort_callback_stops_evaluation():
+    x, y = data()
+    model = compiled_model()
+    callback = AbortCallback(AbortAfter(2), every=1)
+    model.evaluate(x, y, batch_size=8, callbacks=[callback], verbose=0)
+    assert callback.aborted
+    assert callback.batches == 2
+    assert model.stop_evaluating
+
+
+def test_abort_callback_without_an_abort_runs_to_the_end():
+    x, y = data()
+    callback = AbortCallback(types.SimpleNamespace(is_aborted=lambda: False), every=1)
+    history = compiled_model().fit(x, y, batch_size=8, epochs=2, callbacks=[callback], verbose=0)
+    assert not callback.aborted
+    assert len(history.history["loss"]) == 2
+
+
+@pytest.fixture
+def app_redis(monkeypatch):
+    redis_client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(app, "redis_client", redis_client)
+    monkeypatch.setattr(app, "result_cache", ResultCache(redis_client))
+    monkeypatch.setattr(app, "scheduler", Scheduler(redis_client, lambda task_id: False))
+    monkeypatch.setattr(app, "train_model_batch", types.SimpleNamespace(apply_async=lambda **kwargs: None))
+    monkeypatch.setattr(app, "AbortableAsyncResult", lambda task_id: types.SimpleNamespace(revoke=lambda: None, abort=lambda: None))
+    return redis_client
+
+
+def test_cancelling_a_queued_batch_cancels_its_sub_tasks(app_redis):
+    config = {"layers": 1, "units": [8], "epochs": 1, "batchSize": 32, "optimizer": "adam"}
+    payload = BatchTrainModelRequest(configs=[config, config])
+    request = types.SimpleNamespace(headers={"x-client-id": "c1"}, client=None)
+
+    async def train_and_cancel():
+        batch = await app.train_model_batch_request(payload, request)
+        for sub_task_id in batch["sub_task_ids"]:
+            await app.result_cache.claim(sub_task_id, sub_task_id)
+        await app.cancel_task(CancelTaskRequest(task_id=batch["task_id"]))
+        events = {task_id: await read_events(app_redis, task_id) for task_id in [batch["task_id"], *batch["sub_task_ids"]]}
+        claims = [await app.result_cache.claim(sub_task_id, "next") for sub_task_id in batch["sub_task_ids"]]
+        return batch, events, claims
+
+    batch, events, claims = asyncio.run(train_and_cancel())
+    assert [event["status"] for event in events.pop(batch["task_id"])] == ["CANCELLED"]
+    assert set(events) == set(batch["sub_task_ids"])
+    for sub_task_events in events.values():
+        assert [(event["status"], event["batch_id"]) for event in sub_task_events] == [("CANCELLED", batch["task_id"])]
+    # The sub-tasks' claims were released, so the next identical request gets to claim them.
+    assert claims == [None, None]
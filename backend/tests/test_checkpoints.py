@@ -0,0 +1,140 @@
+# Tests for checkpointing and resuming (see checkpoints.py): a checkpoint written during training puts
+# a fresh model back into the same state, and /resume refuses tasks without a checkpoint as well as
+# tasks that are still queued or running or already being resumed. /resume runs against fakeredis with
+# the Celery task states and apply_async() stubbed.
+
+import asyncio
+import types
+import uuid
+
+import fakeredis
+import numpy as np
+import pytest
+from celery import states
+from fastapi import HTTPException
+
+import app
+import checkpoints
+from checkpoints import CheckpointCallback, CheckpointWriter, load_checkpoint, read_checkpoint_meta, restore_model
+from models import ResumeTaskRequest
+from scheduling import Scheduler
+from worker import build_model
+
+CONFIG = {"layers": 1, "units": [8], "epochs": 2, "batch_size": 16, "optimizer": "adam"}
+
+
+@pytest.fixture(autouse=True)
+def artifact_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoints, "ARTIFACT_DIR", str(tmp_path))
+
+
+def compiled_model():
+    model = build_model(CONFIG["layers"], CONFIG["units"])
+    model.compile(optimizer=CONFIG["optimizer"], loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def test_restore_model_from_a_checkpoint_written_during_training():
+    rng = np.random.default_rng(0)
+    x = rng.random((32, 32, 32, 3), dtype=np.float32)
+    y = rng.integers(0, 10, 32)
+    model = compiled_model()
+    writer = CheckpointWriter("t1")
+    history = [{"loss": 2.3}, {"loss": 2.2}]
+    callback = CheckpointCallback(writer, {"task_id": "t1", "config": CONFIG, "dataset": "v1"}, history, every=1)
+    model.fit(x, y, batch_size=CONFIG["batch_size"], epochs=CONFIG["epochs"], callbacks=[callback], verbose=0)
+    writer.close()
+    assert writer.error is None
+
+    meta, weights, optimizer_variables = load_checkpoint("t1")
+    assert meta["epoch"] == 2
+    assert meta["config"] == CONFIG
+    assert meta["history"] == history
+    assert read_checkpoint_meta("t1") == meta
+
+    restored = compiled_model()
+    restore_model(restored, weights, optimizer_variables)
+    for expected, actual in zip(model.get_weights(), restored.get_weights()):
+        np.testing.assert_array_equal(expected, actual)
+    # Two epochs of two batches each.
+    assert int(restored.optimizer.iterations.numpy()) == 4
+    for expected, actual in zip(model.optimizer.variables, restored.optimizer.variables):
+        np.testing.assert_array_equal(expected.numpy(), actual.numpy())
+
+
+def test_read_checkpoint_meta_without_a_checkpoint():
+    assert read_checkpoint_meta("missing") is None
+
+
+def test_resume_without_a_checkpoint_is_a_404():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(app.resume_task(ResumeTaskRequest(task_id=str(uuid.uuid4())), request=None))
+    assert error.value.status_code == 404
+
+
+# Stands in for Celery: 'states' maps task ids to their state, tasks sent with apply_async() start out
+# PENDING.
+class FakeCelery:
+    def __init__(self):
+        self.states = {}
+
+    def apply_async(self, kwargs, task_id, queue):
+        self.states[task_id] = states.PENDING
+
+    def AsyncResult(self, task_id):
+        return types.SimpleNamespace(state=self.states.get(task_id, states.PENDING))
+
+
+@pytest.fixture
+def celery(monkeypatch):
+    fake = FakeCelery()
+    redis_client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(app, "redis_client", redis_client)
+    monkeypatch.setattr(app, "scheduler", Scheduler(redis_client, lambda task_id: False))
+    monkeypatch.setattr(app, "AsyncResult", fake.AsyncResult)
+    monkeypatch.setattr(app, "train_model", fake)
+    monkeypatch.setattr(app, "read_checkpoint_meta", lambda task_id: {"task_id": task_id, "config": CONFIG, "epoch": 1})
+    return fake
+
+
+def resume(task_id, client="c1"):
+    request = types.SimpleNamespace(headers={"x-client-id": client}, client=None)
+    return app.resume_task(ResumeTaskRequest(task_id=task_id), request=request)
+
+
+def resume_status(task_id):
+    try:
+        asyncio.run(resume(task_id))
+    except HTTPException as error:
+        return error.status_code
+    return 200
+
+
+def test_resume_refuses_a_task_that_is_still_queued_or_running(celery):
+    original = str(uuid.uuid4())
+    asyncio.run(app.submit_task(celery, {}, original, 1.0, "c1"))
+    for state in (states.PENDING, states.STARTED):
+        celery.states[original] = state
+        assert resume_status(original) == 409
+
+    celery.states[original] = states.FAILURE
+    assert resume_status(original) == 200
+
+
+def test_resume_refuses_a_second_resume_of_the_same_checkpoint(celery):
+    original = str(uuid.uuid4())
+    first = asyncio.run(resume(original))
+    assert first["resumed_from"] == original and first["epoch"] == 1
+
+    async def resume_twice():
+        return await asyncio.gather(resume(original, "c2"), resume(original, "c3"), return_exceptions=True)
+
+    # Refused as long as the first resume is queued or running, and however many arrive at once.
+    assert [error.status_code for error in asyncio.run(resume_twice())] == [409, 409]
+    celery.states[first["task_id"]] = states.STARTED
+    assert resume_status(original) == 409
+
+    # Once it ended, the checkpoint can be resumed again.
+    celery.states[first["task_id"]] = states.REVOKED
+    asyncio.run(app.scheduler.finish(first["task_id"]))
+    assert resume_status(original) == 200
@@ -0,0 +1,117 @@
+# Tests for the WebSocket fan-out (see connections.py): per-client queues with drop-oldest and
+# coalescing, routing updates to subscribers, and holding live updates back during a replay.
+
+import asyncio
+
+from connections import Client, ConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+
+# Takes the client's queued messages in delivery order, the way its sender task would.
+def drain(client):
+    messages = []
+    while not client.queue.empty():
+        coalesce_key, entry = client.queue.get_nowait()
+        message, _ = client.pending.pop(coalesce_key) if coalesce_key is not None else entry
+        messages.append(message)
+    return messages
+
+
+def test_full_queue_drops_the_oldest_message():
+    client = Client(FakeWebSocket(), max_queue=3)
+    for i in range(5):
+        client.enqueue(f"m{i}")
+    assert drain(client) == ["m2", "m3", "m4"]
+    assert client.dropped == 2
+
+
+def test_coalesced_messages_replace_the_pending_one_in_place():
+    client = Client(FakeWebSocket(), max_queue=10)
+    client.enqueue("batch 1", ("BATCH", "t1"))
+    client.enqueue("epoch 1")
+    client.enqueue("batch 2", ("BATCH", "t1"))
+    client.enqueue("other task", ("BATCH", "t2"))
+    client.enqueue("batch 3", ("BATCH", "t1"))
+    assert drain(client) == ["batch 3", "epoch 1", "other task"]
+    # Once delivered, the next message with that key is queued anew.
+    client.enqueue("batch 4", ("BATCH", "t1"))
+    assert drain(client) == ["batch 4"]
+
+
+def test_dropping_a_coalesced_message_forgets_its_key():
+    client = Client(FakeWebSocket(), max_queue=2)
+    client.enqueue("batch 1", ("BATCH", "t1"))
+    client.enqueue("epoch 1")
+    client.enqueue("SUCCESS")
+    assert client.pending == {}
+    client.enqueue("batch 2", ("BATCH", "t1"))
+    assert drain(client) == ["SUCCESS", "batch 2"]
+
+
+def test_publish_reaches_subscribers_and_unsubscribed_clients():
+    async def run():
+        manager = ConnectionManager(max_queue=10)
+        sockets = [FakeWebSocket() for _ in range(3)]
+        first, second, _ = [manager.connect(websocket) for websocket in sockets]
+        manager.subscribe(first, "t1")
+        manager.subscribe(second, "t2")
+        manager.publish("t1", "for t1")
+        manager.publish("t2", "for t2")
+        await asyncio.sleep(0)
+        sent = [websocket.sent for websocket in sockets]
+        for client in list(manager.clients):
+            manager.disconnect(client)
+        return sent
+    assert asyncio.run(run()) == [["for t1"], ["for t2"], ["for t1", "for t2"]]
+
+
+def test_replay_holds_back_live_updates_and_skips_replayed_ones():
+    client = Client(FakeWebSocket(), max_queue=10)
+    client.begin_replay("t1")
+    client.deliver("t1", "epoch 1", event_id="100-0")
+    client.deliver("t1", "batch", ("BATCH", "t1"))
+    client.deliver("t1", "epoch 2", event_id="100-1")
+    client.deliver("t2", "other task", event_id="50-0")
+    assert drain(client) == ["other task"]
+    # The replay itself sent everything up to 100-0, so only what came after is delivered now.
+    client.end_replay("t1", last_event_id="100-0")
+    assert drain(client) == ["batch", "epoch 2"]
+    client.deliver("t1", "epoch 3", event_id="100-2")
+    assert drain(client) == ["epoch 3"]
+
+
+def test_empty_replay_delivers_everything_held_back():
+    client = Client(FakeWebSocket(), max_queue=10)
+    client.begin_replay("t1")
+    client.deliver("t1", "epoch 1", event_id="100-0")
+    client.deliver("t1", "epoch 2", event_id="100-1")
+    client.end_replay("t1")
+    assert drain(client) == ["epoch 1", "epoch 2"]
+
+
+# An event logged before the replay read the stream but published only after the replay ended was
+# already part of the replay.
+def test_events_published_after_the_replay_ended_are_not_sent_twice():
+    manager = ConnectionManager(max_queue=10)
+    client = Client(FakeWebSocket(), max_queue=10)
+    manager.clients.add(client)
+    manager.subscribe(client, "t1")
+    client.begin_replay("t1")
+    client.end_replay("t1", last_event_id="100-1")
+    manager.publish("t1", "epoch 1", event_id="100-0")
+    manager.publish("t1", "epoch 2", event_id="100-1")
+    manager.publish("t1", "batch", ("BATCH", "t1"))
+    manager.publish("t1", "epoch 3", event_id="100-2")
+    assert drain(client) == ["batch", "epoch 3"]
+    # Once unsubscribed, a later subscription without a replay gets every update again.
+    manager.unsubscribe(client, "t1")
+    manager.subscribe(client, "t1")
+    manager.publish("t1", "epoch 2 again", event_id="100-1")
+    assert drain(client) == ["epoch 2 again"]
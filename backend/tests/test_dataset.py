@@ -0,0 +1,87 @@
+# Tests for the preprocessed dataset store (see dataset.py): the cache is built once however many
+# callers ask for it at the same time, a failed build leaves nothing behind, and load_dataset() maps
+# the arrays read-only. _build is replaced by a stub writing small arrays, so CIFAR-10 isn't needed.
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import dataset
+from dataset import ARRAY_NAMES, ensure_dataset, load_dataset
+
+SHAPES = {"x_train": (8, 32, 32, 3), "y_train": (8, 1), "x_val": (2, 32, 32, 3), "y_val": (2, 1),
+          "x_test": (4, 32, 32, 3), "y_test": (4, 1), "mean": (3,)}
+
+
+class StubBuild:
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+
+    def __call__(self, target_dir):
+        self.calls += 1
+        # Long enough for concurrent callers to pile up behind the lock.
+        time.sleep(0.05)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(target_dir, f"{name}.npy"), np.zeros(SHAPES[name], dtype=np.float32))
+        if self.fail:
+            raise OSError("disk full")
+        with open(os.path.join(target_dir, "meta.json"), "w") as f:
+            json.dump({"version": dataset.DATASET_VERSION}, f)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, "DATASET_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(dataset, "_dataset", None)
+    return tmp_path
+
+
+def leftovers(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if not name.endswith(".lock"))
+
+
+def test_concurrent_callers_build_the_cache_once(cache_dir, monkeypatch):
+    build = StubBuild()
+    monkeypatch.setattr(dataset, "_build", build)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(ensure_dataset())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.append(ensure_dataset())
+
+    assert build.calls == 1
+    assert set(results) == {dataset.dataset_dir()}
+    assert leftovers(cache_dir) == [dataset.DATASET_VERSION]
+
+
+def test_failed_build_leaves_no_partial_cache(cache_dir, monkeypatch):
+    monkeypatch.setattr(dataset, "_build", StubBuild(fail=True))
+    with pytest.raises(OSError):
+        ensure_dataset()
+    assert leftovers(cache_dir) == []
+
+    build = StubBuild()
+    monkeypatch.setattr(dataset, "_build", build)
+    ensure_dataset()
+    assert build.calls == 1
+
+
+def test_load_dataset_maps_the_arrays_read_only_once(cache_dir, monkeypatch):
+    monkeypatch.setattr(dataset, "_build", StubBuild())
+    loaded = load_dataset()
+
+    assert loaded.version == dataset.DATASET_VERSION
+    for name in ARRAY_NAMES:
+        array = getattr(loaded, name)
+        assert isinstance(array, np.memmap)
+        assert array.shape == SHAPES[name]
+        assert not array.flags.writeable
+    assert load_dataset() is loaded
@@ -0,0 +1,113 @@
+# Tests for the rendezvous of distributed training groups (see distributed.py): the coordinator
+# reserving ranks, the other ranks waiting for the cluster spec, and a rank's subprocess aborting the
+# group when it fails, against fakeredis.
+
+import threading
+
+import fakeredis
+import pytest
+
+import distributed
+from distributed import abort, exit_codes, is_aborted, register, reserve, run_rank, wait_for_cluster
+
+SPEC = {"layers": 1, "units": [8], "epochs": 1, "batch_size": 32, "optimizer": "adam"}
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(distributed, "POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(distributed, "DISTRIBUTED_HOST", "127.0.0.1")
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis()
+
+
+def test_reserve_waits_for_every_rank_and_publishes_the_cluster(redis_client):
+    results = {}
+
+    def participant(rank):
+        results[rank] = (register(redis_client, "g1", rank), wait_for_cluster(redis_client, "g1", timeout=5))
+
+    threads = [threading.Thread(target=participant, args=(rank,)) for rank in (2, 1)]
+    for thread in threads:
+        thread.start()
+    cluster = reserve(redis_client, "g1", 3, SPEC, lambda: False, timeout=5)
+    for thread in threads:
+        thread.join()
+
+    assert len(cluster) == 3
+    assert cluster[1:] == [results[1][0], results[2][0]]
+    assert all(address.startswith("127.0.0.1:") for address in cluster)
+    assert results[1][1] == results[2][1] == (cluster, SPEC)
+    assert not is_aborted(redis_client, "g1")
+
+
+def test_reserve_times_out_when_a_rank_never_registers(redis_client):
+    register(redis_client, "g1", 1)
+    assert reserve(redis_client, "g1", 3, SPEC, lambda: False, timeout=0.05) is None
+    assert is_aborted(redis_client, "g1")
+    # The rank that did register gives up instead of waiting for a cluster that won't come.
+    assert wait_for_cluster(redis_client, "g1", timeout=5) is None
+
+
+def test_reserve_stops_when_the_coordinator_is_cancelled(redis_client):
+    checks = []
+
+    def task_aborted():
+        checks.append(True)
+        return len(checks) >= 3
+
+    assert reserve(redis_client, "g1", 2, SPEC, task_aborted, timeout=5) is None
+    assert len(checks) == 3
+    assert is_aborted(redis_client, "g1")
+
+
+def test_wait_for_cluster_times_out_without_a_cluster(redis_client):
+    register(redis_client, "g1", 1)
+    assert wait_for_cluster(redis_client, "g1", timeout=0.05) is None
+
+
+def test_wait_for_cluster_returns_when_the_group_is_aborted(redis_client):
+    abort(redis_client, "g1")
+    assert wait_for_cluster(redis_client, "g1", timeout=5) is None
+
+
+# Stands in for a rank's training subprocess, exiting with 'returncode' after 'polls' polls.
+class FakeProcess:
+    def __init__(self, returncode, polls=2):
+        self.returncode = None
+        self.exit_code = returncode
+        self.polls = polls
+        self.terminated = False
+
+    def poll(self):
+        self.polls -= 1
+        if self.polls <= 0 and not self.terminated:
+            self.returncode = self.exit_code
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+        self.returncode = -15
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+@pytest.mark.parametrize("returncode,aborted", [(0, False), (1, True)])
+def test_run_rank_records_the_exit_code_and_aborts_on_failure(redis_client, monkeypatch, returncode, aborted):
+    monkeypatch.setattr(distributed.subprocess, "Popen", lambda *args, **kwargs: FakeProcess(returncode))
+    assert run_rank(redis_client, "g1", 1, ["a:1", "b:2"], SPEC) == returncode
+    assert exit_codes(redis_client, "g1") == {1: returncode}
+    assert is_aborted(redis_client, "g1") is aborted
+
+
+def test_run_rank_terminates_its_subprocess_when_the_group_is_aborted(redis_client, monkeypatch):
+    process = FakeProcess(0, polls=1000)
+    monkeypatch.setattr(distributed.subprocess, "Popen", lambda *args, **kwargs: process)
+    abort(redis_client, "g1")
+    assert run_rank(redis_client, "g1", 1, ["a:1", "b:2"], SPEC) is None
+    assert process.terminated
+    assert exit_codes(redis_client, "g1") == {}
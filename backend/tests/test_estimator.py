@@ -0,0 +1,23 @@
+# Tests that the analytic model profile (see estimator.py) matches the models worker.py builds.
+
+import pytest
+
+from estimator import model_profile
+from worker import build_model
+
+CONFIGS = [
+    (1, [1]),
+    (1, [32]),
+    (2, [32, 64]),
+    (2, [64, 16]),
+    (3, [16, 32, 64]),
+    (3, [128, 64, 8]),
+]
+
+
+@pytest.mark.parametrize("layers,units", CONFIGS)
+def test_model_profile_params_match_keras(layers, units):
+    params, flops, activations = model_profile(layers, units)
+    assert params == build_model(layers, units).count_params()
+    assert flops > 0 and activations > 0
+
@@ -0,0 +1,33 @@
+# Tests for the per-task event streams (see events.py): which offsets a client may replay from, and
+# replaying after an offset, against fakeredis.
+
+import asyncio
+
+import fakeredis
+import pytest
+
+from events import append_event, is_event_id, read_events
+
+
+@pytest.mark.parametrize("offset", ["0", "-", "1700000000000", "1700000000000-3"])
+def test_is_event_id_accepts_stream_ids(offset):
+    assert is_event_id(offset)
+
+
+@pytest.mark.parametrize("offset", ["notanid", "", "1-", "-1", "1-2-3", "(1-0", "+", None, 5])
+def test_is_event_id_rejects_anything_else(offset):
+    assert not is_event_id(offset)
+
+
+def test_read_events_replays_after_the_offset():
+    server = fakeredis.FakeServer()
+    sync_client = fakeredis.FakeRedis(server=server)
+    event_ids = [append_event(sync_client, "t1", {"task_id": "t1", "epoch": epoch}) for epoch in range(3)]
+
+    client = fakeredis.FakeAsyncRedis(server=server)
+    everything = asyncio.run(read_events(client, "t1", "0"))
+    after_first = asyncio.run(read_events(client, "t1", event_ids[0]))
+
+    assert [event["epoch"] for event in everything] == [0, 1, 2]
+    assert [event["event_id"] for event in everything] == event_ids
+    assert [event["epoch"] for event in after_first] == [1, 2]
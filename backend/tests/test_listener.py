@@ -0,0 +1,88 @@
+# Tests for the Redis listener (see listener.py): an update its handler fails on is skipped without a
+# reconnect, while a Redis error makes it resubscribe, against fakeredis.
+
+import asyncio
+import json
+
+import fakeredis
+import pytest
+import redis
+
+import listener
+from listener import RedisListener
+
+
+@pytest.fixture(autouse=True)
+def short_backoff(monkeypatch):
+    monkeypatch.setattr(listener, "LISTENER_BACKOFF_INITIAL", 0.01)
+
+
+async def wait_for(condition, timeout=2):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_handler_errors_skip_the_update_without_reconnecting():
+    received = []
+
+    # Like app.handle_update(), expects every update to be a dict.
+    def on_message(update):
+        received.append(update.get('task_id'))
+
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        redis_listener = RedisListener(client, ['model_updates:*'], on_message)
+        task = asyncio.create_task(redis_listener.run())
+        await wait_for(lambda: redis_listener.connected)
+        for payload in (5, "not json", {'task_id': "t1"}):
+            await client.publish('model_updates:t1', payload if isinstance(payload, str) else json.dumps(payload))
+        await wait_for(lambda: received)
+        task.cancel()
+        return redis_listener
+
+    redis_listener = asyncio.run(run())
+    assert received == ["t1"]
+    assert redis_listener.reconnects == 0
+    assert redis_listener.last_error is None
+
+
+class BrokenPubSub:
+    async def psubscribe(self, *patterns):
+        raise redis.ConnectionError("Connection refused")
+
+    async def aclose(self):
+        pass
+
+
+# Refuses the first 'failures' subscriptions, then hands out real fakeredis ones.
+class FlakyRedis:
+    def __init__(self, failures):
+        self.client = fakeredis.FakeAsyncRedis()
+        self.failures = failures
+
+    def pubsub(self, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            return BrokenPubSub()
+        return self.client.pubsub(**kwargs)
+
+
+def test_redis_errors_resubscribe_with_backoff():
+    received = []
+
+    async def run():
+        client = FlakyRedis(failures=2)
+        redis_listener = RedisListener(client, ['model_updates:*'], received.append)
+        task = asyncio.create_task(redis_listener.run())
+        await wait_for(lambda: redis_listener.connected)
+        await client.client.publish('model_updates:t1', json.dumps({'task_id': "t1"}))
+        await wait_for(lambda: received)
+        task.cancel()
+        return redis_listener
+
+    redis_listener = asyncio.run(run())
+    assert received == [{'task_id': "t1"}]
+    assert redis_listener.reconnects == 2
+    assert redis_listener.last_error == "Connection refused"
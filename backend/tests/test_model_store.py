@@ -0,0 +1,51 @@
+# Tests for the trained model store (see model_store.py): a stored model, in either format, predicts
+# what the trained model does on normalized inputs, and keeps its metadata.
+
+import os
+
+import numpy as np
+import pytest
+
+import model_store
+from model_store import FORMATS, load_model, read_model_meta, save_model
+from worker import build_model
+
+# Dynamic-range quantization stores the weights in 8 bits, so TFLite outputs only come close.
+TOLERANCE = {"savedmodel": 1e-5, "tflite": 0.05}
+
+
+@pytest.fixture(autouse=True)
+def artifact_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_store, "ARTIFACT_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("model_format", FORMATS)
+def test_save_and_load_round_trip(model_format, artifact_dir):
+    rng = np.random.default_rng(0)
+    model = build_model(1, [8])
+    mean = rng.random((32, 32, 3), dtype=np.float32) * 0.5
+    pixels = rng.integers(0, 256, (4, 32, 32, 3)).astype(np.float32)
+    config = {"layers": 1, "units": [8], "epochs": 1, "batch_size": 32, "optimizer": "adam"}
+
+    meta = save_model("t1", model, mean, {"config": config, "test_accuracy": 0.5}, model_format=model_format)
+    probabilities = load_model("t1")(pixels)
+
+    expected = model(pixels / 255 - mean, training=False).numpy()
+    np.testing.assert_allclose(probabilities, expected, atol=TOLERANCE[model_format])
+    assert read_model_meta("t1") == meta
+    assert meta["format"] == model_format and meta["config"] == config and meta["test_accuracy"] == 0.5
+    assert meta["size_bytes"] > 0
+    # Only the finished model directory is left, no temporary one.
+    assert os.listdir(artifact_dir / "models") == ["t1"]
+
+
+def test_load_model_without_a_stored_model():
+    assert read_model_meta("missing") is None
+    with pytest.raises(FileNotFoundError):
+        load_model("missing")
+
+
+def test_save_model_rejects_unknown_formats():
+    with pytest.raises(ValueError):
+        save_model("t1", build_model(1, [8]), np.zeros((32, 32, 3), dtype=np.float32), {}, model_format="onnx")
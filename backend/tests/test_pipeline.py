@@ -0,0 +1,60 @@
+# Tests for the tf.data input pipelines (see pipeline.py): batched augmentation and batches gathered
+# from the dataset arrays.
+
+import numpy as np
+import tensorflow as tf
+
+from metrics import WORKER_REGISTRY
+from pipeline import augment_batch, build_eval_dataset, build_train_dataset
+
+
+def random_images(batch=16, size=32):
+    return np.random.default_rng(0).random((batch, size, size, 3), dtype=np.float32)
+
+
+def test_augment_batch_keeps_shape_dtype_and_value_range():
+    images = random_images()
+    augmented = augment_batch(tf.constant(images)).numpy()
+    assert augmented.shape == images.shape
+    assert augmented.dtype == np.float32
+    assert augmented.min() >= images.min() and augmented.max() <= images.max()
+
+
+# Shifts and flips only move pixels around: every pixel of an augmented image comes from the same
+# channel of the same source image.
+def test_augment_batch_only_moves_pixels_within_each_image():
+    images = random_images(batch=4)
+    augmented = augment_batch(tf.constant(images)).numpy()
+    for source, result in zip(images, augmented):
+        for channel in range(3):
+            assert np.isin(result[..., channel], source[..., channel]).all()
+
+
+def test_augment_batch_without_shift_only_flips():
+    images = random_images(batch=8)
+    augmented = augment_batch(tf.constant(images), shift_range=0).numpy()
+    for source, result in zip(images, augmented):
+        assert np.array_equal(result, source) or np.array_equal(result, source[:, ::-1])
+
+
+def test_pipelines_cover_every_sample():
+    x = random_images(batch=10, size=8)
+    y = np.arange(10, dtype=np.uint8).reshape(10, 1)
+    train_labels = np.concatenate([labels for _, labels in build_train_dataset(x, y, batch_size=4).as_numpy_iterator()])
+    eval_batches = list(build_eval_dataset(x, y, batch_size=4).as_numpy_iterator())
+    assert sorted(train_labels.ravel()) == list(range(10))
+    assert [len(labels) for _, labels in eval_batches] == [4, 4, 2]
+    np.testing.assert_array_equal(np.concatenate([images for images, _ in eval_batches]), x)
+
+
+def loading_seconds(split):
+    return WORKER_REGISTRY.get_sample_value("data_loading_seconds_total", {"split": split}) or 0.0
+
+
+def test_data_loading_time_is_recorded_by_split():
+    x = random_images(batch=8, size=8)
+    y = np.zeros((8, 1), dtype=np.uint8)
+    before = {split: loading_seconds(split) for split in ("train", "eval")}
+    list(build_eval_dataset(x, y, batch_size=4).as_numpy_iterator())
+    assert loading_seconds("train") == before["train"]
+    assert loading_seconds("eval") > before["eval"]
@@ -0,0 +1,69 @@
+# Tests for the opt-in precision and XLA modes (see precision.py): the float32 fallback without native
+# bfloat16, the dtype policy being restored after building a model, the jit_compile argument, and the
+# throughput measured over an epoch.
+
+import pytest
+import tensorflow as tf
+
+import precision
+from precision import ThroughputCallback, jit_compile_setting, precision_policy, resolve_precision
+
+
+@pytest.mark.parametrize("supported,expected", [(True, "mixed_bfloat16"), (False, "float32")])
+def test_resolve_precision_falls_back_to_float32_without_bf16(monkeypatch, supported, expected):
+    monkeypatch.setattr(precision, "bf16_supported", lambda: supported)
+    assert resolve_precision("mixed_bfloat16") == expected
+    assert resolve_precision("float32") == "float32"
+
+
+def test_precision_policy_restores_the_global_policy():
+    previous = tf.keras.mixed_precision.global_policy().name
+    with precision_policy("mixed_bfloat16"):
+        assert tf.keras.mixed_precision.global_policy().name == "mixed_bfloat16"
+    assert tf.keras.mixed_precision.global_policy().name == previous
+
+
+def test_precision_policy_restores_the_global_policy_on_error():
+    previous = tf.keras.mixed_precision.global_policy().name
+    with pytest.raises(RuntimeError):
+        with precision_policy("mixed_bfloat16"):
+            raise RuntimeError("model build failed")
+    assert tf.keras.mixed_precision.global_policy().name == previous
+
+
+def test_jit_compile_setting():
+    assert jit_compile_setting(True) is True
+    assert jit_compile_setting(False) == "auto"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_epoch(callback, clock, steps):
+    callback.on_epoch_begin(0)
+    for step in range(steps):
+        clock.now += 1.0
+        callback.on_train_batch_end(step)
+    callback.on_epoch_end(0)
+
+
+def test_throughput_counts_the_last_partial_batch_with_its_real_size(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(precision.time, "perf_counter", clock)
+    callback = ThroughputCallback(batch_size=32, num_samples=100)
+    run_epoch(callback, clock, steps=4)
+    assert callback.epoch_rates == [pytest.approx(100 / 4)]
+    assert callback.last_elapsed == pytest.approx(4)
+
+
+def test_throughput_without_a_sample_count_counts_full_batches(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(precision.time, "perf_counter", clock)
+    callback = ThroughputCallback(batch_size=32)
+    run_epoch(callback, clock, steps=4)
+    assert callback.epoch_rates == [pytest.approx(128 / 4)]
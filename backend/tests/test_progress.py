@@ -0,0 +1,67 @@
+# Tests for batch-level progress (see progress.py): updates are published at most once per interval
+# with everything in between coalesced, and the last batch of an epoch counts its real size.
+
+import pytest
+
+import progress
+from progress import ProgressCallback, ProgressReporter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(progress.time, "perf_counter", clock)
+    return clock
+
+
+def test_reporter_publishes_at_most_once_per_interval(clock):
+    updates = []
+    reporter = ProgressReporter(lambda task_id, update: updates.append(update), "t1", epochs=1, steps_per_epoch=10, hz=2)
+
+    for step, t in enumerate([0.1, 0.3, 0.6, 0.8, 1.0, 1.2]):
+        clock.now = 100.0 + t
+        reporter.batch_end(0, step, 32, {"loss": 1.0 / (step + 1)})
+
+    assert [update["batch"] for update in updates] == [3, 6]
+    # The first update covers the three batches since the start, the second the three since then.
+    assert updates[0]["samples_per_sec"] == pytest.approx(3 * 32 / 0.6)
+    assert updates[1]["samples_per_sec"] == pytest.approx(3 * 32 / 0.6)
+    assert updates[1]["logs"] == {"loss": pytest.approx(1.0 / 6)}
+    assert updates[1]["eta_seconds"] == pytest.approx(4 / (6 / 1.2))
+
+
+def test_reporter_with_zero_hz_never_publishes(clock):
+    updates = []
+    reporter = ProgressReporter(lambda task_id, update: updates.append(update), "t1", epochs=1, steps_per_epoch=3, hz=0)
+    for step in range(3):
+        clock.now += 10
+        reporter.batch_end(0, step, 32, {})
+    assert updates == []
+
+
+class RecordingReporter:
+    def __init__(self):
+        self.batches = []
+
+    def batch_end(self, epoch, step, batch_size, logs):
+        self.batches.append((epoch, step, batch_size))
+
+
+def test_callback_counts_the_last_partial_batch_with_its_real_size():
+    reporter = RecordingReporter()
+    callback = ProgressCallback(reporter, batch_size=32, num_samples=100)
+    for epoch in range(2):
+        callback.on_epoch_begin(epoch)
+        for step in range(4):
+            callback.on_train_batch_end(step)
+
+    assert [size for _, _, size in reporter.batches] == [32, 32, 32, 4] * 2
+    assert [epoch for epoch, _, _ in reporter.batches] == [0] * 4 + [1] * 4
@@ -0,0 +1,128 @@
+# Tests for the worker's background publisher (see publisher.py): ordered delivery with event ids,
+# flush() waiting for the queue to drain, retrying a failed send without logging events twice, and
+# dropping progress updates when the queue is full, against fakeredis.
+
+import json
+import threading
+import time
+
+import fakeredis
+import redis
+
+from events import stream_key
+from publisher import BackgroundPublisher
+
+
+# Wraps a fakeredis client so the tests can fail or hold up its pipelines. 'failures' is the list of
+# pipeline calls (counting from 0) that raise a connection error when executed.
+class FlakyRedis:
+    def __init__(self, client, failures=(), gate=None):
+        self.client = client
+        self.failures = set(failures)
+        self.gate = gate
+        self.calls = 0
+
+    def pipeline(self, **kwargs):
+        pipe = self.client.pipeline(**kwargs)
+        call, self.calls = self.calls, self.calls + 1
+        execute = pipe.execute
+
+        def flaky_execute():
+            if self.gate is not None:
+                self.gate.wait()
+            if call in self.failures:
+                pipe.reset()
+                raise redis.ConnectionError("connection reset")
+            return execute()
+        pipe.execute = flaky_execute
+        return pipe
+
+
+def make_publisher(client, **kwargs):
+    publisher = BackgroundPublisher(redis_url="redis://localhost:6379/0", backoff=0.001, max_backoff=0.001, **kwargs)
+    publisher.client = client
+    return publisher
+
+
+def subscribe(client):
+    pubsub = client.pubsub()
+    pubsub.psubscribe("model_updates:*")
+    assert pubsub.get_message(timeout=1)["type"] == "psubscribe"
+    return pubsub
+
+
+def received(pubsub):
+    updates = []
+    while True:
+        message = pubsub.get_message(timeout=0.1)
+        if message is None:
+            return updates
+        updates.append(json.loads(message["data"]))
+
+
+def test_updates_are_published_in_order_with_their_event_ids():
+    client = fakeredis.FakeRedis()
+    pubsub = subscribe(client)
+    publisher = make_publisher(client)
+
+    for epoch in range(3):
+        publisher.publish("t1", {"task_id": "t1", "status": "BATCH", "epoch": epoch})
+        publisher.publish("t1", {"task_id": "t1", "status": "PROGRESS", "epoch": epoch})
+    publisher.publish("t1", {"task_id": "t1", "status": "SUCCESS"})
+    assert publisher.flush(timeout=5)
+
+    updates = received(pubsub)
+    assert [(u["status"], u.get("epoch")) for u in updates] == [
+        ("BATCH", 0), ("PROGRESS", 0), ("BATCH", 1), ("PROGRESS", 1), ("BATCH", 2), ("PROGRESS", 2), ("SUCCESS", None)]
+    logged = [event_id.decode() for event_id, _ in client.xrange(stream_key("t1"))]
+    assert [u["event_id"] for u in updates if u["status"] != "BATCH"] == logged
+    assert all("event_id" not in u for u in updates if u["status"] == "BATCH")
+
+
+def test_flush_waits_until_the_queue_is_drained():
+    gate = threading.Event()
+    client = fakeredis.FakeRedis()
+    pubsub = subscribe(client)
+    publisher = make_publisher(FlakyRedis(client, gate=gate))
+
+    for epoch in range(5):
+        publisher.publish("t1", {"task_id": "t1", "status": "PROGRESS", "epoch": epoch})
+    assert not publisher.flush(timeout=0.1)
+
+    gate.set()
+    assert publisher.flush(timeout=5)
+    assert publisher.unfinished == 0
+    assert [u["epoch"] for u in received(pubsub)] == [0, 1, 2, 3, 4]
+
+
+def test_failed_publish_is_retried_without_logging_the_event_twice():
+    client = fakeredis.FakeRedis()
+    pubsub = subscribe(client)
+    # Call 0 appends the event to the stream, call 1 (the PUBLISH) fails once and call 2 retries it.
+    publisher = make_publisher(FlakyRedis(client, failures={1}))
+
+    publisher.publish("t1", {"task_id": "t1", "status": "SUCCESS"})
+    assert publisher.flush(timeout=5)
+
+    updates = received(pubsub)
+    assert [u["status"] for u in updates] == ["SUCCESS"]
+    assert client.xlen(stream_key("t1")) == 1
+    assert updates[0]["event_id"] == client.xrange(stream_key("t1"))[0][0].decode()
+
+
+def test_full_queue_drops_progress_updates():
+    gate = threading.Event()
+    client = fakeredis.FakeRedis()
+    pubsub = subscribe(client)
+    publisher = make_publisher(FlakyRedis(client, gate=gate), max_queue=2, batch_size=1)
+
+    publisher.publish("t1", {"task_id": "t1", "status": "PROGRESS", "epoch": 0})
+    # Wait for the sender to take the first update, so the queue holds exactly what follows.
+    while not publisher.queue.empty():
+        time.sleep(0.001)
+    results = [publisher.publish("t1", {"task_id": "t1", "status": "PROGRESS", "epoch": epoch}) for epoch in range(1, 4)]
+    assert results == [True, True, False]
+
+    gate.set()
+    assert publisher.flush(timeout=5)
+    assert [u["epoch"] for u in received(pubsub)] == [0, 1, 2]
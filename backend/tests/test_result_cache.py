@@ -0,0 +1,54 @@
+# Tests for the result cache's key normalization and cached-result replay (see result_cache.py).
+
+import json
+
+from models import TrainModelRequest
+from result_cache import cache_key, replay_updates
+
+
+def request(**fields):
+    config = {"layers": 2, "units": [32, 64], "epochs": 5, "batchSize": 64, "optimizer": "adam"}
+    config.update(fields)
+    return TrainModelRequest(**config)
+
+
+def test_cache_key_ignores_field_order():
+    first = TrainModelRequest(**{"layers": 2, "units": [32, 64], "epochs": 5, "batchSize": 64, "optimizer": "adam"})
+    second = TrainModelRequest(**json.loads('{"optimizer": "adam", "batchSize": 64, "epochs": 5, "units": [32, 64], "layers": 2}'))
+    assert cache_key(first) == cache_key(second)
+
+
+def test_cache_key_normalizes_optimizer_name():
+    assert cache_key(request(optimizer=" Adam ")) == cache_key(request(optimizer="adam"))
+
+
+def test_cache_key_explicit_defaults_match_omitted_ones():
+    assert cache_key(request(precision="float32", jit=False)) == cache_key(request())
+
+
+def test_cache_key_distinguishes_training_modes():
+    keys = {cache_key(request()), cache_key(request(precision="mixed_bfloat16")), cache_key(request(jit=True)),
+            cache_key(request(precision="mixed_bfloat16", jit=True))}
+    assert len(keys) == 4
+
+
+def test_cache_key_distinguishes_configurations():
+    base = cache_key(request())
+    for change in ({"units": [64, 32]}, {"epochs": 6}, {"batchSize": 32}, {"optimizer": "sgd"}):
+        assert cache_key(request(**change)) != base
+
+
+def test_replay_updates_rebuilds_progress_then_success():
+    history = [{"epoch": 1, "logs": {"loss": 2.0}}, {"epoch": 2, "logs": {"loss": 1.5}}]
+    result = {"task_id": "t1", "test_accuracy": 0.6, "test_loss": 1.2, "history": history}
+    updates = replay_updates(result)
+    assert [update["status"] for update in updates] == ["PROGRESS", "PROGRESS", "SUCCESS"]
+    assert [update["epoch"] for update in updates[:2]] == [1, 2]
+    assert updates[1]["logs"] == {"loss": 1.5}
+    assert updates[-1]["test_accuracy"] == 0.6 and updates[-1]["test_loss"] == 1.2
+    assert all(update["task_id"] == "t1" and update["cached"] for update in updates)
+
+
+def test_replay_updates_without_history():
+    updates = replay_updates({"task_id": "t1", "test_accuracy": 0.1, "test_loss": 2.3})
+    assert [update["status"] for update in updates] == ["SUCCESS"]
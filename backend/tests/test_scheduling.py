@@ -0,0 +1,125 @@
+# Tests for the per-client limit, queue positions and start time estimates of the scheduler (see
+# scheduling.py), against fakeredis.
+
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from config import FAST_LANE_QUEUE, TRAIN_QUEUE
+from scheduling import PREFIX, Scheduler, mark_started
+
+RATE = 0.01
+
+
+@pytest.fixture
+def redis_clients():
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+
+
+def make_scheduler(async_client, finished=(), max_tasks=2):
+    async def setup():
+        await async_client.set(f"{PREFIX}:seconds_per_cost", RATE)
+    asyncio.run(setup())
+    return Scheduler(async_client, lambda task_id: task_id in finished, max_tasks_per_client=max_tasks)
+
+
+def test_admit_enforces_the_per_client_limit(redis_clients):
+    _, client = redis_clients
+    scheduler = make_scheduler(client)
+
+    async def run():
+        assert await scheduler.admit("alice", "t1")
+        assert await scheduler.admit("alice", "t2")
+        assert not await scheduler.admit("alice", "t3")
+        # Other clients have their own slots.
+        assert await scheduler.admit("bob", "t4")
+        # A refused task doesn't hold a slot.
+        assert await client.smembers(f"{PREFIX}:client:alice") == {b"t1", b"t2"}
+    asyncio.run(run())
+
+
+def test_admit_frees_slots_of_finished_tasks(redis_clients):
+    _, client = redis_clients
+    scheduler = make_scheduler(client, finished={"t1"})
+
+    async def run():
+        await scheduler.admit("alice", "t1")
+        await scheduler.enqueue("t1", "alice", TRAIN_QUEUE, 100)
+        await scheduler.admit("alice", "t2")
+        assert await scheduler.admit("alice", "t3")
+        assert await client.smembers(f"{PREFIX}:client:alice") == {b"t2", b"t3"}
+        assert await scheduler.position("t1") == (0, None)
+    asyncio.run(run())
+
+
+def test_forced_admit_is_never_refused(redis_clients):
+    _, client = redis_clients
+    scheduler = make_scheduler(client, max_tasks=1)
+
+    async def run():
+        assert await scheduler.admit("alice", "t1")
+        assert not await scheduler.admit("alice", "t2")
+        assert await scheduler.admit("alice", "t2", force=True)
+    asyncio.run(run())
+
+
+def test_position_and_estimated_start_follow_the_queue(redis_clients):
+    sync_client, client = redis_clients
+    scheduler = make_scheduler(client, max_tasks=10)
+
+    async def enqueue():
+        estimates = []
+        for task_id, cost in (("t1", 100), ("t2", 200), ("t3", 300)):
+            estimates.append(await scheduler.enqueue(task_id, "alice", TRAIN_QUEUE, cost))
+        return estimates
+    estimates = asyncio.run(enqueue())
+    assert estimates == pytest.approx([1.0, 2.0, 3.0])
+
+    async def positions():
+        now = time.time()
+        return now, [await scheduler.position(task_id) for task_id in ("t1", "t2", "t3")]
+    now, queued = asyncio.run(positions())
+    # One worker slot: each task starts once every task ahead of it is done.
+    assert [position for position, _ in queued] == [1, 2, 3]
+    assert [start - now for _, start in queued] == pytest.approx([0.0, 1.0, 3.0], abs=0.1)
+
+    lane, _ = mark_started(sync_client, "t1")
+    assert lane == TRAIN_QUEUE
+    now, queued = asyncio.run(positions())
+    assert queued[0] == (0, None)
+    assert [position for position, _ in queued[1:]] == [1, 2]
+    # t2 waits for t1's expected finish, t3 for t2's as well.
+    assert [start - now for _, start in queued[1:]] == pytest.approx([1.0, 3.0], abs=0.1)
+
+
+def test_is_queued_until_started(redis_clients):
+    sync_client, client = redis_clients
+    scheduler = make_scheduler(client)
+
+    async def is_queued():
+        return await scheduler.is_queued("t1")
+    assert not asyncio.run(is_queued())
+    asyncio.run(scheduler.enqueue("t1", "alice", TRAIN_QUEUE, 100))
+    assert asyncio.run(is_queued())
+    mark_started(sync_client, "t1")
+    assert not asyncio.run(is_queued())
+
+
+def test_finish_refines_the_seconds_per_cost(redis_clients):
+    sync_client, client = redis_clients
+    scheduler = make_scheduler(client)
+
+    async def run():
+        await scheduler.admit("alice", "t1")
+        await scheduler.enqueue("t1", "alice", TRAIN_QUEUE, 100)
+        mark_started(sync_client, "t1")
+        started = float(await client.hget(f"{PREFIX}:task:t1", "started"))
+        # Took 2 s, i.e. 0.02 s per unit of cost, which moves the estimate a fifth of the way there.
+        await scheduler.record({"task_id": "t1", "status": "SUCCESS", "timestamp": started + 2.0})
+        assert await scheduler.seconds_per_cost() == pytest.approx(0.8 * RATE + 0.2 * 0.02)
+        assert await scheduler.depths() == {TRAIN_QUEUE: (0, 0), FAST_LANE_QUEUE: (0, 0)}
+        assert await client.smembers(f"{PREFIX}:client:alice") == set()
+    asyncio.run(run())
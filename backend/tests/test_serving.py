@@ -0,0 +1,134 @@
+# Tests for /predict's serving layer (see serving.py): micro-batching of concurrent requests and the
+# LRU cache of loaded models.
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from serving import MicroBatcher, ModelCache
+
+
+def images(count, value=0.0):
+    return np.full((count, 2), value, dtype=np.float32)
+
+
+# A predict function that records the size of every batch and returns its input.
+class Recorder:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, batch):
+        self.batches.append(len(batch))
+        return batch
+
+
+def test_requests_are_batched_up_to_max_batch_and_the_rest_carried_over():
+    predict = Recorder()
+
+    async def run():
+        batcher = MicroBatcher(predict, window_ms=0, max_batch=4)
+        return await asyncio.gather(*(batcher.submit(images(count, value)) for value, count in enumerate([3, 2, 1])))
+
+    results = asyncio.run(run())
+    # The second request doesn't fit next to the first and opens the next batch with the third.
+    assert predict.batches == [3, 3]
+    assert [size for _, size in results] == [3, 3, 3]
+    for value, (outputs, _) in enumerate(results):
+        np.testing.assert_array_equal(outputs, images([3, 2, 1][value], value))
+
+
+def test_requests_larger_than_max_batch_run_alone():
+    predict = Recorder()
+
+    async def run():
+        batcher = MicroBatcher(predict, window_ms=0, max_batch=4)
+        return await asyncio.gather(batcher.submit(images(6)), batcher.submit(images(1)))
+
+    asyncio.run(run())
+    assert predict.batches == [6, 1]
+
+
+def test_cancelled_requests_are_skipped():
+    predict = Recorder()
+
+    async def run():
+        batcher = MicroBatcher(predict, window_ms=0, max_batch=8)
+        kept = asyncio.create_task(batcher.submit(images(2, 1.0)))
+        cancelled = asyncio.create_task(batcher.submit(images(3, 2.0)))
+        # Both requests are queued, the batch hasn't been dispatched yet.
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        return await kept
+
+    outputs, size = asyncio.run(run())
+    assert predict.batches == [2]
+    np.testing.assert_array_equal(outputs, images(2, 1.0))
+
+
+def test_a_failing_batch_fails_every_request_in_it():
+    def predict(batch):
+        raise ValueError("bad input")
+
+    async def run():
+        batcher = MicroBatcher(predict, window_ms=0, max_batch=8)
+        return await asyncio.gather(batcher.submit(images(1)), batcher.submit(images(2)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [ValueError, ValueError]
+
+
+def test_cache_evicts_the_least_recently_used_model():
+    loaded = []
+
+    def load(model_id):
+        loaded.append(model_id)
+        return Recorder()
+
+    async def run():
+        cache = ModelCache(load, capacity=2, window_ms=0)
+        for model_id in ["a", "b", "a", "c"]:
+            await cache.get(model_id)
+        status = cache.status()
+        await cache.get("b")
+        return status
+
+    status = asyncio.run(run())
+    assert status["loaded"] == ["a", "c"]
+    assert status["evictions"] == 1
+    assert loaded == ["a", "b", "c", "b"]
+
+
+def test_concurrent_requests_share_one_load():
+    calls = []
+
+    def load(model_id):
+        calls.append(threading.get_ident())
+        time.sleep(0.05)
+        return Recorder()
+
+    async def run():
+        cache = ModelCache(load, capacity=2, window_ms=0)
+        return cache, await asyncio.gather(*(cache.get("a") for _ in range(5)))
+
+    cache, batchers = asyncio.run(run())
+    assert len(calls) == 1
+    assert calls[0] != threading.get_ident()
+    assert all(batcher is batchers[0] for batcher in batchers)
+    assert cache.loads == 1
+
+
+def test_unknown_models_are_not_cached():
+    def load(model_id):
+        raise FileNotFoundError(model_id)
+
+    async def run():
+        cache = ModelCache(load, capacity=2, window_ms=0)
+        with pytest.raises(FileNotFoundError):
+            await cache.predict("missing", images(1))
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.status()["loaded"] == [] and cache.loading == {}
@@ -0,0 +1,83 @@
+# Tests for sweep rungs, trial sampling and the successive-halving cutoff of SweepCallback (see
+# sweep.py), against fakeredis.
+
+import asyncio
+import types
+
+import fakeredis
+import pytest
+
+import sweep
+
+SPACE = {"layers": [1, 2], "units": [16, 32, 64], "batchSize": [32, 64], "optimizer": ["adam", "sgd"]}
+
+
+def test_rungs():
+    assert sweep.rungs(1, 27, 3) == [1, 3, 9]
+    assert sweep.rungs(2, 20, 2) == [2, 4, 8, 16]
+    assert sweep.rungs(5, 5, 3) == []
+
+
+def test_sample_trials_is_distinct_and_within_the_space():
+    trials = sweep.sample_trials(SPACE, 10, seed=0)
+    assert len(trials) == 10
+    assert len({(t["layers"], tuple(t["units"]), t["batch_size"], t["optimizer"]) for t in trials}) == 10
+    for trial in trials:
+        assert trial["layers"] in SPACE["layers"] and len(trial["units"]) == trial["layers"]
+        assert set(trial["units"]) <= set(SPACE["units"])
+        assert trial["batch_size"] in SPACE["batchSize"] and trial["optimizer"] in SPACE["optimizer"]
+    assert sweep.sample_trials(SPACE, 10, seed=0) == trials
+
+
+def test_sample_trials_uses_the_whole_space_when_it_is_small():
+    # (3 + 3^2) unit choices x 2 batch sizes x 2 optimizers.
+    trials = sweep.sample_trials(SPACE, 100)
+    assert len(trials) == 48
+    assert len({(t["layers"], tuple(t["units"]), t["batch_size"], t["optimizer"]) for t in trials}) == 48
+
+
+def start_sweep(metric, eta=3, trials=4):
+    server = fakeredis.FakeServer()
+    configs = [{"layers": 1, "units": [16], "batch_size": 32, "optimizer": "adam"}] * trials
+    settings = {"client": "alice", "metric": metric, "min_epochs": 1, "max_epochs": 9, "eta": eta, "parallelism": trials}
+    _, trials = asyncio.run(sweep.create_sweep(fakeredis.FakeAsyncRedis(server=server), "s1", configs, settings))
+    return fakeredis.FakeRedis(server=server), [trial["trial_id"] for trial in trials]
+
+
+def run_epoch(redis_client, trial_id, epoch, logs, abort_callback=None):
+    callback = sweep.SweepCallback(redis_client, lambda task_id, update: None, "s1", trial_id, abort_callback)
+    model = types.SimpleNamespace(stop_training=False)
+    callback.set_model(model)
+    callback.on_epoch_end(epoch, logs)
+    return callback.stopped, model.stop_training
+
+
+def test_callback_stops_trials_below_the_cutoff():
+    redis_client, trial_ids = start_sweep("val_accuracy")
+    # Alone at the rung: the cutoff is its own value.
+    assert run_epoch(redis_client, trial_ids[0], 0, {"val_accuracy": 0.5}) == (False, False)
+    # Below the 2/3 quantile of [0.5, 0.3].
+    assert run_epoch(redis_client, trial_ids[1], 0, {"val_accuracy": 0.3}) == (True, True)
+    assert run_epoch(redis_client, trial_ids[2], 0, {"val_accuracy": 0.6}) == (False, False)
+    # Epoch 2 is no rung, so nothing is compared there.
+    assert run_epoch(redis_client, trial_ids[3], 1, {"val_accuracy": 0.1}) == (False, False)
+
+
+def test_callback_cutoff_for_losses_keeps_the_lowest():
+    redis_client, trial_ids = start_sweep("val_loss")
+    assert run_epoch(redis_client, trial_ids[0], 0, {"val_loss": 1.0}) == (False, False)
+    assert run_epoch(redis_client, trial_ids[1], 0, {"val_loss": 2.0}) == (True, True)
+    assert run_epoch(redis_client, trial_ids[2], 0, {"val_loss": 0.8}) == (False, False)
+
+
+def test_callback_ignores_aborted_epochs():
+    redis_client, trial_ids = start_sweep("val_accuracy")
+    run_epoch(redis_client, trial_ids[0], 0, {"val_accuracy": 0.9})
+    aborted = types.SimpleNamespace(aborted=True)
+    assert run_epoch(redis_client, trial_ids[1], 0, {"val_accuracy": 0.1}, aborted) == (False, False)
+    assert redis_client.zcard(sweep._key("s1", "rung:1")) == 1
+
+
+@pytest.mark.parametrize("metric,mode", [("val_accuracy", "max"), ("val_loss", "min"), ("loss", "min")])
+def test_metric_mode(metric, mode):
+    assert sweep.metric_mode(metric) == mode
@@ -0,0 +1,100 @@
+# Tests for the warm worker pool (see warmup.py): the warmup runs on its own thread and the first task
+# waits for it, and the startup metrics it records are summarized for /metrics/startup, against
+# fakeredis.
+
+import asyncio
+import threading
+import types
+
+import fakeredis
+import numpy as np
+import pytest
+
+import warmup
+
+
+@pytest.fixture(autouse=True)
+def fresh_process(monkeypatch):
+    monkeypatch.setattr(warmup, "state", {'warmed': False, 'warmup_seconds': None, 'tasks_started': 0})
+    monkeypatch.setattr(warmup, "ready", threading.Event())
+    dataset = types.SimpleNamespace(x_train=np.zeros((64, 32, 32, 3), dtype=np.float32),
+                                    y_train=np.zeros((64, 1), dtype=np.uint8))
+    monkeypatch.setattr(warmup, "load_dataset", lambda: dataset)
+
+
+@pytest.fixture
+def redis_clients():
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+
+
+# Stands in for worker.build_model: records the thread models are built on and holds the warmup until
+# 'release' is set.
+class StubModelFactory:
+    def __init__(self, fail=False):
+        self.release = threading.Event()
+        self.threads = []
+        self.fail = fail
+
+    def __call__(self, layers, units):
+        self.threads.append(threading.get_ident())
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("out of memory")
+        return types.SimpleNamespace(compile=lambda **kwargs: None, fit=lambda *args, **kwargs: None,
+                                     evaluate=lambda *args, **kwargs: None)
+
+
+def test_warmup_runs_off_the_calling_thread_and_records_its_time(redis_clients):
+    sync_client, async_client = redis_clients
+    build_model = StubModelFactory()
+
+    warmup.start_warmup(build_model, sync_client)
+    # start_warmup() returned while the warmup is still held up.
+    assert not warmup.ready.is_set()
+    build_model.release.set()
+    assert warmup.ready.wait(5)
+
+    assert build_model.threads and build_model.threads[0] != threading.get_ident()
+    assert warmup.state['warmed']
+    assert warmup.start_task() is True
+    warmup.record_time_to_first_epoch(sync_client, 1.5, warm=True)
+
+    summary = asyncio.run(warmup.startup_metrics(async_client))
+    assert summary['warmup_seconds']['count'] == 1
+    assert summary['warmup_seconds']['mean'] == pytest.approx(warmup.state['warmup_seconds'])
+    assert summary['time_to_first_epoch_warm'] == {'count': 1, 'mean': 1.5, 'p50': 1.5, 'p95': 1.5}
+    assert summary['time_to_first_epoch_cold'] == {'count': 0}
+
+
+def test_failed_warmup_still_lets_tasks_start_cold(redis_clients):
+    sync_client, async_client = redis_clients
+    build_model = StubModelFactory(fail=True)
+    build_model.release.set()
+
+    warmup.start_warmup(build_model, sync_client)
+    assert warmup.ready.wait(5)
+    assert not warmup.state['warmed']
+    assert warmup.start_task() is False
+    assert warmup.start_task() is True
+    assert asyncio.run(warmup.startup_metrics(async_client))['warmup_seconds'] == {'count': 0}
+
+
+def test_without_warmup_tasks_start_right_away():
+    warmup.start_warmup(StubModelFactory(), warm=False)
+    assert warmup.ready.is_set()
+    assert warmup.start_task() is False
+
+
+def test_startup_metrics_without_any_samples(redis_clients):
+    _, async_client = redis_clients
+    summary = asyncio.run(warmup.startup_metrics(async_client))
+    assert summary == {name: {'count': 0} for name in ('time_to_first_epoch_cold', 'time_to_first_epoch_warm', 'warmup_seconds')}
+
+
+def test_startup_metrics_percentiles(redis_clients):
+    sync_client, async_client = redis_clients
+    for seconds in range(1, 21):
+        warmup.record_time_to_first_epoch(sync_client, float(seconds), warm=False)
+    cold = asyncio.run(warmup.startup_metrics(async_client))['time_to_first_epoch_cold']
+    assert cold == {'count': 20, 'mean': 10.5, 'p50': 11.0, 'p95': 20.0}
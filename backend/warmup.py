@@ -0,0 +1,161 @@
+# META
+
+# Description: Warm worker pool. TensorFlow's runtime, its thread pools, oneDNN kernels and the
+# tf.data machinery are all initialized lazily, and the dataset used to be loaded per task, so the
+# first task on a fresh worker process spent most of its time to first batch on startup work. The
+# Celery signal handlers in worker.py call into this module so that every pool process does that work
+# ahead of time:
+#   - in the parent process, before the pool forks, the dataset cache is built if it doesn't exist yet
+#     (see dataset.py), so the children only ever map it;
+#   - in every pool process, TensorFlow's intra-op and inter-op thread counts are pinned, the dataset
+#     is mapped, and a tiny model is fit on a single batch to initialize the runtime, trace the input
+#     pipeline and load the kernels training uses.
+# The pool process runs that fit on a background thread (start_warmup()) rather than in the
+# worker_process_init handler itself: a child that hasn't reported to the parent within
+# worker_proc_alive_timeout (4 seconds by default) is killed, and a warmup can take longer than that.
+# The first task the process gets waits until the warmup is done instead (wait_for_warmup()).
+# Each model still traces its own train step the first time it runs, as that depends on its exact
+# architecture; everything around it is already warm.
+#
+# Time to first epoch is recorded per task, split into cold starts (first task of a process that
+# wasn't warmed up) and warm starts, together with how long warmups take, so the effect can be
+# measured. The app serves the aggregates from /metrics/startup.
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from config import TF_INTER_OP_THREADS, TF_INTRA_OP_THREADS
+from dataset import ensure_dataset, load_dataset
+from pipeline import build_train_dataset, build_eval_dataset
+
+# Number of recent samples kept per startup metric in Redis.
+METRIC_SAMPLES = 1000
+
+# Per-process state. 'warmed' is set once warm_process() succeeded; 'tasks_started' counts the tasks
+# this process has run so far.
+state = {'warmed': False, 'warmup_seconds': None, 'tasks_started': 0}
+
+# Number of pool processes the worker was started with, recorded by the parent before it forks.
+pool_size = None
+
+# Set once this process's warmup has finished or failed, or right away if it isn't warmed up.
+ready = threading.Event()
+
+
+def startup_metric_key(name):
+    return f"worker_metrics:{name}"
+
+
+def prepare_parent(concurrency):
+    global pool_size
+    pool_size = concurrency
+    ensure_dataset()
+
+
+# Pins TensorFlow's thread pools. Only takes effect before the process executes its first TensorFlow
+# op; afterwards TensorFlow refuses the change and the current settings are kept.
+def configure_threads():
+    processes = pool_size or 1
+    cpus = os.cpu_count() or 1
+    intra = TF_INTRA_OP_THREADS or max(1, cpus // processes)
+    inter = TF_INTER_OP_THREADS or max(1, min(2, intra))
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra)
+        tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as e:
+        print(f"Could not pin TensorFlow threads in process {os.getpid()}: {e}")
+    return intra, inter
+
+
+# Called in every pool process right after the fork. Pins the thread pools, which has to happen before
+# the first TensorFlow op, then warms the process up on a background thread unless 'warm' is False.
+def start_warmup(build_model, redis_client=None, warm=True):
+    configure_threads()
+    if not warm:
+        ready.set()
+        return
+
+    def run():
+        try:
+            warm_process(build_model, redis_client)
+        except Exception as e:
+            # A failed warmup only costs the first task its head start.
+            print(f"Worker process warmup failed: {e}")
+        finally:
+            ready.set()
+
+    threading.Thread(target=run, name="warmup", daemon=True).start()
+
+
+# Blocks until the process's warmup is done, so that a task doesn't compete with it for the cores.
+def wait_for_warmup():
+    ready.wait()
+
+
+# Warms up the current process. 'build_model' is the worker's model factory; the smallest allowed
+# configuration is fit for one step on a single batch, and evaluated on one.
+def warm_process(build_model, redis_client=None):
+    start = time.perf_counter()
+    intra, inter = configure_threads()
+    dataset = load_dataset()
+    batch_size = 32
+    indices = np.arange(batch_size)
+    x, y = np.asarray(dataset.x_train[indices]), np.asarray(dataset.y_train[indices])
+
+    model = build_model(1, [8])
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    model.fit(build_train_dataset(x, y, batch_size), epochs=1, verbose=0)
+    model.evaluate(build_eval_dataset(x, y, batch_size), verbose=0)
+
+    state['warmed'] = True
+    state['warmup_seconds'] = time.perf_counter() - start
+    print(f"Worker process {os.getpid()} warmed up in {state['warmup_seconds']:.2f}s "
+          f"(intra-op threads={intra}, inter-op threads={inter})")
+    if redis_client is not None:
+        _record(redis_client, 'warmup_seconds', state['warmup_seconds'])
+
+
+# Called at the start of every task; waits for the warmup, if it's still running. Returns whether the
+# task starts warm: either the process was warmed up ahead of time or it has already run a task before.
+def start_task():
+    wait_for_warmup()
+    warm = state['warmed'] or state['tasks_started'] > 0
+    state['tasks_started'] += 1
+    return warm
+
+
+def record_time_to_first_epoch(redis_client, seconds, warm):
+    _record(redis_client, 'time_to_first_epoch_warm' if warm else 'time_to_first_epoch_cold', seconds)
+
+
+def _record(redis_client, name, value):
+    try:
+        with redis_client.pipeline() as pipe:
+            pipe.lpush(startup_metric_key(name), json.dumps(value))
+            pipe.ltrim(startup_metric_key(name), 0, METRIC_SAMPLES - 1)
+            pipe.execute()
+    except Exception as e:
+        print(f"Could not record startup metric {name}: {e}")
+
+
+# Summarizes the recorded startup metrics for the app: sample count, mean and percentiles per metric.
+# Used with the app's asynchronous Redis client.
+async def startup_metrics(redis_client):
+    summary = {}
+    for name in ('time_to_first_epoch_cold', 'time_to_first_epoch_warm', 'warmup_seconds'):
+        values = sorted(json.loads(value) for value in await redis_client.lrange(startup_metric_key(name), 0, -1))
+        if not values:
+            summary[name] = {'count': 0}
+            continue
+        summary[name] = {
+            'count': len(values),
+            'mean': sum(values) / len(values),
+            'p50': values[len(values) // 2],
+            'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+        }
+    return summary
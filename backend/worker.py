@@ -1,28 +1,44 @@
 # META
 
-# Currently 1 active print statement as part of callback
+# Active print statements: each task's configuration and progress, cancellations, and errors, including
+# failed bookkeeping (metrics, scheduler, model store, sweeps, publishing) that doesn't fail the task.
 
 
 # importing celery
 from celery import Celery
-from celery.contrib.abortable import AbortableTask
+from celery.signals import celeryd_after_setup, worker_process_init, task_prerun
 #importing redis
 import redis
 
 # preprocessing imports
 import tensorflow as tf
-from sklearn.model_selection import train_test_split
 import numpy as np
+from dataset import load_dataset
+from config import ABORT_CHECK_EVERY_N_BATCHES, DISTRIBUTED_RESERVE_TIMEOUT, ESTIMATE_MAX_SECONDS, PUBLISH_FLUSH_TIMEOUT, REDIS_URL, TRAIN_QUEUE, WORKER_METRICS_PORT, WORKER_WARMUP
+from pipeline import build_train_dataset, build_eval_dataset
+from progress import ProgressReporter, ProgressCallback
+from events import FINAL_STATUSES
+from publisher import BackgroundPublisher
+from checkpoints import CheckpointWriter, CheckpointCallback, load_checkpoint, restore_model
+from cancellation import AbortCallback, CancellableTask
+import warmup
+import distributed
+from scheduling import mark_started
+from precision import ThroughputCallback, jit_compile_setting, precision_policy, resolve_precision
+import sweep
+import metrics
+from model_store import save_model
 
 # model building and training imports
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 
 import signal
 import sys
 
-import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Creating a celery instance and a redis client. The Celery instance is used to create a task that will
 # train the model, whereas the redis client is used to publish updates to the frontend. The redis client
@@ -41,8 +57,37 @@ import json
 # The broker and backend parameters are optional, but they are used here to specify
 # the Redis instance that will be used for message passing and storing task results. We had it previously
 # when we were using Redis to publish updates to the frontend.
-redis_client = redis.Redis(host='redis', port = 6379, db = 0)
-celery = Celery(backend='redis://redis:6379/0', broker='redis://redis:6379/0')
+# The server's address comes from REDIS_URL (see config.py), which defaults to the one above.
+redis_client = redis.Redis.from_url(REDIS_URL)
+celery = Celery(backend=REDIS_URL, broker=REDIS_URL)
+# Training tasks are long, so a worker process must not reserve the next task while it is still busy
+# with the current one: that task would be stuck behind it even if another process (or the fast-lane
+# worker) is idle, and the queue positions reported by /train would be off (see scheduling.py). A
+# prefetch multiplier of 1 alone isn't enough: a task acked when it starts frees the prefetch slot
+# for one more message, so tasks are acked once they finish instead. A task whose worker process
+# died is then redelivered rather than lost. With the Redis broker, a message not acked within the
+# visibility timeout is redelivered too, so that is kept well above the longest run /train admits.
+celery.conf.worker_prefetch_multiplier = 1
+celery.conf.task_acks_late = True
+celery.conf.task_reject_on_worker_lost = True
+celery.conf.broker_transport_options = {'visibility_timeout': 2 * ESTIMATE_MAX_SECONDS}
+# Sends the training updates of this process to Redis from a background thread, see publish_update().
+publisher = BackgroundPublisher()
+
+# Publishes a training update for the given task on that task's own channel, model_updates:<task_id>,
+# so consumers interested in one task don't have to filter everyone else's traffic (the FastAPI app
+# pattern-subscribes to all of them). Every update also carries the task_id returned by /train, which
+# the app uses to route it to the WebSocket clients subscribed to that task, and the time it was
+# produced, which the app uses to measure how far behind its listener is. Everything except
+# batch-level progress is first appended to the task's durable event stream (see events.py), and the
+# published update carries the resulting event_id. All of that happens on the process' background
+# publisher (see publisher.py): this only queues the update, so the training callbacks calling it never
+# wait on Redis or fail because of it. A final update is the exception; it returns once it's sent.
+def publish_update(task_id, update):
+    update = {'task_id': task_id, 'timestamp': time.time(), **update}
+    publisher.publish(task_id, update)
+    if update.get('status') in FINAL_STATUSES and not publisher.flush():
+        print(f"Final update of task {task_id} still not published after {PUBLISH_FLUSH_TIMEOUT}s")
 
 # Handling the closing of the celery worker when a SIGINT or SIGTERM signal is received.
 def handle_exit(signal, frame):
@@ -56,49 +101,86 @@ def setup_signal_handlers():
     signal.signal(signal.SIGTERM, handle_exit)  # Handle termination signal
 
 
-@celery.task(bind=True, base = AbortableTask)
-def train_model(self, layers, units, epochs, batch_size, optimizer):
-    try:
-        print(f"Training model with layers={layers}, units={units}, epochs={epochs}, batch_size={batch_size}, optimizer={optimizer}")
-        #Loading CIFAR-10 in and splitting dataset
-        (x_train, y_train), (x_test, y_test) = tf.keras.datasets.cifar10.load_data()
+# Builds the CNN described by a TrainModelRequest: 'layers' blocks of Conv2D + MaxPooling2D with the
+# given number of filters each, followed by a dense layer as wide as the last conv layer, dropout and
+# a 10-way softmax for the CIFAR-10 classes. The softmax always computes in float32, so that under a
+# mixed precision policy (see precision.py) the probabilities fed to the loss keep full precision.
+def build_model(layers, units):
+    model = Sequential()
+    model.add(Conv2D(units[0], (3, 3), activation='relu', input_shape=(32, 32, 3)))
+    model.add(MaxPooling2D((2, 2)))
+    for i in range(1, layers):
+        model.add(Conv2D(units[i], (3, 3), activation='relu'))
+        model.add(MaxPooling2D((2, 2)))
+    model.add(Flatten())
+    model.add(Dense(units[-1], activation = 'relu'))
+    model.add(Dropout(0.5))
+    model.add(Dense(10, activation='softmax', dtype='float32'))
+    return model
 
-        #Normalizing pixel values
-        x_train, x_test = x_train/255.0, x_test/255.0
 
-        #Mean subtraction
-        mean = np.mean(x_train, axis = (0, 1, 2) )
-        x_train = x_train - mean
-        x_test = x_test - mean
+# Warm worker pool (see warmup.py). celeryd_after_setup fires once in the main worker process before
+# the prefork pool starts, worker_process_init in every pool process right after it's forked. The pool
+# process starts its warmup on a thread there and the first task waits for it, since the handler must
+# return within worker_proc_alive_timeout. The main process also serves the worker's Prometheus
+# metrics (see metrics.py).
+@celeryd_after_setup.connect
+def prepare_worker(sender, instance, **kwargs):
+    try:
+        metrics.start_worker_exporter(WORKER_METRICS_PORT)
+    except Exception as e:
+        print(f"Could not start the metrics exporter: {e}")
+    warmup.prepare_parent(instance.concurrency)
+
+@worker_process_init.connect
+def warm_worker_process(**kwargs):
+    warmup.start_warmup(build_model, redis_client, warm=WORKER_WARMUP)
 
-        #Extracting validation set
-        x_train, x_val, y_train, y_val = train_test_split(x_train, y_train, test_size = 0.1, stratify = y_train)
 
-        #Data augmentation via shifts and horizontal flips
+# Tells the scheduler a task left its queue (see scheduling.py) and records how long it waited.
+@task_prerun.connect
+def task_started(task_id=None, **kwargs):
+    try:
+        started = mark_started(redis_client, task_id)
+        if started is not None:
+            lane, wait = started
+            metrics.TASK_WAIT.labels(lane).observe(wait)
+    except Exception as e:
+        print(f"Could not mark task {task_id} as started: {e}")
 
-        datagen = ImageDataGenerator(
-            width_shift_range = 0.1,
-            height_shift_range = 0.1,
-            horizontal_flip = True
-        )
 
-        datagen.fit(x_train)
+# Trains a single model. The weights and optimizer state are checkpointed as training goes (see
+# checkpoints.py). If resume_from is the id of an earlier train_model task with the same configuration,
+# training continues from that task's last checkpoint instead of starting at epoch 0. Once training
+# succeeds, the model is stored under the task id for /predict (see model_store.py). 'precision' and
+# 'jit' select the opt-in mixed precision and XLA modes (see precision.py). A task started by /sweep
+# is a trial of sweep 'sweep_id': it may be stopped early, ending with status STOPPED and no test
+# evaluation, and it reports to the sweep's leaderboard (see sweep.py).
+@celery.task(bind=True, base = CancellableTask)
+def train_model(self, layers, units, epochs, batch_size, optimizer, precision="float32", jit=False, resume_from=None, sweep_id=None):
+    task_id = self.request.id
+    task_started = time.perf_counter()
+    warm_start = warmup.start_task()
+    try:
+        print(f"Training model with layers={layers}, units={units}, epochs={epochs}, batch_size={batch_size}, optimizer={optimizer}, precision={precision}, jit={jit}")
+        # Mapping the preprocessed CIFAR-10 arrays (normalized, mean-subtracted and split into
+        # train/validation/test). The first task on a host builds the cache, every later task in every
+        # worker process shares the same memory-mapped pages instead of re-running the preprocessing.
+        dataset = load_dataset()
+        x_train, y_train = dataset.x_train, dataset.y_train
+        x_val, y_val = dataset.x_val, dataset.y_val
+        x_test, y_test = dataset.x_test, dataset.y_test
 
-        train_generator = datagen.flow(x_train, y_train, batch_size = batch_size)
-        val_generator = tf.data.Dataset.from_tensor_slices((x_val, y_val)).batch(batch_size)
-        test_generator = tf.data.Dataset.from_tensor_slices((x_test, y_test)).batch(batch_size)
+        # Data augmentation via shifts and horizontal flips, applied to whole batches inside a tf.data
+        # pipeline (see pipeline.py) rather than image by image through ImageDataGenerator.
+        train_generator = build_train_dataset(x_train, y_train, batch_size)
+        val_generator = build_eval_dataset(x_val, y_val, batch_size)
+        test_generator = build_eval_dataset(x_test, y_test, batch_size)
 
         # Build model
-        model = Sequential()
-        model.add(Conv2D(units[0], (3, 3), activation='relu', input_shape=(32, 32, 3)))
-        model.add(MaxPooling2D((2, 2)))
-        for i in range(1, layers):
-            model.add(Conv2D(units[i], (3, 3), activation='relu'))
-            model.add(MaxPooling2D((2, 2)))
-        model.add(Flatten())
-        model.add(Dense(units[-1], activation = 'relu'))
-        model.add(Dropout(0.5))
-        model.add(Dense(10, activation='softmax'))
+        policy = resolve_precision(precision)
+        with precision_policy(policy):
+            model = build_model(layers, units)
 
         print("Model Summary:")
         model.summary()
@@ -107,7 +189,8 @@ def train_model(self, layers, units, epochs, batch_size, optimizer):
         model.compile(
             optimizer=optimizer,
             loss='sparse_categorical_crossentropy',
-            metrics=['accuracy']
+            metrics=['accuracy'],
+            jit_compile=jit_compile_setting(jit)
         )
 
         print("Final Training Parameters:")
@@ -116,6 +199,7 @@ def train_model(self, layers, units, epochs, batch_size, optimizer):
         print(f"Epochs: {epochs}")
         print(f"Batch Size: {batch_size}")
         print(f"Optimizer: {model.optimizer}")
+        print(f"Precision: {policy}, XLA: {jit}")
 
         # Define a custom callback to track the training progress.
         # Note: Turns out the default output from tensorflow averages training accuracy and loss over 
@@ -125,34 +209,287 @@ def train_model(self, layers, units, epochs, batch_size, optimizer):
             def __init__(self):
                 super().__init__()
                 self.batch_accuracies = []
+                # Per-epoch logs, sent along with the final result so the app can cache and replay it.
+                self.history = []
+                self.reported_first_epoch = False
 
             def on_epoch_end(self, epoch, logs=None):
+                # An epoch cut short by /cancel isn't a completed epoch; it's reported by the
+                # CANCELLED update instead.
+                if abort_callback.aborted:
+                    return
                 logs = logs or {}
                 print (f" Epoch {epoch + 1}: logs={logs}")
                 update = {'status': "PROGRESS", 'epoch': epoch + 1, 'logs': logs}
-                redis_client.publish('model_updates', json.dumps(update))
+                if throughput_callback.epoch_rates:
+                    update['images_per_sec'] = throughput_callback.epoch_rates[-1]
+                # The first epoch this task completes also reports how long the task took to get
+                # there, and whether it started on a warm process.
+                if not self.reported_first_epoch:
+                    self.reported_first_epoch = True
+                    time_to_first_epoch = time.perf_counter() - task_started
+                    update.update(time_to_first_epoch=time_to_first_epoch, warm_start=warm_start)
+                    warmup.record_time_to_first_epoch(redis_client, time_to_first_epoch, warm_start)
+                    metrics.TIME_TO_FIRST_EPOCH.labels("warm" if warm_start else "cold").observe(time_to_first_epoch)
+                metrics.observe_epoch(time.perf_counter() - throughput_callback.epoch_start, throughput_callback.last_elapsed,
+                                      update.get('images_per_sec'))
+                self.history.append({'epoch': epoch + 1, 'logs': dict(logs)})
+                publish_update(task_id, update)
 
             def get_total_accuracy(self):
                 return np.sum(self.batch_accuracies)
         
-        history = model.fit(
-            train_generator,
-            epochs=epochs,
-            validation_data=val_generator,
-            callbacks=[TrainingCallback()],
+        training_callback = TrainingCallback()
+        # Measures images/sec; listed before training_callback so each epoch's rate is ready when the
+        # epoch is reported.
+        throughput_callback = ThroughputCallback(batch_size, len(x_train))
+        # Stops training at the next batch boundary once /cancel aborts the task (see cancellation.py).
+        abort_callback = AbortCallback(self)
+        # Early stopping of sweep trials; runs after training_callback so the epoch that stops a trial
+        # is still reported.
+        callbacks = [abort_callback, throughput_callback, training_callback]
+        if sweep_id:
+            sweep_callback = sweep.SweepCallback(redis_client, publish_update, sweep_id, task_id, abort_callback)
+            callbacks.append(sweep_callback)
 
-        )
+        # Restoring the weights, optimizer state and history of the run we're resuming, if any.
+        initial_epoch = 0
+        if resume_from:
+            checkpoint_meta, weights, optimizer_variables = load_checkpoint(resume_from)
+            if checkpoint_meta['dataset'] != dataset.version:
+                raise ValueError(f"Checkpoint of task {resume_from} was trained on dataset {checkpoint_meta['dataset']}, not {dataset.version}")
+            restore_model(model, weights, optimizer_variables)
+            initial_epoch = checkpoint_meta['epoch']
+            training_callback.history.extend(checkpoint_meta['history'])
+            print(f"Resuming task {resume_from} from epoch {initial_epoch}")
+            publish_update(task_id, {'status': "RESUMED", 'epoch': initial_epoch, 'resumed_from': resume_from})
+
+        # Batch-level progress, rate-limited to PROGRESS_HZ updates per second (see progress.py).
+        reporter = ProgressReporter(publish_update, task_id, max(epochs - initial_epoch, 0), math.ceil(len(x_train) / batch_size))
+        checkpoint_writer = CheckpointWriter(task_id)
+        checkpoint_meta = {
+            'task_id': task_id,
+            'config': dict(layers=layers, units=units, epochs=epochs, batch_size=batch_size, optimizer=optimizer,
+                           precision=precision, jit=jit),
+            'dataset': dataset.version,
+        }
+        try:
+            history = model.fit(
+                train_generator,
+                epochs=epochs,
+                initial_epoch=initial_epoch,
+                validation_data=val_generator,
+                callbacks=[
+                    *callbacks,
+                    CheckpointCallback(checkpoint_writer, checkpoint_meta, training_callback.history, abort_callback),
+                    ProgressCallback(reporter, batch_size, len(x_train)),
+                ],
+
+            )
+        finally:
+            checkpoint_writer.close()
+
+        if abort_callback.aborted:
+            completed_epochs = training_callback.history[-1]['epoch'] if training_callback.history else initial_epoch
+            print(f"Training cancelled after {completed_epochs} completed epochs")
+            response = {'status': "CANCELLED", 'epoch': completed_epochs, 'logs': abort_callback.last_logs,
+                        'history': training_callback.history}
+            if sweep_id:
+                response['sweep_id'] = sweep_id
+            publish_update(task_id, response)
+            finish_trial(sweep_id, task_id, "CANCELLED", completed_epochs)
+            return
+
+        completed_epochs = training_callback.history[-1]['epoch'] if training_callback.history else initial_epoch
+        if sweep_id and sweep_callback.stopped:
+            publish_update(task_id, {'status': "STOPPED", 'epoch': completed_epochs, 'history': training_callback.history,
+                                     'sweep_id': sweep_id, 'images_per_sec': throughput_callback.images_per_sec()})
+            finish_trial(sweep_id, task_id, "STOPPED", completed_epochs)
+            return
 
         # Evaluate the model on the test set
         test_loss, test_accuracy = model.evaluate(test_generator)
-        response = {"status": "SUCCESS", 'test_accuracy': test_accuracy, 'test_loss': test_loss}
-        redis_client.publish('model_updates', json.dumps(response))
+        response = {"status": "SUCCESS", 'test_accuracy': test_accuracy, 'test_loss': test_loss, 'history': training_callback.history,
+                    'precision': policy, 'jit': jit, 'images_per_sec': throughput_callback.images_per_sec(),
+                    'model_saved': store_model(task_id, model, dataset, checkpoint_meta['config'], test_accuracy, test_loss)}
+        if sweep_id:
+            response['sweep_id'] = sweep_id
+        publish_update(task_id, response)
+        finish_trial(sweep_id, task_id, "SUCCESS", completed_epochs)
     except Exception as e:
         print(f"An error occurred during training.{e}")
         response = {"status": "ERROR", "message": str(e)}
-        redis_client.publish('model_updates', json.dumps(response))
+        if sweep_id:
+            response['sweep_id'] = sweep_id
+        publish_update(task_id, response)
+        finish_trial(sweep_id, task_id, "ERROR")
         raise
 
+# Exports a trained model for /predict (see model_store.py). Returns whether it was stored; a model
+# that can't be stored doesn't fail the training run.
+def store_model(task_id, model, dataset, config, test_accuracy, test_loss):
+    try:
+        save_model(task_id, model, dataset.mean, {'config': config, 'dataset': dataset.version,
+                                                  'test_accuracy': test_accuracy, 'test_loss': test_loss})
+        return True
+    except Exception as e:
+        print(f"Could not store the model of task {task_id}: {e}")
+        return False
+
+# Records the end of a sweep trial (see sweep.py). Runs after the trial's own final update, which is
+# the one the app reacts to by starting the next trial.
+def finish_trial(sweep_id, task_id, status, epoch=None):
+    if not sweep_id:
+        return
+    try:
+        sweep.trial_finished(redis_client, publish_update, sweep_id, task_id, status, epoch)
+    except Exception as e:
+        print(f"Could not record the end of sweep trial {task_id}: {e}")
+
+# Trains several small models in one task. The models built by train_model are tiny, so a single task
+# leaves most CPU cores idle and spends a large share of its time in the input pipeline. Here every
+# model reads the very same augmented batches from one shared pipeline, so data loading is paid once,
+# and the models' train steps for a batch run concurrently in a thread pool (TensorFlow releases the
+# GIL while executing them), which keeps the remaining cores busy.
+#
+# 'configs' is a list of dicts with the train_model arguments (layers, units, epochs, batch_size,
+# optimizer and optionally precision and jit), all with the same batch_size since they share one
+# pipeline. 'sub_task_ids' holds one id per config, generated by /train/batch. Every model's progress
+# and final result go to model_updates tagged with its sub-task id, exactly like a train_model task
+# with that id would publish them, and a summary of all results is published under the batch task's
+# own id at the end.
+@celery.task(bind=True, base = CancellableTask)
+def train_model_batch(self, configs, sub_task_ids):
+    batch_id = self.request.id
+    warmup.wait_for_warmup()
+    try:
+        print(f"Training {len(configs)} models in batch {batch_id}: {configs}")
+        batch_size = configs[0]['batch_size']
+        dataset = load_dataset()
+        train_generator = build_train_dataset(dataset.x_train, dataset.y_train, batch_size)
+        val_generator = build_eval_dataset(dataset.x_val, dataset.y_val, batch_size)
+        test_generator = build_eval_dataset(dataset.x_test, dataset.y_test, batch_size)
+
+        models = []
+        for config in configs:
+            with precision_policy(resolve_precision(config.get('precision', "float32"))):
+                model = build_model(config['layers'], config['units'])
+            model.compile(
+                optimizer=config['optimizer'],
+                loss='sparse_categorical_crossentropy',
+                metrics=['accuracy'],
+                jit_compile=jit_compile_setting(config.get('jit', False))
+            )
+            models.append(model)
+        histories = [[] for _ in configs]
+        steps_per_epoch = math.ceil(len(dataset.x_train) / batch_size)
+        reporters = [ProgressReporter(publish_update, sub_task_ids[i], config['epochs'], steps_per_epoch, extra={'batch_id': batch_id})
+                     for i, config in enumerate(configs)]
+
+        with ThreadPoolExecutor(max_workers=len(models)) as executor:
+            for epoch in range(max(config['epochs'] for config in configs)):
+                # Models whose requested number of epochs is reached simply stop taking batches.
+                active = [i for i, config in enumerate(configs) if config['epochs'] > epoch]
+                # Running sums of each model's per-batch loss/accuracy, weighted by batch size, to
+                # report the same epoch averages model.fit() would.
+                totals = {i: {} for i in active}
+                seen = 0
+                for step_index, (x, y) in enumerate(train_generator):
+                    if (step_index + 1) % ABORT_CHECK_EVERY_N_BATCHES == 0 and self.is_aborted():
+                        break
+                    steps = {i: executor.submit(models[i].train_on_batch, x, y, return_dict=True) for i in active}
+                    size = int(tf.shape(x)[0])
+                    seen += size
+                    for i, step in steps.items():
+                        step_logs = step.result()
+                        for name, value in step_logs.items():
+                            totals[i][name] = totals[i].get(name, 0.0) + value * size
+                        reporters[i].batch_end(epoch, step_index, size, step_logs)
+                if self.is_aborted():
+                    print(f"Batch {batch_id} cancelled during epoch {epoch + 1}")
+                    for i, task_id in enumerate(sub_task_ids):
+                        publish_update(task_id, {'status': "CANCELLED", 'epoch': len(histories[i]), 'history': histories[i], 'batch_id': batch_id})
+                    publish_update(batch_id, {'status': "CANCELLED"})
+                    return
+
+                evaluations = {i: executor.submit(models[i].evaluate, val_generator, return_dict=True, verbose=0) for i in active}
+                for i in active:
+                    logs = {name: total / seen for name, total in totals[i].items()}
+                    logs.update({f"val_{name}": value for name, value in evaluations[i].result().items()})
+                    print(f" Batch {batch_id}, model {i}, epoch {epoch + 1}: logs={logs}")
+                    histories[i].append({'epoch': epoch + 1, 'logs': logs})
+                    publish_update(sub_task_ids[i], {'status': "PROGRESS", 'epoch': epoch + 1, 'logs': logs, 'batch_id': batch_id})
+
+            tests = [executor.submit(model.evaluate, test_generator, return_dict=True, verbose=0) for model in models]
+            results = []
+            for i, test in enumerate(tests):
+                test_logs = test.result()
+                saved = store_model(sub_task_ids[i], models[i], dataset, configs[i], test_logs['accuracy'], test_logs['loss'])
+                response = {"status": "SUCCESS", 'test_accuracy': test_logs['accuracy'], 'test_loss': test_logs['loss'],
+                            'history': histories[i], 'batch_id': batch_id, 'model_saved': saved}
+                publish_update(sub_task_ids[i], response)
+                results.append({'task_id': sub_task_ids[i], 'test_accuracy': test_logs['accuracy'], 'test_loss': test_logs['loss']})
+
+        publish_update(batch_id, {"status": "SUCCESS", 'results': results})
+    except Exception as e:
+        print(f"An error occurred during batch training.{e}")
+        for task_id in [*sub_task_ids, batch_id]:
+            publish_update(task_id, {"status": "ERROR", "message": str(e)})
+        raise
+
+# Data-parallel training of one model across 'workers' worker processes (see distributed.py). This
+# task is the coordinator and rank 0: it reserves the other ranks by sending them distributed_participant
+# tasks on its own queue, then trains its shard alongside them. Progress is published under this task's
+# id like train_model's; 'workers' is added to every update. Checkpointing and XLA aren't supported in
+# this mode.
+@celery.task(bind=True, base = CancellableTask)
+def train_model_distributed(self, layers, units, epochs, batch_size, optimizer, workers, precision="float32"):
+    group_id = self.request.id
+    try:
+        print(f"Training model with layers={layers}, units={units}, epochs={epochs}, batch_size={batch_size}, optimizer={optimizer} on {workers} workers")
+        publish_update(group_id, {'status': "RESERVING", 'workers': workers})
+        queue = (self.request.delivery_info or {}).get('routing_key') or TRAIN_QUEUE
+        for rank in range(1, workers):
+            distributed_participant.apply_async(args=(group_id, rank), queue=queue)
+        spec = dict(layers=layers, units=units, epochs=epochs, batch_size=batch_size, optimizer=optimizer, precision=precision)
+        cluster = distributed.reserve(redis_client, group_id, workers, spec, self.is_aborted)
+        if cluster is None:
+            if self.is_aborted():
+                publish_update(group_id, {'status': "CANCELLED", 'workers': workers})
+                return
+            raise RuntimeError(f"Could not reserve {workers} workers within {DISTRIBUTED_RESERVE_TIMEOUT}s")
+        print(f"Distributed task {group_id} running on {cluster}")
+        publish_update(group_id, {'status': "RESERVED", 'workers': workers, 'cluster': cluster})
+
+        exit_code = distributed.run_rank(redis_client, group_id, 0, cluster, spec, self.is_aborted)
+        if self.is_aborted():
+            print(f"Distributed task {group_id} cancelled")
+            publish_update(group_id, {'status': "CANCELLED", 'workers': workers})
+            return
+        result = distributed.read_result(redis_client, group_id)
+        if exit_code != 0 or result is None:
+            raise RuntimeError(f"Distributed training failed, exit codes by rank: {distributed.exit_codes(redis_client, group_id)}")
+        publish_update(group_id, {"status": "SUCCESS", **result})
+    except Exception as e:
+        print(f"An error occurred during distributed training.{e}")
+        distributed.abort(redis_client, group_id)
+        publish_update(group_id, {"status": "ERROR", "message": str(e)})
+        raise
+
+# One additional rank of a train_model_distributed task. Registers its address, waits for the
+# coordinator to publish the cluster and runs its training subprocess. Exits right away if the group
+# was aborted before this task got to run.
+@celery.task(bind=True)
+def distributed_participant(self, group_id, rank):
+    if distributed.is_aborted(redis_client, group_id):
+        return
+    distributed.register(redis_client, group_id, rank)
+    reserved = distributed.wait_for_cluster(redis_client, group_id)
+    if reserved is None:
+        return
+    cluster, spec = reserved
+    distributed.run_rank(redis_client, group_id, rank, cluster, spec)
+
 if __name__ == '__main__':
     setup_signal_handlers()
     celery.worker_main()
\ No newline at end of file
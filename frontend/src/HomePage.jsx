@@ -50,6 +50,9 @@ const HomePage = () => {
     const failureCountRef = useRef(0);
     const reconnectAttemptRef = useRef(0);
     const taskIDRef = useRef(null);
+    // id of the last logged training event received, so that a reconnecting websocket can ask for
+    // only the events it missed.
+    const lastEventIdRef = useRef('0');
 
     // Defining a function that checks if the backend is available.
     const checkBackendAvailability = async () => {
@@ -65,6 +68,15 @@ const HomePage = () => {
         }
     };
 
+    // Asking the backend to only send this tab the updates belonging to the given task id, so that
+    // other tabs training their own models don't show up in this one's progress. The offset makes the
+    // backend first replay every event of the task logged after the last one we received.
+    const subscribeToTask = (taskId) => {
+        if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+            wsRef.current.send(JSON.stringify({action: 'subscribe', task_id: taskId, offset: lastEventIdRef.current}));
+        }
+    };
+
     // Defining a function to connect to the websocket server. This function will be called when the
     // useEffect hook runs.
     const connect = async () => {
@@ -93,9 +105,16 @@ const HomePage = () => {
             wsRef.current = new WebSocket(`ws://localhost:5000/ws`);
             wsRef.current.onopen = () => {
                 console.log('WebSocket connection established')
+                // Re-subscribing to the current task's updates after a reconnect.
+                if (taskIDRef.current) {
+                    subscribeToTask(taskIDRef.current.data.task_id);
+                }
             }
             wsRef.current.onmessage = function(event) {
                 const data = JSON.parse(event.data);
+                if (data.event_id && taskIDRef.current && data.task_id === taskIDRef.current.data.task_id) {
+                    lastEventIdRef.current = data.event_id;
+                }
                 console.log('logging event itself first' + event)
                 console.log(data);
                 if (data.status === 'PROGRESS') {
@@ -106,6 +125,9 @@ const HomePage = () => {
                     setLoss(data.test_loss);
                     setLoading(false);
                 }
+                else if (data.status === 'CANCELLED') {
+                    setLoading(false);
+                }
                 else if (data.status === 'ERROR'){
                     setError(`Error during training: ${data.message}`)
                     setLoading(false);
@@ -249,6 +271,10 @@ const HomePage = () => {
             // The second argument to the 'post' method is the data we want to send to the server. This data
             // is an object with keys 'layers', 'units', 'epochs', 'batchSize', and 'optimizer'. The values of
             // these keys are the state variables defined above.
+            if (taskIDRef.current && wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+                wsRef.current.send(JSON.stringify({action: 'unsubscribe', task_id: taskIDRef.current.data.task_id}));
+            }
+            lastEventIdRef.current = '0';
             taskIDRef.current = await axios.post('http://localhost:5000/train', {
                 layers: inputLayers,
                 units: inputUnits,
@@ -256,6 +282,7 @@ const HomePage = () => {
                 batchSize: inputBatchSize,
                 optimizer: inputOptimizer
             });
+            subscribeToTask(taskIDRef.current.data.task_id);
         } catch (err){ // more specific than just a broad error i.e catch specific types of exceptions
             // axios exceptions
             let errorMessage = 'Failed to train model: ';